@@ -1,216 +1,179 @@
+import numpy as np
 import pandas as pd
 import re
 import os
 import gc
-import win32com.client as win32
-import tempfile
-import pythoncom
+import uuid
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-
-
-
-def main(file_path):
+from output_formats import write_temp_output, output_extension, output_mimetype, output_format_from_request, write_temp_zip, send_and_remove, DEFAULT_OUTPUT_FORMAT
+from amounts import clean_amount_columns
+from excel_reader import read_excel, chunk_rows_from_env
+from result_cache import result_cache_from_env
+from instrumentation import stage, wants_report, report_header
+from jobs import job_runner_from_env, job_summary, job_output, wants_async, process_uploads, DONE
+from metrics import install_metrics
+
+
+
+# === Legacy pattern engine ===
+# Every DESC is split into tokens, each followed by the reference-like parts found
+# in it. The pattern of a codigo group is the tokens common to all its rows, in
+# the order of its first row, and patterns shared by several codigos get the
+# codigo as a prefix.
+
+TOKEN_PARTS_RE = re.compile(r'''
+    [A-Z]*\d+[A-Z]* |
+    TX:\d+               |
+    TRJ:[^\s]+           |
+    \d{6,}               |
+    [A-Z]{2,}\d{2,}      |
+    \d+/\d+              |
+    -\d+-\d+             |
+    \d{15,}              |
+    MONTEVIDEO.*?0013
+''', re.VERBOSE | re.IGNORECASE)
+
+
+def extract_tokens(descriptions):
+    """
+    Tokens of every distinct description: each token followed by the parts the
+    TOKEN_PARTS_RE extractor finds in it, without repeats. Returns the index of
+    each row's description and the token lists of the distinct descriptions.
+    """
+    codes, distinct = pd.factorize(descriptions, use_na_sentinel=False)
+    find_parts = TOKEN_PARTS_RE.findall
+    parts_of = {}  # token -> its parts, shared by the batch
+
+    def extract(desc):
+        extracted = []
+        for token in desc.split():
+            extracted.append(token)
+            parts = parts_of.get(token)
+            if parts is None:
+                parts = parts_of[token] = find_parts(token)
+            extracted.extend(parts)
+
+        seen = set()
+        return [x for x in extracted if not (x in seen or seen.add(x))]
+
+    return codes, [extract(desc) for desc in distinct]
+
+
+def intersect_tokens(codigos, token_codes, token_lists):
+    """
+    Pattern of every row: the tokens common to all rows of its codigo, in the
+    order of the group's first row (all of the first row's tokens when none is
+    common), joined with ', '. token_lists[token_codes[i]] are the tokens of row i.
+    Groups are intersected over the whole frame, each distinct token list once.
+    """
+    codes, _ = pd.factorize(codigos)
+    if len(codes) == 0:
+        return pd.Series([], index=codigos.index, dtype=object)
+
+    # Rows of each group are contiguous after a stable sort, the first row leading
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    sorted_tokens = token_codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+
+    group_patterns = np.empty(len(starts), dtype=object)
+    for g, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        first = token_lists[sorted_tokens[start]]
+        common = set(first)
+        for other in set(sorted_tokens[start + 1:end].tolist()):
+            if not common:
+                break
+            common.intersection_update(token_lists[other])
+
+        ordered_common = [token for token in first if token in common]
+        group_patterns[g] = ', '.join(ordered_common or first)
+
+    group_of_row = np.empty(len(order), dtype=np.intp)
+    group_of_row[order] = np.repeat(np.arange(len(starts)), ends - starts)
+    return pd.Series(group_patterns[group_of_row], index=codigos.index, dtype=object)
+
+
+def prefix_duplicate_patterns(patterns, codigos):
+    """
+    Prefixes '*<codigo>*' to the patterns that are shared by several codigos.
+    """
+    pattern_codes, pattern_values = pd.factorize(patterns)
+    codigo_codes, _ = pd.factorize(codigos)
+    if len(pattern_codes) == 0:
+        return patterns
+
+    # Distinct codigos per pattern, from the distinct (pattern, codigo) pairs
+    valid = (pattern_codes >= 0) & (codigo_codes >= 0)
+    width = np.int64(codigo_codes.max() + 1)
+    pairs = np.unique(pattern_codes[valid].astype(np.int64) * width + codigo_codes[valid])
+    codigos_per_pattern = np.bincount(pairs // width, minlength=len(pattern_values))
+
+    shared = np.flatnonzero((pattern_codes >= 0) & (codigos_per_pattern[np.maximum(pattern_codes, 0)] > 1))
+    if len(shared) == 0:
+        return patterns
+
+    values = patterns.to_numpy(dtype=object).copy()
+    codigo_values = codigos.to_numpy(dtype=object)
+    values[shared] = [f"*{codigo_values[i]}*{values[i]}" for i in shared.tolist()]
+    return pd.Series(values, index=patterns.index, name=patterns.name, dtype=object)
+
+
+def main(file_path, output_format=DEFAULT_OUTPUT_FORMAT):
     try:
-        def create_pivot_table(excel_file_path):
+        def pivot_fields(headers):
             """
-            Creates a pivot table in a new sheet of the specified Excel file.
+            SummaryPivot field layout for the legacy engine: every column after the first
+            is a row field, Credito/Debito are summed as data fields and 'codigo' is a page filter.
             """
-            try:
-                pythoncom.CoInitialize()
-                excel = win32.gencache.EnsureDispatch('Excel.Application')
-                excel.Visible = False
-
-                wb = excel.Workbooks.Open(excel_file_path)
-                ws_data = wb.Sheets(1)
-                pivot_sheet = wb.Sheets.Add(After=ws_data)
-                pivot_sheet.Name = "PivotTable"
-
-                last_row = ws_data.UsedRange.Rows.Count
-                last_col = ws_data.UsedRange.Columns.Count
-
-                data_range = ws_data.Range(ws_data.Cells(1, 1), ws_data.Cells(last_row, last_col))
-
-                pivot_table_name = "SummaryPivot"
-
-                # Create the PivotTable
-                pivot_cache = wb.PivotCaches().Create(
-                    SourceType=win32.constants.xlDatabase,
-                    SourceData=data_range,
-                    Version=win32.constants.xlPivotTableVersion15
-                )
-
-                pivot_cache.CreatePivotTable(
-                    TableDestination=pivot_sheet.Cells(1, 1),
-                    TableName=pivot_table_name,
-                    DefaultVersion=win32.constants.xlPivotTableVersion15
-                )
-
-                pivot_table = pivot_sheet.PivotTables(pivot_table_name)
-
-                headers = [ws_data.Cells(1, i).Value for i in range(2, last_col + 1)]
-
-                # Add all fields as RowFields and disable their subtotals
-                for header in headers:
-                    if header not in ['codigo', 'credito', 'debito']:
-                        try:
-                            pf = pivot_table.PivotFields(header)
-                            pf.Orientation = win32.constants.xlRowField
-                            pf.Subtotals = [False] * 12  # Disable all subtotals
-                        except:
-                            pass
-
-                # Add 'Credito' and 'Debito' as DataFields if present, using their original names
-                for field in ['Credito', 'Debito']:
-                    if field in headers:
-                        try:
-                            pf = pivot_table.PivotFields(field)
-                            pf.Orientation = win32.constants.xlDataField
-                            pf.Function = win32.constants.xlSum
-                            pf.Name = field  # Use original column name, not "Sum of ..."
-                        except Exception as e:
-                            print(f"⚠️ Could not add DataField '{field}': {e}")
-
-                # Hide the default "Data" column if only one data field is present
-                if pivot_table.DataFields.Count == 1:
-                    try:
-                        pivot_table.PivotFields("Data").Orientation = win32.constants.xlHidden
-                    except Exception:
-                        pass
-
-                # Add filter for 'codigo'
-                if 'codigo' in headers:
-                    try:
-                        pivot_table.PivotFields("codigo").Orientation = win32.constants.xlPageField
-                    except Exception as e:
-                        print(f"⚠️ Could not add PageField 'codigo': {e}")
-
-                # Apply tabular layout and remove grand totals for rows/columns
-                try:
-                    pivot_table.RowAxisLayout(win32.constants.xlTabularRow)
-                    pivot_table.ColumnGrandTotals = False
-                    pivot_table.RowGrandTotals = False
-                except Exception as e:
-                    print(f"⚠️ Layout customization failed: {e}")
-
-                # Autofit columns for visibility
-                pivot_sheet.Columns.AutoFit()
-
-                wb.Save()
-                wb.Close()
-                excel.Quit()
-                print("📊 Pivot table generated, subtotals disabled, tabular layout applied.")
-            except Exception as e:
-                print(f"❌ An error occurred during pivot table creation: {e}")
+            headers = list(headers)[1:]
+            return {
+                "rows": [h for h in headers if h not in ['codigo', 'credito', 'debito']],
+                "repeat_labels": [],
+                "data": [f for f in ['Credito', 'Debito'] if f in headers],
+                "pages": ['codigo'] if 'codigo' in headers else [],
+            }
 
         # === Step 1: Load and sort Excel file ===
         input_path = file_path
         try:
-            df = pd.read_excel(input_path, dtype=str).fillna('')
+            df = read_excel(input_path, chunk_rows_from_env())
         except FileNotFoundError:
             print(f"❌ Error: The file at {input_path} was not found.")
             exit()
 
         df = df.sort_values(by='codigo').reset_index(drop=True)
 
-        # === Step 2: Token extraction from DESC ===
-        def extract_tokens(desc):
-            """
-            Extracts specific patterns and tokens from a description string.
-            """
-            tokens = desc.split()
-            extracted = []
-
-            for token in tokens:
-                extracted.append(token)
-                patterns = re.findall(r'''
-                    [A-Z]*\d+[A-Z]* |
-                    TX:\d+               |
-                    TRJ:[^\s]+           |
-                    \d{6,}               |
-                    [A-Z]{2,}\d{2,}      |
-                    \d+/\d+              |
-                    -\d+-\d+             |
-                    \d{15,}              |
-                    MONTEVIDEO.*?0013
-                ''', token, re.VERBOSE | re.IGNORECASE)
-                extracted.extend(patterns)
-
-            seen = set()
-            return [x for x in extracted if not (x in seen or seen.add(x))]
-
-        df['__pattern_tokens'] = df['DESC'].apply(extract_tokens)
-
-        # === Step 3: Pattern generation per codigo group ===
-        def intersect_tokens(group):
-            """
-            Finds the intersection of tokens within a group.
-            """
-            all_tokens = group['__pattern_tokens'].tolist()
-            if not all_tokens:
-                return group.assign(Pattren='')
-
-            common = set(all_tokens[0])
-            for token_list in all_tokens[1:]:
-                common &= set(token_list)
+        # === Steps 2-5: Tokens of each DESC, intersected per codigo group ===
+        # Rows without a codigo are left out, as groupby did
+        df = df[df['codigo'].notna()].reset_index(drop=True)
 
-            ordered_common = [token for token in all_tokens[0] if token in common]
-            if not ordered_common:
-                ordered_common = all_tokens[0]
+        with stage("tokenize", df):
+            token_codes, token_lists = extract_tokens(df['DESC'])
 
-            pattern_str = ', '.join(ordered_common)
-            return group.assign(Pattren=pattern_str)
-
-        # === Step 4: Batch-wise processing ===
-        batch_size = 100
-        result_batches = []
-        for i in range(0, len(df), batch_size):
-            batch = df.iloc[i:i+batch_size].copy()
-            processed = batch.groupby('codigo', group_keys=False).apply(intersect_tokens)
-            result_batches.append(processed)
-
-        # === Step 5: Combine all batches ===
-        final_df = pd.concat(result_batches).reset_index(drop=True)
+        final_df = df
+        with stage("intersect_tokens", final_df):
+            final_df['Pattren'] = intersect_tokens(final_df['codigo'], token_codes, token_lists)
 
         # === Step 6: Fix duplicate patterns across different codigos ===
-        pattern_map = final_df.groupby('Pattren')['codigo'].nunique()
-        duplicate_patterns = pattern_map[pattern_map > 1].index
-
-        def prefix_if_duplicate(row):
-            """
-            Adds a code prefix to patterns that are shared by multiple 'codigo' values.
-            """
-            if row['Pattren'] in duplicate_patterns:
-                return f"*{row['codigo']}*{row['Pattren']}"
-            return row['Pattren']
-
-        final_df['Pattren'] = final_df.apply(prefix_if_duplicate, axis=1)
+        with stage("prefix_duplicates", final_df):
+            final_df['Pattren'] = prefix_duplicate_patterns(final_df['Pattren'], final_df['codigo'])
 
         # === Step 7: Save final output to a temporary file ===
-        final_df.drop(columns='__pattern_tokens', inplace=True)
-
         # Clean 'Credito' and 'Debito' columns
-        for col in ['Credito', 'Debito']:
-            final_df[col] = pd.to_numeric(
-                final_df[col].astype(str).str.replace(r'[^\d\.\-]', '', regex=True),
-                errors='coerce'
-            ).fillna(0)
+        with stage("clean_amounts", final_df):
+            clean_amount_columns(final_df, ['Credito', 'Debito'])
 
         # Create a temporary file to store the processed data
-        temp_file = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
-        output_path = temp_file.name
-        final_df.to_excel(output_path, index=False)
-        temp_file.close()
+        # For xlsx the pivot table is written together with the data sheet
+        output_path = write_temp_output(final_df, output_format, pivot_fields)
 
         print(f"✅ Output saved to temporary file: {output_path}")
         del final_df
         gc.collect()
 
-        # === Step 8: Generate Pivot Table ===
-        # The pivot table creation must happen after the file is saved and closed.
-        # The `create_pivot_table` function opens, modifies, and saves the file.
-        create_pivot_table(output_path)
         # Save the final output to the specified path
         return output_path
 
@@ -228,6 +191,20 @@ app = Flask(__name__)
 # Added "http://localhost:3000" to the allowed origins
 CORS(app, origins=["http://127.0.0.1:5000", "http://localhost:5173", "http://localhost:3000"])
 
+# Repeat uploads of the same file are answered from the on-disk result cache
+RESULT_CACHE = result_cache_from_env(namespace="api")
+
+# Uploads sent with async=1 (or 'Prefer: respond-async') run as background jobs;
+# their outputs are added to the result cache when the job finishes
+JOB_RUNNER = job_runner_from_env(
+    main,
+    on_output=lambda outputs, output_format, cache_keys: RESULT_CACHE.put_many(
+        cache_keys, outputs, output_extension(output_format)),
+)
+
+# Request, pipeline, cache and job metrics, scraped from GET /metrics
+METRICS = install_metrics(app, RESULT_CACHE, JOB_RUNNER)
+
 
 @app.route('/excel_filter', methods=['POST'])
 def excel_filter():
@@ -238,50 +215,112 @@ def excel_filter():
 
         # Collect all uploaded Excel files
         excel_files = []
+        upload_names = []
         for key in request.files:
             if key.startswith("excel_file_"):
                 file = request.files[key]
                 filename = secure_filename(file.filename)
-                temp_path = os.path.join("temp", filename)
+                # Prefixed so that uploads with the same name do not overwrite each other
+                temp_path = os.path.join("temp", f"{uuid.uuid4().hex[:8]}_{filename}")
                 os.makedirs("temp", exist_ok=True)
                 file.save(temp_path)
                 excel_files.append(temp_path)
+                upload_names.append(filename)
 
         if not excel_files:
             return jsonify({"error": "No Excel files uploaded"}), 400
+
+        # Output format from the 'format' parameter or the Accept header (default xlsx)
+        try:
+            output_format = output_format_from_request(request)
+        except ValueError as e:
+            for file_path in excel_files:
+                os.remove(file_path)
+            return jsonify({"error": str(e)}), 400
+
+        # Job mode: queue the files and answer right away with the job id
+        if wants_async(request):
+            cache_keys = [RESULT_CACHE.key_for(file_path, output_format) if RESULT_CACHE.enabled else None
+                          for file_path in excel_files]
+            job_id = JOB_RUNNER.submit(excel_files, output_format, context=cache_keys)
+            print(f"Queued {len(excel_files)} Excel files as job {job_id}")
+            return jsonify(job_summary(JOB_RUNNER.status(job_id))), 202
         
         print(f"Processing {len(excel_files)} Excel files...")
-        
-        # Process each uploaded file
-        processed_file_paths = []
 
+        # Process the uploaded files: cache hits first, the rest concurrently in the worker pool
+        results = process_uploads(JOB_RUNNER, RESULT_CACHE, excel_files, output_format, upload_names)
 
-        
+        # Clean up the original uploaded temporary files
         for file_path in excel_files:
-            output_path = main(file_path)
-            if output_path and os.path.exists(output_path):
-                processed_file_paths.append(output_path)
-            # Clean up the original uploaded temporary file
             os.remove(file_path)
 
-        if not processed_file_paths:
+        processed = [result for result in results if result["output"]]
+        if not processed:
+            errors = {result["file"]: result["error"] for result in results if result["error"]}
+            if errors:
+                return jsonify({"error": "Processing failed", "files": errors}), 500
             return jsonify({"message": "No patterns were identified in any of the uploaded files."}), 200
 
-        # For simplicity, if multiple files are uploaded, we'll return the first processed one.
-        # You might want to combine them or return a zip file if more complex handling is needed.
-        # Here, we'll return the first processed file found.
-        output_file_to_send = processed_file_paths[0]
-        
-        # Clean up other processed files if only one is sent back (optional, depends on use case)
-        for i, path in enumerate(processed_file_paths):
-            if i != 0:
-                os.remove(path)
-                
-        return send_file(output_file_to_send, as_attachment=True, download_name=os.path.basename(output_file_to_send))
+        # The outputs are removed once the response has been sent
+        if len(results) == 1:
+            output_file_to_send = processed[0]["output"]
+            response = send_and_remove(output_file_to_send, os.path.basename(output_file_to_send),
+                                       output_mimetype(output_format))
+            response.headers["X-Cache"] = processed[0]["cache"]
+        else:
+            # Several files: every output goes back in one zip, with a manifest of per-file results
+            output_file_to_send = write_temp_zip(results, output_format)
+            response = send_and_remove(output_file_to_send, "excel_filter_results.zip", "application/zip",
+                                       [result["output"] for result in processed])
+            response.headers["X-Cache"] = ",".join(result["cache"] for result in results)
+
+        # Seconds and rows per file on request ('report=1' or an 'X-Pipeline-Report: 1'
+        # header); the full stage reports are in the zip manifest
+        if wants_report(request):
+            summary = report_header([result["report"] for result in results])
+            if summary is not None:
+                response.headers["X-Pipeline-Report"] = summary
+        return response
 
     except Exception as e:
         print(f"Error during processing: {e}")
         return jsonify({"error": str(e)}), 500
 
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = JOB_RUNNER.status(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job_summary(job))
+
+
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def job_download(job_id):
+    job = JOB_RUNNER.status(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    if job["status"] != DONE:
+        return jsonify(job_summary(job)), 409
+
+    # Like the synchronous endpoint, the first file is sent unless another is asked for;
+    # index counts the uploaded files, including those that produced no output
+    try:
+        index = int(request.args.get("index", 0))
+    except ValueError:
+        index = -1
+    output_path, error = job_output(job, index)
+    if output_path is None:
+        if error:
+            return jsonify({"error": f"File {index} of job {job_id} has no output: {error}", "index": index}), 404
+        return jsonify({"error": f"Job {job_id} has {len(job['outputs'])} input file(s)"}), 404
+    return send_file(output_path, as_attachment=True, download_name=os.path.basename(output_path),
+                     mimetype=output_mimetype(job["output_format"]))
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(RESULT_CACHE.stats())
+
 if __name__ == '__main__':
     app.run(debug=True) # Run Flask app in debug mode for development
@@ -1,329 +1,44 @@
 import pandas as pd
-import re
 import os
 import gc
-import win32com.client as win32
-import tempfile
-import pythoncom
-# from difflib import SequenceMatcher
+from collections import Counter
+from functools import partial
+import uuid
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import shutil
-
-def create_pivot_table(excel_file_path):
+from pattern_stages import description_patterns, fill_pattern_with_referencia, replace_with_common_patterns
+from xlsx_writer import summary_pivot_fields
+from output_formats import write_temp_output, write_temp_output_chunks, output_extension, output_mimetype, output_format_from_request, write_temp_zip, send_and_remove, DEFAULT_OUTPUT_FORMAT
+from excel_reader import read_excel, iter_excel_chunks, combine_chunks, chunk_rows_from_env
+from batch_runner import run_folder
+from sharding import run_sharded
+from pattern_clusters import add_pattern_clusters, pattern_clusters_from_env
+from pattern_index import install_pattern_index, pattern_index_enabled, keep_for_index, SEARCH_MODES, DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from external_sort import ExternalSorter, memory_budget_from_env, spill_dir_from_env
+from amounts import clean_amount_columns, infer_amount_decimal, amount_decimal_votes, decimal_from_votes, amount_decimal_from_env, AMOUNT_COLUMNS
+from frame_dtypes import compact_frames_from_env, compact_frame, compact_text
+from schemas import sniff_schema, detect_schema, expected_layouts, UnknownSchemaError
+from instrumentation import stage, instrumented, wants_report, report_header, report_mode, report_warning
+from result_cache import result_cache_from_env
+from jobs import job_runner_from_env, job_summary, job_output, wants_async, process_uploads, DONE
+from metrics import install_metrics
+
+def process_excel_file(df, decimal=None):
     try:
-        pythoncom.CoInitialize()
-        excel = win32.gencache.EnsureDispatch('Excel.Application')
-        excel.Visible = False
-
-        wb = excel.Workbooks.Open(excel_file_path)
-        ws_data = wb.Sheets(1)
-        pivot_sheet = wb.Sheets.Add(After=ws_data)
-        pivot_sheet.Name = "PivotTable"
-
-        last_row = ws_data.UsedRange.Rows.Count
-        last_col = ws_data.UsedRange.Columns.Count
-        data_range = ws_data.Range(ws_data.Cells(1, 1), ws_data.Cells(last_row, last_col))
-        pivot_table_name = "SummaryPivot"
-
-        pivot_cache = wb.PivotCaches().Create(
-            SourceType=win32.constants.xlDatabase,
-            SourceData=data_range,
-            Version=win32.constants.xlPivotTableVersion15
-        )
-
-        pivot_cache.CreatePivotTable(
-            TableDestination=pivot_sheet.Cells(1, 1),
-            TableName=pivot_table_name,
-            DefaultVersion=win32.constants.xlPivotTableVersion15
-        )
-
-        pivot_table = pivot_sheet.PivotTables(pivot_table_name)
-        headers = [ws_data.Cells(1, i).Value for i in range(1, last_col + 1)]
-
-        # --- Select first column (priority: codigo > Pattern > first header) ---
-        if "codigo" in headers:
-            first_field = "codigo"
-        elif "Pattren" in headers:
-            first_field = "Pattren"
-        else:
-            first_field = headers[0]
-
-        # --- Force first_field into column A ---
-        try:
-            pf = pivot_table.PivotFields(first_field)
-            pf.Orientation = win32.constants.xlRowField
-            pf.Position = 1
-            pf.Subtotals = [False] * 12
-
-            # ✅ Field setting: Repeat item labels (same as UI option)
-            pf.LayoutForm = win32.constants.xlTabularRow
-            pf.RepeatLabels = True  
-
-            print(f"✅ Using '{first_field}' as first row field with repeat labels")
-        except Exception as e:
-            print(f"⚠️ Could not set '{first_field}' as first RowField: {e}")
-
-        # --- Add other row fields (skip first_field, credito, debito) ---
-        for header in headers:
-            if header not in [first_field, 'credito', 'debito']:
-                try:
-                    pf = pivot_table.PivotFields(header)
-                    pf.Orientation = win32.constants.xlRowField
-                    pf.Subtotals = [False] * 12
-                except:
-                    pass
-
-        for header in headers:
-            if header not in [first_field, 'Crédito', 'Débito']:
-                try:
-                    pf = pivot_table.PivotFields(header)
-                    pf.Orientation = win32.constants.xlRowField
-                    pf.Subtotals = [False] * 12
-                except:
-                    pass
-
-        # # --- Add DataFields for Credito/Debito ---
-        # for field in ['Credito', 'Debito', 'Crédito', 'Débito']:
-        #     if field in headers:
-        #         try:
-        #             pf = pivot_table.PivotFields(field)
-        #             pf.Orientation = win32.constants.xlDataField
-        #             pf.Function = win32.constants.xlSum
-        #             pf.Name = field
-        #         except Exception as e:
-        #             print(f"⚠️ Could not add DataField '{field}': {e}")
-
-        if pivot_table.DataFields.Count == 1:
-            try:
-                pivot_table.PivotFields("Data").Orientation = win32.constants.xlHidden
-            except Exception:
-                pass
-        # --- Layout settings ---
-        try:
-            pivot_table.RowAxisLayout(win32.constants.xlTabularRow)
-            pivot_table.ColumnGrandTotals = False
-            pivot_table.RowGrandTotals = False
-        except Exception as e:
-            print(f"⚠️ Layout customization failed: {e}")
-
-        pivot_sheet.Columns.AutoFit()
-
-        wb.Save()
-        wb.Close()
-        excel.Quit()
-        print("📊 Pivot table generated successfully.")
-
-    except Exception as e:
-        print(f"❌ Pivot table creation failed: {e}")
-
-
-
-
-
-def process_excel_file(df):
-    try:
-        # === Function: Create Pivot Table ===
-      # === Step 2: Token extraction (row-wise, skip 'codigo'-related tokens) ===
-        def extract_tokens(desc, codigo):
-            tokens = desc.split()
-            seen = set()
-            return [x for x in tokens if not (x in seen or seen.add(x))]
-
-        df['__pattern_tokens'] = df.apply(lambda row: extract_tokens(row['DESC'], row['codigo']), axis=1)
-        df['Pattren'] = df['__pattern_tokens'].apply(lambda tokens: ' '.join(tokens))
-
-        def extract_special_pattern(pattern):
-            # Match: start digits (before -), then **, then keep 2/xxxxxx
-            match = re.search(r'^(\d+)-[^ ]+\s+TX:\d+\s+(2/\d+)', pattern)
-            if match:
-                return f"{match.group(1)}**{match.group(2)}"
-            return pattern  # keep unchanged if not matched
-
-        def drop_first_pattern(pattern):
-            pattern = str(pattern).strip()
-            parts = pattern.split()
-
-            removed_info = []
-            filtered = []
-
-            for part in parts:
-                if part.startswith("/"):  # <-- only keep if it starts with "/"
-                    filtered.append(part)
-                    continue
-                # Rule 1: first 6+ digits followed by 2+ letters (e.g., 837841TT)
-                if len(part) >= 8 and part[:6].isdigit() and part[6:].isalpha() and len(part[6:]) >= 2:
-                    removed_info.append((part, "Rule: 6+ digits followed by 2+ letters"))
-                    continue
-
-                # Rule 2: starts with TX: and only digits after
-                if part.startswith("TX:") and part[3:].isdigit():
-                    removed_info.append((part, "Rule: TX: + digits"))
-                    continue
-
-                # Rule 3: 6+ digits + LR: + digits
-                if part[:6].isdigit() and part[6:].startswith("LR:") and part[9:].isdigit():
-                    removed_info.append((part, "Rule: 6+ digits + LR: + digits"))
-                    continue
-
-                # Rule 4: 6+ digits + LR: + 12+ digits
-                if part[:6].isdigit() and part[6:].startswith("LR:") and part[9:].isdigit() and len(part[9:]) >= 12:
-                    removed_info.append((part, "Rule: 6+ digits + LR: + 12+ digits"))
-                    continue
-
-                # Rule 5: 6+ digits + LR: + alphanumeric
-                if part[:6].isdigit() and part[6:].startswith("LR:") and part[9:].isalnum():
-                    removed_info.append((part, "Rule: 6+ digits + LR: + alphanumeric"))
-                    continue
-
-                # Rule 6: TRJ:**-digit-digit
-                if part.startswith("TRJ:**-") and re.match(r"^TRJ:\*\*-\d-\d+$", part):
-                    removed_info.append((part, "Rule: TRJ:**-X-X"))
-                    continue
-
-                # Rule 7: TRJ:..-digit-digit
-                if part.startswith("TRJ:..-") and re.match(r"^TRJ:\.\.-\d-\d+$", part):
-                    removed_info.append((part, "Rule: TRJ:..-X-X"))
-                    continue
-
-                # Rule 8: 1–2 letters + 2+ digits + 2+ letters + 2+ digits (e.g., S15BUZ612)
-                if re.match(r"^[A-Z]{1,2}\d{2,}[A-Z]{2,}\d{2,}$", part):
-                    removed_info.append((part, "Rule: 1–2 letters, digits, 2+ letters, 2+ digits"))
-                    continue
-
-                if re.match(r"RECIBIDA", part):
-                    removed_info.append((part, "Rule: RECIBIDA"))
-                    continue
-
-                if re.match(r"Trf.", part):
-                    removed_info.append((part, "Rule: Trf."))
-                    continue
-
-                # Rule 9: 6+ digits + LR:SPI-PREX + digits
-                if part[:6].isdigit() and part[6:].startswith("LR:SPI-PREX") and part[16:].isdigit():
-                    removed_info.append((part, "Rule: 6+ digits + LR:SPI-PREX + digits"))
-                    continue
-
-                if re.match(r"^\d{6}[A-Z]{2}\d+$", part):
-                    removed_info.append((part, "Rule: 6 digits + 2 uppercase letters + more digits"))
-                    continue
-
-                # If no rules matched → keep
-                filtered.append(part)
-
-
-            return ' '.join(filtered)
-
-
-        def fill_pattern_with_referencia(df):
-            def mask_last_pattern_if_long_number(df):
-                def mask_pattern(pattern_str):
-                    # Split into parts
-                    patterns = pattern_str.split()
-                    if not patterns:
-                        return pattern_str
-                    
-                    # 1️⃣ Mask last part if it contains a long number (10+ digits)
-                    last = patterns[-1]
-                    digits = re.findall(r'\d+', last)
-                    if digits and len(digits[-1]) >= 10:
-                        masked = '**' + digits[-1][-4:]
-                        patterns[-1] = re.sub(r'\d{7,}', masked, last)
-
-                    # Join back into string
-                    # result = ', '.join(patterns)
-                    result = ' '.join(patterns)
-
-                    # 2️⃣ Replace any special character repeated more than 5 times with "**"
-                    result = re.sub(r'([^A-Za-z0-9\s])\1{4,}', '**', result)
-
-                    return result
-
-                df['Pattren'] = df['Pattren'].apply(mask_pattern)
-
-            mask_last_pattern_if_long_number(df)
-
-
-
-
-            def should_replace(pattern):
-                pattern = pattern.split()    
-                # print(f"Checking pattern: '{len(pattern)}'")
-                # Empty pattern
-        # If pattern has a single token
-                if len(pattern) == 1:
-                    token = pattern[0]
-                    if token.isdigit() and len(token) <= 3:
-                        return True
-                    if token.isalpha() and len(token) <= 3:
-                        return True
-                    if ',' not in token and len(token) <= 3:
-                        return True
-                    if not token.strip():
-                        return True
-                if len(pattern) < 1:
-                    return True
-                
-            mask_last_pattern_if_long_number(df)    
-
-            for idx, row in df.iterrows():
-                pattern = str(row.get('Pattren', '')).strip()
-                referencia = str(row.get('Referencia', '')).strip()
-                if should_replace(pattern) and referencia:
-                    # Split referencia by space and join with comma
-                    referencia_patterns = ' '.join(referencia.split())
-                    df.at[idx, 'Pattren'] = referencia_patterns
-                elif pattern:
-                    df.at[idx, 'Pattren'] = pattern
-
-
-        def replace_with_common_patterns(df, codigo_col='codigo', pattern_col='Pattren'):
-            """
-            For each codigo group:
-            - Find words common to all rows in the group's pattern
-            - If there are >= 2 common words, replace the pattern with only those words
-            """
-            df = df.copy()
-
-            for codigo, group in df.groupby(codigo_col):
-                # Split patterns into sets of words
-                split_patterns = [set(str(p).split()) for p in group[pattern_col]]
-
-                if not split_patterns:
-                    continue
-
-                # Find intersection
-                common_words = set.intersection(*split_patterns)
-
-                # If >= 2 common words, replace each pattern with them (in order from first row)
-                if len(common_words) >= 2:
-                    first_pattern_words = str(group.iloc[0][pattern_col]).split()
-                    ordered_common = [w for w in first_pattern_words if w in common_words]
-
-                    for idx in group.index:
-                        df.at[idx, pattern_col] = ' '.join(ordered_common)
-
-            return df
-
-
+        # === Step 2: Patterns from the descriptions ===
+        # Tokens without repeats, special TX pattern, reference tokens dropped and
+        # long numbers masked, computed once per distinct description
+        df['Pattren'] = description_patterns(df['DESC'])
 
         # === Step 3: Clean numeric fields ===
-        for possible_col in [['Credito', 'Crédito'], ['Debito', 'Débito']]:
-            # Find which column name actually exists in the dataframe
-            col = next((c for c in possible_col if c in df.columns), None)
-            if col:
-                df[col] = pd.to_numeric(
-                    df[col].astype(str).str.replace(r'[^\d\.\-]', '', regex=True),
-                    errors='coerce'
-                ).fillna(0)
-
-        # === Step 4: Save intermediate output to temporary file ===
-        df['Pattren'] = df['Pattren'].apply(extract_special_pattern)
-        df['Pattren'] = df['Pattren'].apply(drop_first_pattern)
-        fill_pattern_with_referencia(df)
-
-        df.drop(columns='__pattern_tokens', inplace=True)
+        with stage("clean_amounts", df):
+            # Amounts in either separator convention, ambiguous ones read with the
+            # statement's decimal separator; unparseable cells become 0
+            clean_amount_columns(df, decimal=decimal)
+
+        # === Step 4: Referencia fallback and common patterns per codigo ===
+        fill_pattern_with_referencia(df, mask=False)
         df = replace_with_common_patterns(df, codigo_col='codigo', pattern_col='Pattren')
 
         return df
@@ -333,111 +48,78 @@ def process_excel_file(df):
         exit()
 
 
-def Pre_Processing(df):
+def Pre_Processing(df, output_format=DEFAULT_OUTPUT_FORMAT, schema=None, decimal=None):
+    """
+    Runs the pipeline on a statement in one of the SCHEMAS layouts (detected from
+    the columns when schema is not given) and writes the result to a temporary file.
+    The amounts' decimal separator is inferred from the whole statement unless given.
+    With compact frames on, codigo and the patterns are categoricals and the text
+    columns Arrow-backed strings until the output is written.
+    """
+    schema = schema or detect_schema(df.columns)
+    if schema is None:
+        raise UnknownSchemaError(
+            f"The columns do not match any known statement layout (expected one of: {expected_layouts()})")
     try:
-        columns_name = df.columns.tolist()
-        required_columns1 = {"Fecha", "Concepto", "Referencia"}
-        required_columns2 = {"Fecha valor", "Concepto", "Referencia"}
-        required_columns3 = {"Número de documento", "Asunto", "Dependencia"}
-
-#       # Check if the required columns are present in the DataFrame
-        if required_columns1.issubset(columns_name):
-            rename_map = {
-                "Fecha": "codigo",
-                "Concepto": "DESC",
-                "Referencia": "Referencia"
-            }
-            df.rename(columns=rename_map, inplace=True)
-            df = df.sort_values(by='codigo').reset_index(drop=True)
-            df = process_excel_file(df)
-            rename_map1 = {
-                "codigo": "Fecha",
-                "DESC": "Concepto",
-                "Referencia": "Referencia"
-            }
-            df.rename(columns=rename_map1, inplace=True)
-            df = remove_empty_columns(df)
-            temp_file = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
-            output_path = temp_file.name
-            df.to_excel(output_path, index=False)
-            temp_file.close()
-            print(f"✅ Output saved to temporary file: {output_path}")
-            create_pivot_table(output_path)            
-            return output_path
-    
+        decimal = decimal or infer_amount_decimal(df)
+        df = df.rename(columns=schema.to_pipeline)
+        if compact_frames_from_env():
+            df = compact_frame(df)
+        # Stable, as out of core: rows of a codigo group keep their order in the file
+        df = df.sort_values(by='codigo', kind='stable').reset_index(drop=True)
+        df = run_sharded(partial(process_excel_file, decimal=decimal), df, key='codigo')
+        # Near-duplicate patterns across codigo groups, over the whole file
+        clusters, threshold = pattern_clusters_from_env()
+        if clusters:
+            df = add_pattern_clusters(df, threshold=threshold)
+        df.rename(columns=schema.from_pipeline, inplace=True)
+        df = remove_empty_columns(df)
+        output_path = write_temp_output(df, output_format, summary_pivot_fields)
+        print(f"✅ Output saved to temporary file: {output_path}")
+        keep_for_index(df)
+        return output_path
 
-#       # Check if the required columns are present in the DataFrame
-        elif required_columns2.issubset(columns_name):
-            rename_map = {
-                "Fecha valor": "codigo",
-                "Concepto": "DESC",
-                "Referencia": "Referencia"
-            }
-            df.rename(columns=rename_map, inplace=True)
-            df = df.sort_values(by='codigo').reset_index(drop=True)
-            df = process_excel_file(df)
-            rename_map1 = {
-                "codigo": "Fecha valor",
-                "DESC": "Concepto",
-                "Referencia": "Referencia"
-            }
-            df.rename(columns=rename_map1, inplace=True)
-            df = remove_empty_columns(df)
-            temp_file = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
-            output_path = temp_file.name
-            df.to_excel(output_path, index=False)
-            temp_file.close()
-            print(f"✅ Output saved to temporary file: {output_path}")
-            create_pivot_table(output_path)            
-            return output_path
-
-#       # Check if the required columns are present in the DataFrame
-        elif required_columns3.issubset(columns_name):
-            rename_map = {
-                "Número de documento": "codigo",
-                "Asunto": "DESC",
-                "Dependencia": "Referencia"
-            }
-            df.rename(columns=rename_map, inplace=True)
-            df = df.sort_values(by='codigo').reset_index(drop=True)
-            df = process_excel_file(df)
-            rename_map1 = {
-                "codigo": "Número de documento",
-                "DESC": "Asunto",
-                "Referencia": "Dependencia"
-            }
-            df.rename(columns=rename_map1, inplace=True)
-            df = remove_empty_columns(df)
-            temp_file = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
-            output_path = temp_file.name
-            df.to_excel(output_path, index=False)
-            temp_file.close()
-            print(f"✅ Output saved to temporary file: {output_path}")
-            create_pivot_table(output_path)            
-            return output_path
-        else:
-            df = df.sort_values(by='codigo').reset_index(drop=True)
-            df = process_excel_file(df)
-            rename_map = {
-                            "codigo": "codigo",
-                            "DESC": "DESC",
-                            "Referencia": "Referencia"
-                        }
-            df.rename(columns=rename_map, inplace=True)
-            df = remove_empty_columns(df)
-            temp_file = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
-            output_path = temp_file.name
-            df.to_excel(output_path, index=False)
-            temp_file.close()
-            print(f"✅ Output saved to temporary file: {output_path}")
-            create_pivot_table(output_path)
-            return output_path
+    except Exception as e:
+        print(f"❌ Error loading file: {e}")
+        exit()
+
+def Pre_Processing_out_of_core(sorter, schema, output_format=DEFAULT_OUTPUT_FORMAT, decimal='.'):
+    """
+    Pre_Processing for a statement spilled to disk by an ExternalSorter: blocks
+    of whole codigo groups are merged back from the sorted runs, processed and
+    appended to the output one at a time. Rows of a codigo group keep their
+    order in the file. Columns blank throughout the input are dropped, as
+    remove_empty_columns does; the amount columns are kept, cleaning fills them.
+    decimal is the statement's decimal separator, voted over all of its chunks.
+    """
+    report_mode("out_of_core")
+    if pattern_clusters_from_env()[0]:
+        report_warning("Pattern clusters need the whole file and are not added out of core")
+    if pattern_index_enabled():
+        report_warning("The pattern search index needs the whole result and is not built out of core")
+    amount_names = {name for names in AMOUNT_COLUMNS for name in names}
+    blank = [col for col in sorter.blank_columns() if col not in amount_names]
+
+    def blocks():
+        for block in sorter.groups():
+            block = block.rename(columns=schema.to_pipeline)
+            if compact_frames_from_env():
+                block = compact_frame(block)
+            block = run_sharded(partial(process_excel_file, decimal=decimal), block, key='codigo')
+            block.rename(columns=schema.from_pipeline, inplace=True)
+            yield block.drop(columns=blank)
 
+    try:
+        output_path = write_temp_output_chunks(blocks(), output_format, summary_pivot_fields)
+        print(f"✅ Output saved to temporary file: {output_path} ({sorter.rows} rows, {len(sorter.runs)} runs)")
+        return output_path
 
     except Exception as e:
         print(f"❌ Error loading file: {e}")
         exit()
 
+
+@instrumented("remove_empty_columns")
 def remove_empty_columns(df):
     """
     Removes columns from the DataFrame that are entirely empty (all values are NaN or '').
@@ -445,69 +127,59 @@ def remove_empty_columns(df):
     # Drop columns with all NaN
     df = df.dropna(axis=1, how='all')
     
-    # Drop columns with all empty strings after stripping spaces
-    df = df.loc[:, ~(df.apply(lambda col: col.astype(str).str.strip() == '').all())]
+    # Drop columns with all empty strings after stripping spaces, checked on the
+    # distinct values of each column
+    blank = [(pd.Series(df.iloc[:, j].unique(), dtype=object).astype(str).str.strip() == '').all()
+             for j in range(df.shape[1])]
+    df = df.loc[:, [not b for b in blank]]
     
     return df
 
 
-def process_all_excels_in_folder(input_folder, output_folder):
-    # Ensure output folder exists
-    os.makedirs(output_folder, exist_ok=True)
-
-    # Loop through all Excel files in the folder
-    for file_name in os.listdir(input_folder):
-        if file_name.lower().endswith(('.xlsx', '.xls')):
-            input_path = os.path.join(input_folder, file_name)
-            print(f"📂 Processing file: {input_path}")
-
-            try:
-                df = pd.read_excel(input_path, dtype=str).fillna('')
-            except Exception as e:
-                print(f"❌ Error reading {file_name}: {e}")
-                continue  # Skip this file and move to next
-
-            # Call your Pre_Processing function
-            output_path = Pre_Processing(df)  # This returns a temporary output file path
-
-            # Save with same name to output folder
-            final_output_path = os.path.join(output_folder, file_name)
-            try:
-                os.replace(output_path, final_output_path)
-                print(f"✅ Final output saved: {final_output_path}")
-            except Exception as e:
-                print(f"❌ Error saving {final_output_path}: {e}")
-
-            # Remove temporary file if it still exists
-            if os.path.exists(output_path):
-                try:
-                    os.remove(output_path)
-                    print(f"🗑️ Temporary file deleted: {output_path}")
-                except OSError as e:
-                    print(f"❌ Error deleting temporary file {output_path}: {e}")
-            else:
-                print(f"ℹ️ Temporary file already moved or deleted: {output_path}")
-
-    output = output_folder
+def process_file(input_path, output_format=DEFAULT_OUTPUT_FORMAT, chunk_rows=None):
+    """
+    Reads one workbook and runs Pre_Processing on it. Returns the temporary output path.
+    The schema is detected from the header row first, so a file of an unknown
+    layout is rejected before it is loaded, and only the schema's columns are read.
+    With a memory budget set (SANDRA_MEMORY_BUDGET_MB), a statement past it runs out of core.
+    """
+    schema, header = sniff_schema(input_path)
+    on_chunk = compact_text if compact_frames_from_env() else None
+    chunk_rows = chunk_rows or chunk_rows_from_env()
+    budget = memory_budget_from_env()
+    if not budget:
+        df = read_excel(input_path, chunk_rows, on_chunk=on_chunk, usecols=schema.usecols(header))
+        return Pre_Processing(df, output_format, schema)
+
+    # A statement that outgrows its share of the memory budget is spilled to
+    # disk as sorted runs and processed out of core. The amounts' decimal
+    # separator is voted over every chunk on the way in.
+    votes = Counter()
+    with ExternalSorter(schema.from_pipeline['codigo'], budget, spill_dir_from_env()) as sorter:
+        for chunk in iter_excel_chunks(input_path, chunk_rows, usecols=schema.usecols(header)):
+            votes.update(amount_decimal_votes(chunk))
+            sorter.add(on_chunk(chunk) if on_chunk is not None else chunk)
+        decimal = amount_decimal_from_env() or decimal_from_votes(votes)
+        if not sorter.spilled:
+            return Pre_Processing(combine_chunks(sorter.take_chunks()), output_format, schema, decimal)
+        return Pre_Processing_out_of_core(sorter, schema, output_format, decimal)
+
+
+def process_all_excels_in_folder(input_folder, output_folder, chunk_rows=None, output_format=DEFAULT_OUTPUT_FORMAT, workers=None):
+    """
+    Processes every Excel file of input_folder in a pool of worker processes
+    (SANDRA_FOLDER_WORKERS, default one per CPU) and saves each result in
+    output_folder under the input's name. Returns the per-file results.
+    """
+    return run_folder(partial(process_file, chunk_rows=chunk_rows), input_folder, output_folder,
+                      output_format, workers)
 
-    try:
-        for file_name in os.listdir(output_folder):
-            file_path = os.path.join(output_folder, file_name)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-                print(f"🗑️ Deleted file: {file_path}")
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)  # also delete subfolders if any
-                print(f"🗑️ Deleted folder: {file_path}")
-    except Exception as e:
-        print(f"❌ Error deleting files in {output_folder}: {e}")
 
-    return output
 
 
 
 
-def main(input_path):
+def main(input_path, chunk_rows=None, output_format=DEFAULT_OUTPUT_FORMAT):
     # === Step 1: Load Excel file ===
     # input_path = r"C:\Users\abhay\OneDrive\Desktop\Data filter\INPUT\BROU USD 04 25.xlsx"
     # input_path = r"C:\Users\abhay\OneDrive\Desktop\Data filter\INPUT\Santander Base de Datos .xlsx"
@@ -522,18 +194,16 @@ def main(input_path):
 
     if os.path.isfile(input_path):
         try:
-            df = pd.read_excel(input_path, dtype=str).fillna('')
+            output_path = process_file(input_path, output_format, chunk_rows)  # This returns the processed file path
         except FileNotFoundError:
             print(f"❌ Error: The file at {input_path} was not found.")
             exit()
 
-        output_path = Pre_Processing(df)  # This returns the processed file path
-
         return output_path
 
     else:
-        output = process_all_excels_in_folder(input_path, final_output_dir)
-        return output
+        process_all_excels_in_folder(input_path, final_output_dir, chunk_rows, output_format)
+        return final_output_dir
         
 
 app = Flask(__name__)
@@ -541,6 +211,59 @@ app = Flask(__name__)
 # Added "http://localhost:3000" to the allowed origins
 CORS(app, origins=["http://127.0.0.1:5000", "http://localhost:5173", "http://localhost:3000"])
 
+# Repeat uploads of the same file are answered from the on-disk result cache
+RESULT_CACHE = result_cache_from_env(namespace="api2")
+
+
+def cache_job_outputs(outputs, output_format, context):
+    """
+    Adds the outputs of a finished job to the result cache, each with the
+    pattern index frame of its result. context holds one (cache key, result
+    id) pair per input.
+    """
+    cache_keys = [cache_key for cache_key, _ in context]
+    RESULT_CACHE.put_many(cache_keys, outputs, output_extension(output_format))
+    for (cache_key, result_id), output_path in zip(context, outputs):
+        if output_path:
+            PATTERN_INDEX.save_to_cache(result_id, RESULT_CACHE, cache_key)
+
+
+# Uploads sent with async=1 (or 'Prefer: respond-async') run as background jobs;
+# their outputs are added to the result cache when the job finishes
+JOB_RUNNER = job_runner_from_env(main, on_output=cache_job_outputs)
+
+# Request, pipeline, cache and job metrics, scraped from GET /metrics
+METRICS = install_metrics(app, RESULT_CACHE, JOB_RUNNER)
+
+# Processed results are indexed by pattern token for GET /patterns/search, under
+# the result id sent back in X-Result-Id (or listed by the job status endpoint).
+# The index starts with the first request, so scripts importing this module keep nothing
+PATTERN_INDEX = install_pattern_index(app)
+
+
+def result_ids(input_paths):
+    """
+    Search ids of the results of the uploaded files, None where not indexed.
+    """
+    ids = [os.path.basename(path) for path in input_paths]
+    return [result_id if PATTERN_INDEX.has(result_id) else None for result_id in ids]
+
+
+def index_cached_results(input_paths, results):
+    """
+    Pairs the pattern index with the result cache after process_uploads():
+    cache hits are indexed from the frame kept with the cached output, and new
+    results keep their indexed frame with their cache entry.
+    """
+    if not PATTERN_INDEX.enabled or not RESULT_CACHE.enabled:
+        return
+    for input_path, result in zip(input_paths, results):
+        result_id = os.path.basename(input_path)
+        if result["cache"] == "HIT":
+            PATTERN_INDEX.load_from_cache(result_id, RESULT_CACHE, result["key"])
+        elif result["output"]:
+            PATTERN_INDEX.save_to_cache(result_id, RESULT_CACHE, result["key"])
+
 
 @app.route('/excel_filter', methods=['POST'])
 def excel_filter():
@@ -551,42 +274,148 @@ def excel_filter():
 
         # Collect all uploaded Excel files
         excel_files = []
+        upload_names = []
         for key in request.files:
             if key.startswith("excel_file_"):
                 file = request.files[key]
                 filename = secure_filename(file.filename)
-                temp_path = os.path.join("temp", filename)
+                # Prefixed so that uploads with the same name do not overwrite each other
+                temp_path = os.path.join("temp", f"{uuid.uuid4().hex[:8]}_{filename}")
                 os.makedirs("temp", exist_ok=True)
                 file.save(temp_path)
                 excel_files.append(temp_path)
+                upload_names.append(filename)
 
         if not excel_files:
             return jsonify({"error": "No Excel files uploaded"}), 400
+
+        # Output format from the 'format' parameter or the Accept header (default xlsx)
+        try:
+            output_format = output_format_from_request(request)
+        except ValueError as e:
+            for file_path in excel_files:
+                os.remove(file_path)
+            return jsonify({"error": str(e)}), 400
+
+        # Job mode: queue the files and answer right away with the job id
+        if wants_async(request):
+            context = [(RESULT_CACHE.key_for(file_path, output_format) if RESULT_CACHE.enabled else None,
+                        os.path.basename(file_path)) for file_path in excel_files]
+            job_id = JOB_RUNNER.submit(excel_files, output_format, context=context)
+            print(f"Queued {len(excel_files)} Excel files as job {job_id}")
+            return jsonify(job_summary(JOB_RUNNER.status(job_id))), 202
         
         print(f"Processing {len(excel_files)} Excel files...")
-        
-        # Process each uploaded file
-        processed_file_paths = []
 
+        # Process the uploaded files: cache hits first, the rest concurrently in the worker pool
+        results = process_uploads(JOB_RUNNER, RESULT_CACHE, excel_files, output_format, upload_names)
+        index_cached_results(excel_files, results)
 
-        
+        # Clean up the original uploaded temporary files
         for file_path in excel_files:
-            output_path = main(file_path)
-            if output_path and os.path.exists(output_path):
-                processed_file_paths.append(output_path)
-            # Clean up the original uploaded temporary file
             os.remove(file_path)
 
-        if not processed_file_paths:
+        processed = [result for result in results if result["output"]]
+        if not processed:
+            errors = {result["file"]: result["error"] for result in results if result["error"]}
+            if errors:
+                return jsonify({"error": "Processing failed", "files": errors}), 500
             return jsonify({"message": "No patterns were identified in any of the uploaded files."}), 200
 
-        output_file_to_send = processed_file_paths[0]
-        
-                
-        return send_file(output_file_to_send, as_attachment=True, download_name=os.path.basename(output_file_to_send))
+        # The outputs are removed once the response has been sent
+        if len(results) == 1:
+            output_file_to_send = processed[0]["output"]
+            response = send_and_remove(output_file_to_send, os.path.basename(output_file_to_send),
+                                       output_mimetype(output_format))
+            response.headers["X-Cache"] = processed[0]["cache"]
+        else:
+            # Several files: every output goes back in one zip, with a manifest of per-file results
+            output_file_to_send = write_temp_zip(results, output_format)
+            response = send_and_remove(output_file_to_send, "excel_filter_results.zip", "application/zip",
+                                       [result["output"] for result in processed])
+            response.headers["X-Cache"] = ",".join(result["cache"] for result in results)
+
+        # Results that could not be indexed are sent as '-'
+        if PATTERN_INDEX.enabled:
+            response.headers["X-Result-Id"] = ",".join(result_id or "-" for result_id in result_ids(excel_files))
+
+        # Seconds and rows per file on request ('report=1' or an 'X-Pipeline-Report: 1'
+        # header); the full stage reports are in the zip manifest
+        if wants_report(request):
+            summary = report_header([result["report"] for result in results])
+            if summary is not None:
+                response.headers["X-Pipeline-Report"] = summary
+        return response
 
     except Exception as e:
         print(f"Error during processing: {e}")
         return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = JOB_RUNNER.status(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    summary = job_summary(job)
+    if job["status"] == DONE and PATTERN_INDEX.enabled:
+        summary["result_ids"] = result_ids(job["inputs"])
+    return jsonify(summary)
+
+
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def job_download(job_id):
+    job = JOB_RUNNER.status(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    if job["status"] != DONE:
+        return jsonify(job_summary(job)), 409
+
+    # Like the synchronous endpoint, the first file is sent unless another is asked for;
+    # index counts the uploaded files, including those that produced no output
+    try:
+        index = int(request.args.get("index", 0))
+    except ValueError:
+        index = -1
+    output_path, error = job_output(job, index)
+    if output_path is None:
+        if error:
+            return jsonify({"error": f"File {index} of job {job_id} has no output: {error}", "index": index}), 404
+        return jsonify({"error": f"Job {job_id} has {len(job['outputs'])} input file(s)"}), 404
+    return send_file(output_path, as_attachment=True, download_name=os.path.basename(output_path),
+                     mimetype=output_mimetype(job["output_format"]))
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(RESULT_CACHE.stats())
+
+@app.route('/patterns/search', methods=['GET'])
+def patterns_search():
+    """
+    Rows of a processed result whose pattern holds the tokens of 'q' (mode 'all',
+    the default), any of them ('any') or exactly them ('exact'), with their
+    Credito/Debito totals. 'result' picks the result (default: the last one
+    searched or indexed), 'limit' the number of rows returned.
+    """
+    query = request.args.get("q", "").strip()
+    mode = request.args.get("mode", "all").strip().lower()
+    if not query:
+        return jsonify({"error": "Missing search query 'q'"}), 400
+    if mode not in SEARCH_MODES:
+        return jsonify({"error": f"Unknown mode '{mode}' (expected one of: {', '.join(SEARCH_MODES)})"}), 400
+    try:
+        limit = min(max(0, int(request.args.get("limit", DEFAULT_SEARCH_LIMIT))), MAX_SEARCH_LIMIT)
+    except ValueError:
+        return jsonify({"error": "'limit' must be a number"}), 400
+
+    result_id = request.args.get("result") or None
+    index = PATTERN_INDEX.get(result_id)
+    if index is None:
+        return jsonify({"error": f"Result {result_id} is not indexed" if result_id else "No result is indexed"}), 404
+    return jsonify(index.search(query, mode, limit))
+
+@app.route('/patterns/stats', methods=['GET'])
+def patterns_stats():
+    return jsonify(PATTERN_INDEX.stats())
+
 if __name__ == '__main__':
     app.run(debug=True) # Run Flask app in debug mode for development
\ No newline at end of file
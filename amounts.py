@@ -0,0 +1,303 @@
+import os
+import re
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import report_warning
+
+
+# === Fixed-point amount parser ===
+# Statements print amounts in either convention ('1.234,56' in Uruguay, '1,234.56'
+# elsewhere), with currency symbols, parentheses or trailing minus signs, while
+# numeric cells come out of the reader as plain '1234.5'. Amounts are parsed into
+# int64 cents, and stay in cents through the pipeline so that sums are exact;
+# they are turned into currency units when the output is written. Only the
+# distinct cell values are parsed. Cells that are not an amount are reported
+# and count as 0.
+#
+# The decimal separator of a cell is the last separator when both appear, and a
+# lone separator is a decimal one unless it is repeated ('1.234.567'). A lone
+# separator followed by exactly three digits ('1.234', '1,234') is ambiguous: it
+# is read in the convention set with SANDRA_AMOUNT_DECIMAL (',' or '.'), or else
+# in the statement's. The convention is voted by the amount cells that tell
+# theirs: those using both separators, those with a lone separator followed by
+# one or two digits ('250,50') and those repeating one ('1.234.567'). Without
+# either, '.' is the decimal separator, as in numeric cells. Thousands groups
+# must be well formed ('1.234.567', not '1.2.3'); a lone separator that cannot
+# group thousands ('0,125', '1234,567') is a decimal one.
+#
+# The vote counts cells, so the votes of separate chunks add up to the vote of
+# the whole file. It is taken once per statement (infer_amount_decimal, or
+# amount_decimal_votes per chunk) before the statement is sharded or spilled,
+# and the result is passed to clean_amount_columns, so every shard and block
+# reads '1.500' the same way. Called without it, clean_amount_columns votes per
+# column over the frame it is given.
+
+AMOUNT_COLUMNS = [['Credito', 'Crédito'], ['Debito', 'Débito']]
+
+# Currency markers removed before parsing
+CURRENCY_RE = re.compile(r'U\$S|US\$|\$U|\b(?:USD|UYU|EUR|ARS|BRL)\b|[$€£¥\s]', re.IGNORECASE)
+AMOUNT_RE = re.compile(r'(\()?([-+])?(\d[\d.,]*|[.,]\d[\d.,]*)(-)?(\))?')
+# Numeric cells and amounts without thousands ('-1234.5'), parsed without the general rules
+PLAIN_RE = re.compile(r'-?\d{1,13}(?:\.\d\d?)?')
+SCIENTIFIC_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)[eE][-+]?\d+')
+
+# Digits that still fit in int64 once multiplied by 100
+MAX_INTEGER_DIGITS = 16
+
+
+def amount_decimal_from_env():
+    """
+    Decimal separator for ambiguous amounts set with SANDRA_AMOUNT_DECIMAL
+    (',' or '.'), or None to infer it per column.
+    """
+    value = os.environ.get("SANDRA_AMOUNT_DECIMAL", "").strip()
+    return value if value in (",", ".") else None
+
+
+def _split_amount(text):
+    """
+    Returns (negative, number) for a printed amount, number being its digits and
+    separators, or None when the text is not an amount.
+    """
+    if not text:
+        return False, ''
+    match = AMOUNT_RE.fullmatch(text) or AMOUNT_RE.fullmatch(CURRENCY_RE.sub('', text))
+    if match is None:
+        return None
+    opened, sign, number, trailing, closed = match.groups()
+    if (opened is None) != (closed is None):
+        return None
+    return sign == '-' or trailing is not None or opened is not None, number
+
+
+def _decimal_evidence(number):
+    """
+    The decimal separator a number shows it uses, or None when it does not tell.
+    """
+    last_dot = number.rfind('.')
+    last_comma = number.rfind(',')
+    if last_dot >= 0 and last_comma >= 0:
+        return ',' if last_comma > last_dot else '.'
+    if last_dot < 0 and last_comma < 0:
+        return None
+    separator = max(last_dot, last_comma)
+    char = number[separator]
+    if number.count(char) > 1:
+        return '.' if char == ',' else ','
+    if 1 <= len(number) - separator - 1 <= 2:
+        return char
+    return None
+
+
+def _decimal_votes(texts, counts):
+    """
+    Counter of the decimal separators shown by a list of distinct stripped
+    strings, each counted as many times as it occurs (counts).
+    """
+    votes = Counter()
+    for text, count in zip(texts, counts):
+        if PLAIN_RE.fullmatch(text):
+            continue
+        part = _split_amount(text)
+        if part is not None:
+            evidence = _decimal_evidence(part[1])
+            if evidence is not None:
+                votes[evidence] += int(count)
+    return votes
+
+
+def _distinct_texts(values):
+    """
+    Returns (codes, distinct stripped strings, occurrences of each) for a column.
+    """
+    codes, distinct = pd.factorize(pd.Series(values))
+    counts = np.bincount(codes[codes >= 0], minlength=len(distinct))
+    return codes, [str(text).strip() for text in distinct], counts
+
+
+def decimal_from_votes(votes):
+    """
+    Decimal separator shown by most of the amounts that tell theirs, '.' when
+    none does.
+    """
+    return ',' if votes[','] > votes['.'] else '.'
+
+
+def _valid_grouping(integer, char):
+    """
+    True when the separators char in integer group thousands: a first group of
+    one to three digits not starting with 0, then groups of three.
+    """
+    groups = integer.split(char)
+    if len(groups) == 1:
+        return True
+    first = groups[0]
+    return 1 <= len(first) <= 3 and first[0] != '0' and all(len(group) == 3 for group in groups[1:])
+
+
+def _to_cents(negative, number, decimal):
+    """
+    Cents of a number made of digits and separators, rounded half up on the
+    third decimal, or None when the separators do not make an amount.
+    """
+    last_dot = number.rfind('.')
+    last_comma = number.rfind(',')
+    separator = max(last_dot, last_comma)
+    if separator >= 0 and (last_dot < 0 or last_comma < 0):
+        # A repeated separator groups thousands, as does one followed by
+        # exactly three digits in a column of the other convention
+        char = number[separator]
+        if number.count(char) > 1 or (len(number) - separator == 4 and char != decimal
+                                      and _valid_grouping(number, char)):
+            separator = -1
+
+    if separator >= 0:
+        integer, fraction = number[:separator], number[separator + 1:]
+        if '.' in fraction or ',' in fraction:
+            return None
+    else:
+        integer, fraction = number, ''
+    grouping = {char for char in '.,' if char in integer}
+    if len(grouping) > 1 or (grouping and not _valid_grouping(integer, grouping.pop())):
+        return None
+    integer = integer.replace('.', '').replace(',', '')
+    if len(integer) > MAX_INTEGER_DIGITS:
+        return None
+
+    thousandths = int((fraction + '000')[:3])
+    cents = int(integer or '0') * 100 + (thousandths + 5) // 10
+    return -cents if negative else cents
+
+
+def _parse_distinct(values, decimal):
+    """
+    Returns (cents, invalid) arrays for a list of distinct stripped strings,
+    ambiguous amounts read with decimal as the decimal separator.
+    """
+    cents = np.zeros(len(values), dtype=np.int64)
+    invalid = np.zeros(len(values), dtype=bool)
+
+    # Plain amounts go through float64 in bulk, exact for up to 13 integer digits
+    plain = np.fromiter((PLAIN_RE.fullmatch(text) is not None for text in values), dtype=bool, count=len(values))
+    if plain.any():
+        units = pd.to_numeric(pd.Series(values, dtype=object)[plain]).to_numpy(dtype=np.float64)
+        cents[plain] = np.round(units * 100).astype(np.int64)
+
+    for i in np.flatnonzero(~plain).tolist():
+        text = values[i]
+        part = _split_amount(text)
+        value = None
+        if part is not None:
+            value = _to_cents(part[0], part[1], decimal)
+        elif SCIENTIFIC_RE.fullmatch(text):
+            # Numeric cells printed in scientific notation ('1.5e-05')
+            number = float(text)
+            if abs(number) < 10.0 ** MAX_INTEGER_DIGITS:
+                value = int(round(number * 100))
+        if value is None:
+            invalid[i] = True
+        else:
+            cents[i] = value
+    return cents, invalid
+
+
+def parse_amounts(values, decimal=None):
+    """
+    Parses a column of printed amounts into int64 cents. Returns (cents, invalid):
+    both are arrays aligned with values, invalid marking the non-empty cells
+    that are not an amount (their cents are 0). Empty cells are 0. Without
+    decimal (nor SANDRA_AMOUNT_DECIMAL), the column's cells vote for it.
+    """
+    if decimal is None:
+        decimal = amount_decimal_from_env()
+    codes, texts, counts = _distinct_texts(values)
+    if decimal is None:
+        decimal = decimal_from_votes(_decimal_votes(texts, counts))
+    cents, invalid = _parse_distinct(texts, decimal)
+    # Missing cells (code -1) are empty
+    cents = np.append(cents, 0)
+    invalid = np.append(invalid, False)
+    return cents[codes], invalid[codes]
+
+
+def cents_to_units(cents):
+    """
+    Amounts in currency units (float64), the closest float to each exact cent value.
+    """
+    return np.asarray(cents, dtype=np.int64) / 100
+
+
+def _amount_names(columns):
+    for names in columns:
+        yield from ([names] if isinstance(names, str) else names)
+
+
+def _amount_columns(df, columns):
+    """
+    The first existing name of each group in columns.
+    """
+    for names in columns:
+        names = [names] if isinstance(names, str) else names
+        col = next((c for c in names if c in df.columns), None)
+        if col is not None:
+            yield col
+
+
+def amount_decimal_votes(df, columns=AMOUNT_COLUMNS):
+    """
+    Counter of the decimal separators shown by the cells of the amount columns
+    of df (the first existing name of each group in columns).
+    """
+    votes = Counter()
+    for col in _amount_columns(df, columns):
+        _, texts, counts = _distinct_texts(df[col])
+        votes.update(_decimal_votes(texts, counts))
+    return votes
+
+
+def infer_amount_decimal(df, columns=AMOUNT_COLUMNS):
+    """
+    Decimal separator of a whole statement: SANDRA_AMOUNT_DECIMAL when set,
+    else the vote of the cells of its amount columns.
+    """
+    return amount_decimal_from_env() or decimal_from_votes(amount_decimal_votes(df, columns))
+
+
+def clean_amount_columns(df, columns=AMOUNT_COLUMNS, decimal=None, max_examples=5):
+    """
+    Replaces the amount columns of df (the first existing name of each group in
+    columns) with their value in int64 cents. Ambiguous amounts are read with
+    decimal as the decimal separator; pass the statement's (infer_amount_decimal)
+    when df is only part of it. Unparseable cells are set to 0 and reported with
+    their text. Returns the number of unparseable cells.
+    """
+    total_invalid = 0
+    for col in _amount_columns(df, columns):
+        cents, invalid = parse_amounts(df[col], decimal)
+        if invalid.any():
+            count = int(invalid.sum())
+            bad_values = pd.unique(df[col].to_numpy(dtype=object)[invalid])
+            examples = ", ".join(repr(v) for v in bad_values[:max_examples])
+            more = f" and {len(bad_values) - max_examples} more values" if len(bad_values) > max_examples else ""
+            report_warning(f"{count} unparseable amount(s) in '{col}' set to 0: {examples}{more}")
+            total_invalid += count
+        df[col] = cents
+    return total_invalid
+
+
+def amounts_to_units(df, columns=AMOUNT_COLUMNS):
+    """
+    df with its amount columns in currency units, for writing: the int64 cents
+    left by clean_amount_columns become float64 units. df itself is not changed;
+    it is returned as is when it holds no amounts in cents.
+    """
+    cents = [col for col in _amount_names(columns) if col in df.columns and df[col].dtype == np.int64]
+    if not cents:
+        return df
+    df = df.copy(deep=False)
+    for col in cents:
+        df[col] = cents_to_units(df[col])
+    return df
@@ -0,0 +1,179 @@
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from output_formats import output_extension, DEFAULT_OUTPUT_FORMAT
+from instrumentation import pipeline_report, publish_report, stage
+
+
+# === Parallel folder runner ===
+# Every workbook of a folder is processed in a pool of worker processes. Each worker
+# moves its result into the output folder under a temporary name and renames it, so
+# a file named like the input only appears once it is complete.
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+
+def folder_workers_from_env():
+    """
+    Worker processes for folder runs, overridable with SANDRA_FOLDER_WORKERS
+    (defaults to the number of CPUs).
+    """
+    default = os.cpu_count() or 1
+    try:
+        return max(1, int(os.environ.get("SANDRA_FOLDER_WORKERS", default)))
+    except ValueError:
+        return default
+
+
+def list_excel_files(input_folder, extensions=EXCEL_EXTENSIONS):
+    return sorted(
+        name for name in os.listdir(input_folder)
+        if name.lower().endswith(extensions) and not name.startswith('~$')  # skip Excel lock files
+        and os.path.isfile(os.path.join(input_folder, name))
+    )
+
+
+def output_names(file_names, extension):
+    """
+    Output file name of every input, in order: its stem with extension, or the
+    whole input name with extension when another input shares the stem
+    (statement.xls and statement.xlsx give statement.xls.xlsx and
+    statement.xlsx.xlsx). Names still taken get a numbered suffix. Names are
+    compared case-insensitively, as on Windows, so no two outputs share a path.
+    """
+    stems = [os.path.splitext(name)[0] for name in file_names]
+    stem_counts = {}
+    for stem in stems:
+        stem_counts[stem.casefold()] = stem_counts.get(stem.casefold(), 0) + 1
+
+    names, taken = [], set()
+    for file_name, stem in zip(file_names, stems):
+        base = file_name if stem_counts[stem.casefold()] > 1 else stem
+        name, n = base + extension, 1
+        while name.casefold() in taken:
+            n += 1
+            name = f"{base} ({n}){extension}"
+        taken.add(name.casefold())
+        names.append(name)
+    return names
+
+
+def move_atomic(source_path, final_path):
+    """
+    Moves source_path to final_path through a temporary file in the destination
+    folder, so readers never see a partially written output.
+    """
+    part_path = os.path.join(os.path.dirname(final_path) or ".", f".{os.path.basename(final_path)}.part")
+    try:
+        shutil.move(source_path, part_path)
+        os.replace(part_path, final_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return final_path
+
+
+def _run_file(process_file, input_path, output_path, output_format):
+    """
+    Worker-side body: processes one workbook and moves the result into place.
+    Returns (final path or None, error or None, seconds, stage report).
+    """
+    start = time.perf_counter()
+    temp_path = None
+    report = None
+    try:
+        with pipeline_report(os.path.basename(input_path)) as report:
+            temp_path = process_file(input_path, output_format=output_format)
+            if temp_path and os.path.isfile(temp_path):
+                with stage("move_output"):
+                    move_atomic(temp_path, output_path)
+            else:
+                output_path = None
+        return output_path, None, time.perf_counter() - start, report.to_dict()
+    except (Exception, SystemExit) as e:
+        # The processing functions print their error and call exit(), leaving no message
+        error = "Processing failed, see the log above" if isinstance(e, SystemExit) else (str(e) or type(e).__name__)
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None, error, time.perf_counter() - start, report.to_dict() if report else None
+
+
+def run_folder(process_file, input_folder, output_folder, output_format=DEFAULT_OUTPUT_FORMAT, workers=None):
+    """
+    Processes every Excel file of input_folder and writes each result into
+    output_folder under the input's name, with the extension of output_format
+    (see output_names() for inputs sharing a stem).
+
+    process_file(input_path, output_format=...) must be a module-level function
+    (or a functools.partial of one) returning the path of the output it wrote.
+    Progress and timings are printed per file as results come in. Returns one
+    dict per input file with its output path, status ('ok', 'empty' or
+    'failed'), error, seconds and stage timings.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    workers = workers or folder_workers_from_env()
+    extension = output_extension(output_format)
+
+    file_names = list_excel_files(input_folder)
+    total = len(file_names)
+    if not total:
+        print(f"ℹ️ No Excel files found in {input_folder}")
+        return []
+
+    tasks = [
+        (
+            file_name,
+            os.path.join(input_folder, file_name),
+            os.path.join(output_folder, output_name),
+        )
+        for file_name, output_name in zip(file_names, output_names(file_names, extension))
+    ]
+    print(f"📂 Processing {total} files from {input_folder} with {min(workers, total)} worker(s)")
+
+    results = {}
+    started = time.perf_counter()
+
+    def report(file_name, outcome):
+        output_path, error, seconds, stage_report = outcome
+        status = "failed" if error else ("ok" if output_path else "empty")
+        results[file_name] = {
+            "file": file_name,
+            "output": output_path,
+            "status": status,
+            "error": error,
+            "seconds": round(seconds, 3),
+            "stages": stage_report["stages"] if stage_report else [],
+        }
+        done = len(results)
+        if status == "ok":
+            print(f"✅ [{done}/{total}] {file_name} -> {output_path} ({seconds:.1f}s)")
+        elif status == "empty":
+            print(f"ℹ️ [{done}/{total}] {file_name}: no output ({seconds:.1f}s)")
+        else:
+            print(f"❌ [{done}/{total}] {file_name}: {error} ({seconds:.1f}s)")
+
+    if workers == 1 or total == 1:
+        for file_name, input_path, output_path in tasks:
+            report(file_name, _run_file(process_file, input_path, output_path, output_format))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, total)) as executor:
+            futures = {
+                executor.submit(_run_file, process_file, input_path, output_path, output_format): file_name
+                for file_name, input_path, output_path in tasks
+            }
+            for future in as_completed(futures):
+                file_name = futures[future]
+                try:
+                    outcome = future.result()
+                    if outcome[3]:
+                        publish_report(outcome[3])
+                except BaseException as e:  # the worker process itself died
+                    outcome = (None, str(e) or type(e).__name__, 0.0, None)
+                report(file_name, outcome)
+
+    ok = sum(1 for r in results.values() if r["status"] == "ok")
+    print(f"📊 {ok}/{total} files processed in {time.perf_counter() - started:.1f}s, outputs in {output_folder}")
+    return [results[file_name] for file_name in file_names]
@@ -0,0 +1,131 @@
+"""
+Times the legacy API.py pattern engine against the implementation it replaced
+and checks that both give the same patterns.
+
+Run from the repository root:
+
+    python -m benchmarks.legacy
+    python -m benchmarks.legacy --sizes 10000 100000 --rows-per-key 3
+
+The old engine intersected groups in fixed 100-row batches, so a codigo group
+crossing a batch boundary was split in two. Parity is checked against the old
+code run in a single batch; the rows whose pattern changes because groups are no
+longer split are counted separately.
+"""
+import argparse
+import re
+import sys
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import generate_statement
+
+DEFAULT_SIZES = [10_000, 100_000]
+
+
+# === The replaced implementation (steps 2 to 6 of the old API.main) ===
+
+def reference_patterns(df, batch_size=100):
+    df = df.copy()
+
+    def extract_tokens(desc):
+        tokens = desc.split()
+        extracted = []
+
+        for token in tokens:
+            extracted.append(token)
+            patterns = re.findall(r'''
+                [A-Z]*\d+[A-Z]* |
+                TX:\d+               |
+                TRJ:[^\s]+           |
+                \d{6,}               |
+                [A-Z]{2,}\d{2,}      |
+                \d+/\d+              |
+                -\d+-\d+             |
+                \d{15,}              |
+                MONTEVIDEO.*?0013
+            ''', token, re.VERBOSE | re.IGNORECASE)
+            extracted.extend(patterns)
+
+        seen = set()
+        return [x for x in extracted if not (x in seen or seen.add(x))]
+
+    df['__pattern_tokens'] = df['DESC'].apply(extract_tokens)
+
+    def intersect_tokens(group):
+        all_tokens = group['__pattern_tokens'].tolist()
+        if not all_tokens:
+            return group.assign(Pattren='')
+
+        common = set(all_tokens[0])
+        for token_list in all_tokens[1:]:
+            common &= set(token_list)
+
+        ordered_common = [token for token in all_tokens[0] if token in common]
+        if not ordered_common:
+            ordered_common = all_tokens[0]
+
+        return group.assign(Pattren=', '.join(ordered_common))
+
+    result_batches = []
+    for i in range(0, len(df), batch_size):
+        batch = df.iloc[i:i + batch_size].copy()
+        result_batches.append(batch.groupby('codigo', group_keys=False)[list(batch.columns)].apply(intersect_tokens))
+    final_df = pd.concat(result_batches).reset_index(drop=True)
+
+    pattern_map = final_df.groupby('Pattren')['codigo'].nunique()
+    duplicate_patterns = pattern_map[pattern_map > 1].index
+
+    def prefix_if_duplicate(row):
+        if row['Pattren'] in duplicate_patterns:
+            return f"*{row['codigo']}*{row['Pattren']}"
+        return row['Pattren']
+
+    return final_df.apply(prefix_if_duplicate, axis=1)
+
+
+# === The current engine ===
+
+def current_patterns(df):
+    from API import extract_tokens, intersect_tokens, prefix_duplicate_patterns
+
+    token_codes, token_lists = extract_tokens(df['DESC'])
+    patterns = intersect_tokens(df['codigo'], token_codes, token_lists)
+    return prefix_duplicate_patterns(patterns, df['codigo'])
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the legacy API.py pattern engine against the old one.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--rows-per-key", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    ok = True
+    print(f"{'rows':>9} {'old s':>9} {'new s':>9} {'speedup':>8}  parity  split-group rows")
+    for rows in args.sizes:
+        df = generate_statement(rows, "raw", rows_per_key=args.rows_per_key, seed=args.seed)
+        df = df.sort_values(by='codigo').reset_index(drop=True)
+
+        old, old_seconds = timed(reference_patterns, df)
+        new, new_seconds = timed(current_patterns, df)
+        whole = reference_patterns(df, batch_size=max(len(df), 1))
+
+        same = whole.tolist() == new.tolist()
+        ok &= same
+        split_rows = sum(a != b for a, b in zip(old.tolist(), new.tolist()))
+        print(f"{rows:>9} {old_seconds:>9.3f} {new_seconds:>9.3f} {old_seconds / new_seconds:>7.1f}x  "
+              f"{'ok' if same else 'DIFF':>6}  {split_rows}")
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
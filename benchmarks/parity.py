@@ -0,0 +1,107 @@
+"""
+Checks that the fused description transform gives the same patterns as the
+step-by-step chain it replaces (a verbatim copy in tests/baseline_pattern_chain.py),
+on more and larger inputs than tests/test_pattern_stages.py.
+
+Run from the repository root:
+
+    python -m benchmarks.parity
+    python -m benchmarks.parity --rows 200000 --seed 7
+
+Exits with status 1 and prints the first differences when a pattern differs.
+"""
+import argparse
+import random
+import sys
+
+import pandas as pd
+
+from benchmarks.synthetic import SCHEMAS, generate_statement
+
+# Descriptions that exercise the edges of every step: the special TX pattern,
+# repeated tokens, tokens removed by the rule table, long numbers in the last
+# token and runs of special characters that only collapse in the second mask pass.
+EDGE_CASES = [
+    "",
+    "   ",
+    "IVA",
+    "123456-ABC TX:987654 2/123456 PAGO",
+    "123456-ABC TX:987654 2/123456",
+    "123456-ABC TX:987654",
+    "123456-ABC TX:98x7654 2/123456 PAGO",
+    "123456- TX:987654 2/123456",
+    "A-B TX:1 2/3",
+    "PAGO PAGO PAGO UTE",
+    "PAGO\tUTE ANTEL\nOSE",
+    "TX:123 TRJ:**-1-1234 TRJ:..-2-55 /TX:1",
+    "123456LR:SPI-PREX99 123456LR:123456789012 123456LR:AB12",
+    "Trf.ABC RECIBIDA X 123456AB12345",
+    "CTA 1234567890123",
+    "CTA 1234567890-12345678901",
+    "CTA ABC123456789012345",
+    "COMISION ***-----",
+    "***-----",
+    "X ***1234567890",
+    "X -----*****#####",
+    "X ..........",
+    "١٢٣٤٥٦٧٨٩٠١٢",
+    "ÑANDU 123456ÁB",
+]
+
+PIECES = ["TX:", "TRJ:**-", "TRJ:..-", "LR:", "2/", "-", "*", "**", "*****", "-----", "/", ".", "Trf.",
+          "RECIBIDA", "PAGO", "UTE", "0013", "123456", "1234567890", "12", "AB", "ab", "Ñ", "١٢"]
+
+
+def fuzz_descriptions(n, seed=0):
+    """
+    Random descriptions glued together from pieces the rules react to.
+    """
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        tokens = []
+        for _ in range(rng.randrange(0, 6)):
+            tokens.append(''.join(rng.choice(PIECES) for _ in range(rng.randrange(1, 4))))
+        out.append(' '.join(tokens))
+    return out
+
+
+def reference_patterns(descriptions):
+    """
+    The original chain, from the verbatim copy of its steps kept with the tests.
+    """
+    from tests.baseline_pattern_chain import baseline_patterns
+
+    return baseline_patterns(pd.DataFrame({'DESC': descriptions, 'codigo': 0}))
+
+
+def compare(name, descriptions):
+    from pattern_stages import description_patterns
+
+    descriptions = pd.Series(descriptions, dtype=object)
+    expected = reference_patterns(descriptions)
+    actual = description_patterns(descriptions, cache=None)
+    diff = expected != actual
+    print(f"{name:<12} {len(descriptions):>9} rows  {int(diff.sum())} different")
+    for desc, want, got in list(zip(descriptions[diff], expected[diff], actual[diff]))[:10]:
+        print(f"    {desc!r}: expected {want!r}, got {got!r}")
+    return not diff.any()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the fused description transform against the step-by-step chain.")
+    parser.add_argument("--rows", type=int, default=50_000, help="rows per synthetic statement and of fuzz input")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    ok = compare("edge_cases", EDGE_CASES)
+    ok &= compare("fuzz", fuzz_descriptions(args.rows, args.seed))
+    for schema, (_, desc_col, _) in SCHEMAS.items():
+        ok &= compare(schema, generate_statement(args.rows, schema, seed=args.seed)[desc_col])
+
+    print("✅ Patterns match" if ok else "❌ Patterns differ")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Reports how often each token removal rule fires and how long its matching takes
+on synthetic statements, to spot dead or expensive rules.
+
+Run from the repository root:
+
+    python -m benchmarks.rules
+    python -m benchmarks.rules --rows 500000 --sort seconds
+
+Rules are listed by hits (or by --sort); rules that never removed a token are
+flagged as dead. Set SANDRA_RULE_TRACE_DIR to also get the removed tokens.
+"""
+import argparse
+import sys
+
+from benchmarks.synthetic import SCHEMAS, generate_statement
+
+
+def rule_counts(rows, schemas, seed=0):
+    """
+    The 'token_rules' counters of one pipeline report over the descriptions of
+    every schema's statement, processed without the pattern cache.
+    """
+    from instrumentation import pipeline_report
+    from pattern_stages import description_patterns
+
+    with pipeline_report("benchmarks.rules", log=False) as report:
+        for schema in schemas:
+            df = generate_statement(rows, schema, seed=seed)
+            description_patterns(df[SCHEMAS[schema][1]], cache=None)
+    return report.to_dict().get("counters", {}).get("token_rules", {})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-rule hit counts of the token removal rules.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--schemas", nargs="+", choices=list(SCHEMAS), default=list(SCHEMAS))
+    parser.add_argument("--sort", choices=["hits", "tokens", "seconds", "table"], default="hits")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from token_rules import KEPT
+
+    counts = rule_counts(args.rows, args.schemas, args.seed)
+    names = list(counts)
+    if args.sort != "table":
+        names.sort(key=lambda name: -counts[name].get(args.sort, 0))
+
+    print(f"{'rule':<55} {'tokens':>9} {'hits':>9} {'µs/token':>9}")
+    for name in names:
+        entry = counts[name]
+        per_token = entry["seconds"] / entry["tokens"] * 1e6 if entry["tokens"] else 0.0
+        hits = entry.get("hits", "-")
+        flag = "  dead" if name != KEPT and not entry["tokens"] else ""
+        print(f"{name:<55} {entry['tokens']:>9} {hits:>9} {per_token:>9.2f}{flag}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
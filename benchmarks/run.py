@@ -0,0 +1,234 @@
+"""
+Times every stage of the statement pipeline on synthetic statements.
+
+Run from the repository root:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --sizes 1000 100000 --schemas fecha raw --json results.json
+    python -m benchmarks.run --sizes 100000 --io --legacy
+
+For each schema and size it reports seconds, rows per second and peak memory
+(Python allocations traced by tracemalloc, in a second run of the stage so the
+timings are not slowed down by tracing). Arrow-backed columns are allocated
+outside Python and are not counted; set SANDRA_COMPACT_FRAMES=0 to compare with
+object columns.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.synthetic import SCHEMAS, generate_statement
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+
+
+# === Pipeline stages ===
+# The steps of process_excel_file, through the shared stage functions where they
+# exist. Each stage takes and returns the frame.
+
+def stage_rename_sort(df, schema):
+    from frame_dtypes import compact_frame, compact_frames_from_env
+
+    key_col, desc_col, ref_col = SCHEMAS[schema]
+    df = df.rename(columns={key_col: "codigo", desc_col: "DESC", ref_col: "Referencia"})
+    # Column types as Pre_Processing uses them (SANDRA_COMPACT_FRAMES)
+    if compact_frames_from_env():
+        df = compact_frame(df)
+    return df.sort_values(by='codigo').reset_index(drop=True)
+
+
+def stage_description_patterns(df, schema):
+    from pattern_stages import description_patterns
+
+    # Without the LRU cache, so repeated runs measure the per-description work
+    df['Pattren'] = description_patterns(df['DESC'], cache=None)
+    return df
+
+
+def stage_clean_amounts(df, schema):
+    from amounts import clean_amount_columns
+
+    clean_amount_columns(df)
+    return df
+
+
+def stage_fill_referencia(df, schema):
+    from pattern_stages import fill_pattern_with_referencia
+
+    fill_pattern_with_referencia(df, mask=False)
+    return df
+
+
+def stage_common_patterns(df, schema):
+    from pattern_stages import replace_with_common_patterns
+
+    return replace_with_common_patterns(df, codigo_col='codigo', pattern_col='Pattren')
+
+
+def stage_write_xlsx(df, schema):
+    from xlsx_writer import summary_pivot_fields, write_excel_with_pivot
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        write_excel_with_pivot(df, path, summary_pivot_fields)
+    finally:
+        os.remove(path)
+    return df
+
+
+STAGES = [
+    ("rename_sort", stage_rename_sort),
+    ("description_patterns", stage_description_patterns),
+    ("clean_amounts", stage_clean_amounts),
+    ("fill_referencia", stage_fill_referencia),
+    ("common_patterns", stage_common_patterns),
+    ("write_xlsx", stage_write_xlsx),
+]
+
+
+# === End-to-end runs ===
+
+def run_process_excel_file(df, schema):
+    """
+    API2/app_new processing of an already renamed and sorted frame, starting
+    with an empty pattern cache.
+    """
+    from API2 import process_excel_file
+    from pattern_stages import PATTERN_CACHE
+
+    PATTERN_CACHE.clear()
+    return process_excel_file(stage_rename_sort(df, schema))
+
+
+def run_legacy_main(path, schema):
+    """
+    API.main on a raw codigo/DESC workbook, including reading and writing.
+    """
+    from API import main
+
+    output_path = main(path)
+    if output_path and os.path.exists(output_path):
+        os.remove(output_path)
+
+
+# === Measurement ===
+
+def measure(func, *args, memory=True):
+    """
+    Returns (result, seconds, peak MiB or None). The memory run repeats func on
+    the same arguments, so func must not mutate them.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = func(*args)
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def record(results, schema, rows, stage, seconds, peak):
+    entry = {
+        "schema": schema,
+        "rows": rows,
+        "stage": stage,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(rows / seconds) if seconds > 0 else None,
+        "peak_mib": round(peak, 1) if peak is not None else None,
+    }
+    results.append(entry)
+    peak_text = f"{entry['peak_mib']:>9.1f}" if peak is not None else f"{'-':>9}"
+    print(f"{schema:<12} {rows:>9} {stage:<20} {seconds:>9.3f} {entry['rows_per_second'] or 0:>12,} {peak_text}")
+    sys.stdout.flush()
+
+
+def benchmark(sizes, schemas, memory=True, io=False, legacy=False, seed=0):
+    results = []
+    print(f"{'schema':<12} {'rows':>9} {'stage':<20} {'seconds':>9} {'rows/s':>12} {'peak MiB':>9}")
+
+    for schema in schemas:
+        for rows in sizes:
+            source = generate_statement(rows, schema, seed=seed)
+
+            path = None
+            if io or (legacy and schema == "raw"):
+                from xlsx_writer import write_excel_with_pivot
+
+                fd, path = tempfile.mkstemp(suffix=".xlsx")
+                os.close(fd)
+                write_excel_with_pivot(source, path, None)
+
+            try:
+                if io:
+                    from excel_reader import read_excel
+
+                    _, seconds, peak = measure(read_excel, path, memory=memory)
+                    record(results, schema, rows, "read_excel", seconds, peak)
+
+                # Each stage runs on a copy of the previous stage's output
+                df = source
+                for name, stage in STAGES:
+                    df, seconds, peak = measure(lambda d: stage(d.copy(), schema), df, memory=memory)
+                    record(results, schema, rows, name, seconds, peak)
+                del df
+
+                _, seconds, peak = measure(lambda d: run_process_excel_file(d.copy(), schema), source, memory=memory)
+                record(results, schema, rows, "process_excel_file", seconds, peak)
+
+                if legacy and schema == "raw":
+                    _, seconds, peak = measure(run_legacy_main, path, schema, memory=memory)
+                    record(results, schema, rows, "legacy_api_main", seconds, peak)
+            finally:
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the statement pipeline on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="row counts (default: 1k 100k 1M)")
+    parser.add_argument("--schemas", nargs="+", choices=list(SCHEMAS), default=list(SCHEMAS))
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--io", action="store_true", help="also time read_excel on a generated workbook")
+    parser.add_argument("--legacy", action="store_true", help="also time API.main (raw schema only)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.sizes, args.schemas, memory=not args.no_memory, io=args.io,
+                        legacy=args.legacy, seed=args.seed)
+
+    if args.json:
+        report = {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
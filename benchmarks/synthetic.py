@@ -0,0 +1,145 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+
+# === Synthetic bank statements ===
+# Statements look like the exports Pre_Processing recognizes: one key column
+# (dates or document numbers), a free-text description full of references
+# (TX:, TRJ:, LR:SPI-PREX, long account numbers...), a reference column and
+# Credito/Debito amounts written the way banks print them. Every value is a
+# string, as read by pd.read_excel(dtype=str).fillna('').
+
+# schema name -> (key column, description column, reference column)
+SCHEMAS = {
+    "fecha": ("Fecha", "Concepto", "Referencia"),
+    "fecha_valor": ("Fecha valor", "Concepto", "Referencia"),
+    "documento": ("Número de documento", "Asunto", "Dependencia"),
+    "raw": ("codigo", "DESC", "Referencia"),
+}
+
+MERCHANTS = [
+    "SUPERMERCADO DISCO", "TIENDA INGLESA", "ANCAP", "UTE", "ANTEL", "OSE", "FARMASHOP",
+    "MERCADOPAGO", "DEVOTO", "EL DORADO", "RED PAGOS", "ABITAB", "BPS", "DGI", "IMM",
+]
+WORDS = ["PAGO", "COMPRA", "TRANSFERENCIA", "DEBITO", "CREDITO", "COMISION", "IVA", "CUOTA",
+         "SUELDO", "RETIRO", "DEPOSITO", "CAJA", "USD", "UYU", "SPI", "MONTEVIDEO", "0013"]
+
+# Description templates, filled with random numbers by _description()
+TEMPLATES = [
+    "TRANSFERENCIA TX:{tx} 2/{six} {merchant}",
+    "{six}-{word} TX:{tx} 2/{six} {merchant}",  # collapsed by extract_special_pattern
+    "COMPRA TRJ:**-{d}-{four} {merchant} MONTEVIDEO",
+    "COMPRA TRJ:..-{d}-{four} {merchant}",
+    "{six}LR:SPI-PREX{tx} {merchant}",
+    "{six}LR:{twelve} PAGO {merchant}",
+    "{six}LR:{alnum} {word}",
+    "PAGO {merchant} CTA {account}",
+    "DEBITO AUTOMATICO {merchant} {account}",
+    "RECIBIDA {merchant} {six}",
+    "Trf.{alnum} {merchant}",
+    "{six}{letters} {word} {merchant}",
+    "{six}{upper2}{four} {word}",
+    "{upper2}{four}{upper2}{two} {merchant}",
+    "COMISION MANTENIMIENTO ********** {word}",
+    "RETIRO CAJERO {merchant} ----- {four}",
+    "/{alnum} {word} {merchant}",
+    "{word} {word} {merchant}",
+    "IVA",
+    "",
+]
+
+
+def _description(rng):
+    template = TEMPLATES[rng.randrange(len(TEMPLATES))]
+    return template.format(
+        tx=rng.randrange(10**5, 10**9),
+        six=rng.randrange(10**5, 10**6),
+        four=rng.randrange(1000, 10000),
+        two=rng.randrange(10, 100),
+        d=rng.randrange(1, 10),
+        twelve=rng.randrange(10**11, 10**13),
+        account=rng.randrange(10**9, 10**16),
+        alnum=''.join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789") for _ in range(rng.randrange(4, 10))),
+        letters=''.join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz") for _ in range(rng.randrange(2, 5))),
+        upper2=''.join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(2)),
+        merchant=MERCHANTS[rng.randrange(len(MERCHANTS))],
+        word=WORDS[rng.randrange(len(WORDS))],
+    )
+
+
+def _amounts(np_rng, n, empty_share):
+    """
+    Amounts as printed in statements: '1.234,56', '1,234.56', '$ 100', '-5.5' or ''.
+    """
+    values = np.round(np_rng.lognormal(6, 2, n), 2)
+    styles = np_rng.integers(0, 4, n)
+    empty = np_rng.random(n) < empty_share
+    out = []
+    for value, style, is_empty in zip(values.tolist(), styles.tolist(), empty.tolist()):
+        if is_empty:
+            out.append('')
+        elif style == 0:
+            out.append(f"{value:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.'))
+        elif style == 1:
+            out.append(f"{value:,.2f}")
+        elif style == 2:
+            out.append(f"$ {value:.0f}")
+        else:
+            out.append(f"{-value:.1f}")
+    return out
+
+
+def generate_statement(n_rows, schema="fecha", rows_per_key=5, seed=0):
+    """
+    Returns a synthetic statement of n_rows rows with the columns of the given
+    schema plus Credito and Debito. Rows sharing a key mostly repeat a few
+    descriptions, so codigo groups have common tokens like real statements.
+    """
+    if schema not in SCHEMAS:
+        raise ValueError(f"Unknown schema '{schema}'. Use one of: {', '.join(SCHEMAS)}")
+    key_col, desc_col, ref_col = SCHEMAS[schema]
+
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    n_keys = max(1, n_rows // rows_per_key)
+
+    if schema == "documento":
+        keys = [f"{100000 + i}" for i in range(n_keys)]
+    else:
+        days = pd.date_range("2020-01-01", periods=n_keys, freq="h")
+        keys = [d.strftime("%Y-%m-%d %H:%M:%S") for d in days]
+    key_of_row = np_rng.integers(0, n_keys, n_rows)
+
+    # A handful of descriptions per key, reused by most of its rows
+    per_key = {}
+    descriptions = []
+    for k in key_of_row.tolist():
+        pool = per_key.get(k)
+        if pool is None:
+            pool = per_key[k] = [_description(rng) for _ in range(rng.randrange(1, 4))]
+        descriptions.append(pool[rng.randrange(len(pool))] if rng.random() < 0.8 else _description(rng))
+
+    references = np_rng.choice(
+        np.array(["", "", "REF 001", "  ABC   123 ", "X", "12345678901234", "CTA 55 01"], dtype=object), n_rows
+    )
+
+    return pd.DataFrame({
+        key_col: np.array(keys, dtype=object)[key_of_row],
+        desc_col: descriptions,
+        ref_col: references,
+        "Credito": _amounts(np_rng, n_rows, 0.6),
+        "Debito": _amounts(np_rng, n_rows, 0.4),
+    }, dtype=object)
+
+
+def write_statement(path, n_rows, schema="fecha", seed=0):
+    """
+    Writes a synthetic statement to an xlsx file (data sheet only) and returns the frame.
+    """
+    from xlsx_writer import write_excel_with_pivot
+
+    df = generate_statement(n_rows, schema, seed=seed)
+    write_excel_with_pivot(df, path, None)
+    return df
@@ -0,0 +1,327 @@
+import os
+
+import pandas as pd
+
+from instrumentation import instrumented
+
+
+# === Streaming, bounded-memory workbook reader ===
+# Rows are pulled from a read-only openpyxl cursor and handed out as DataFrames of
+# at most `chunk_rows` rows, so only one chunk of raw cells is held at a time instead
+# of the whole sheet. Values are converted the same way as
+# pd.read_excel(path, dtype=str).fillna('').
+#
+# read_excel still returns the whole sheet as one frame, as Pre_Processing needs
+# every row of a codigo group at once: it bounds the raw cells, not the frame.
+# Only process_file's out-of-core path (SANDRA_MEMORY_BUDGET_MB) keeps a statement
+# larger than memory from being held whole.
+
+DEFAULT_CHUNK_ROWS = 50_000
+
+# Strings that pd.read_excel reads as NaN by default (and therefore '' after fillna)
+NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+}
+# Excel error values come back from openpyxl as their literal text
+EXCEL_ERRORS = {'#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A', '#GETTING_DATA'}
+
+
+def chunk_rows_from_env(default=DEFAULT_CHUNK_ROWS):
+    """
+    Chunk size for the reader, overridable with the SANDRA_CHUNK_ROWS environment variable.
+    """
+    try:
+        return max(1, int(os.environ.get("SANDRA_CHUNK_ROWS", default)))
+    except ValueError:
+        return default
+
+
+def _to_str(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value)
+    if text in NA_STRINGS or (isinstance(value, str) and text in EXCEL_ERRORS):
+        return ''
+    return text
+
+
+def _column_names(header_row, width):
+    """
+    Names columns the way pandas does: 'Unnamed: i' for empty headers and
+    '.1', '.2' suffixes for duplicates.
+    """
+    names = []
+    counts = {}
+    for i in range(width):
+        value = header_row[i] if i < len(header_row) else None
+        name = f"Unnamed: {i}" if value is None or value == '' else value
+        if name in counts:
+            base = name
+            while name in counts:
+                counts[base] += 1
+                name = f"{base}.{counts[base]}"
+        counts[name] = 0
+        names.append(name)
+    return names
+
+
+def _trim(row):
+    end = len(row)
+    while end and (row[end - 1] is None or row[end - 1] == ''):
+        end -= 1
+    return row[:end]
+
+
+def iter_excel_chunks(input_path, chunk_rows=DEFAULT_CHUNK_ROWS, usecols=None):
+    """
+    Yields the first sheet of a workbook as DataFrames of at most chunk_rows rows,
+    every value as str and empty cells as ''.
+
+    Columns are added when a row wider than the header shows up, so a later chunk
+    may have extra 'Unnamed: n' columns. Fully empty rows at the end of the sheet
+    are dropped, as pd.read_excel does. Legacy .xls files are not supported by the
+    read-only cursor and are loaded in one go before being chunked.
+
+    usecols, if given, is a list of column names (as read_header() returns them);
+    only those columns are converted and returned, in sheet order.
+    """
+    chunk_rows = max(1, int(chunk_rows))
+
+    if not str(input_path).lower().endswith(('.xlsx', '.xlsm')):
+        wanted = None if usecols is None else set(usecols)
+        df = pd.read_excel(input_path, dtype=str,
+                           usecols=None if wanted is None else (lambda c: str(c) in wanted)).fillna('')
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows].reset_index(drop=True)
+        if len(df) == 0:
+            yield df
+        return
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(input_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+
+        header = _trim(list(next(rows, ())))
+        width = len(header)
+        columns = _column_names(header, width)
+
+        # Only the selected cells are converted; columns past the header are never selected
+        selected = None
+        if usecols is not None:
+            wanted = set(usecols)
+            selected = [i for i, name in enumerate(columns) if str(name) in wanted]
+            columns = [columns[i] for i in selected]
+
+        buffer = []
+        pending_empty = 0  # empty rows are only kept if data follows them
+        yielded = False
+        for raw in rows:
+            row = _trim(list(raw))
+            if not row:
+                pending_empty += 1
+                continue
+
+            if selected is not None:
+                buffer.extend([] for _ in range(pending_empty))
+                pending_empty = 0
+                buffer.append([_to_str(row[i]) if i < len(row) else '' for i in selected])
+                while len(buffer) >= chunk_rows:
+                    yield _frame(buffer[:chunk_rows], columns)
+                    yielded = True
+                    del buffer[:chunk_rows]
+                continue
+
+            if len(row) > width:
+                width = len(row)
+                columns = _column_names(header, width)
+
+            while pending_empty:
+                buffer.append([])
+                pending_empty -= 1
+                if len(buffer) >= chunk_rows:
+                    yield _frame(buffer, columns)
+                    yielded = True
+                    buffer = []
+
+            buffer.append([_to_str(v) for v in row])
+            if len(buffer) >= chunk_rows:
+                yield _frame(buffer, columns)
+                yielded = True
+                buffer = []
+
+        if buffer or not yielded:
+            yield _frame(buffer, columns)
+    finally:
+        wb.close()
+
+
+_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+
+def _column_index(cell_ref):
+    index = 0
+    for char in cell_ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def _first_sheet_path(archive):
+    from xml.etree import ElementTree
+
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    sheet = workbook.find(f"{_MAIN_NS}sheets/{_MAIN_NS}sheet")
+    rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels.iter(f"{_PKG_REL_NS}Relationship"):
+        if rel.get("Id") == sheet.get(f"{_REL_NS}id"):
+            target = rel.get("Target")
+            return target.lstrip("/") if target.startswith("/") else "xl/" + target
+    raise KeyError("first worksheet")
+
+
+def _shared_strings(archive, wanted):
+    """
+    Texts of the shared strings whose index is in wanted, parsing the table only
+    up to the highest of them.
+    """
+    from xml.etree import ElementTree
+
+    texts = {}
+    last = max(wanted)
+    with archive.open("xl/sharedStrings.xml") as fh:
+        index = 0
+        for _, elem in ElementTree.iterparse(fh):
+            if elem.tag != f"{_MAIN_NS}si":
+                continue
+            if index in wanted:
+                # Plain text or rich text runs; phonetic runs (rPh) are not part of the value
+                parts = [t.text or "" for t in elem.findall(f"{_MAIN_NS}t")]
+                parts += [t.text or "" for t in elem.findall(f"{_MAIN_NS}r/{_MAIN_NS}t")]
+                texts[index] = "".join(parts)
+            elem.clear()
+            if index == last:
+                break
+            index += 1
+    return texts
+
+
+def _sniff_header(input_path):
+    """
+    Reads the first row of an xlsx straight from the archive, without loading
+    the shared string table past the header's strings. Returns None when the row
+    holds anything but text (numbers or dates would need the styles to convert).
+    """
+    import zipfile
+    from xml.etree import ElementTree
+
+    with zipfile.ZipFile(input_path) as archive:
+        cells = {}
+        with archive.open(_first_sheet_path(archive)) as fh:
+            for _, elem in ElementTree.iterparse(fh):
+                if elem.tag != f"{_MAIN_NS}row":
+                    continue
+                if elem.get("r") not in (None, "1"):
+                    break  # the first row is empty
+                for position, cell in enumerate(elem.iter(f"{_MAIN_NS}c")):
+                    ref = cell.get("r")
+                    column = _column_index(ref) if ref else position
+                    kind = cell.get("t")
+                    if kind == "inlineStr":
+                        cells[column] = ("text", "".join(t.text or "" for t in cell.iter(f"{_MAIN_NS}t")))
+                    elif kind in ("s", "str"):
+                        value = cell.find(f"{_MAIN_NS}v")
+                        if value is not None:
+                            cells[column] = (kind, value.text or "")
+                    elif cell.find(f"{_MAIN_NS}v") is not None:
+                        return None
+                break
+
+        shared = {int(v) for kind, v in cells.values() if kind == "s"}
+        texts = _shared_strings(archive, shared) if shared else {}
+
+    header = [None] * (max(cells) + 1 if cells else 0)
+    for column, (kind, value) in cells.items():
+        header[column] = texts.get(int(value)) if kind == "s" else value
+    if any(isinstance(v, str) and "_x" in v for v in header):
+        return None  # escaped characters, leave them to openpyxl
+    return [v if v != "" else None for v in header]
+
+
+def read_header(input_path):
+    """
+    Returns the column names of the first sheet without loading the data rows.
+    """
+    if not str(input_path).lower().endswith(('.xlsx', '.xlsm')):
+        return [str(c) for c in pd.read_excel(input_path, nrows=0).columns]
+
+    try:
+        header = _sniff_header(input_path)
+    except Exception:
+        header = None  # unusual layout, read it through openpyxl below
+
+    if header is None:
+        from openpyxl import load_workbook
+
+        wb = load_workbook(input_path, read_only=True, data_only=True, keep_links=False)
+        try:
+            header = list(next(wb.worksheets[0].iter_rows(values_only=True), ()))
+        finally:
+            wb.close()
+    header = _trim(header)
+    return [str(c) for c in _column_names(header, len(header))]
+
+
+def _frame(rows, columns):
+    width = len(columns)
+    padded = [row + [''] * (width - len(row)) for row in rows]
+    return pd.DataFrame(padded, columns=columns, dtype=object)
+
+
+@instrumented("read_excel")
+def read_excel(input_path, chunk_rows=DEFAULT_CHUNK_ROWS, on_chunk=None, usecols=None):
+    """
+    Drop-in replacement for pd.read_excel(input_path, dtype=str).fillna('') that
+    reads the workbook chunk by chunk. If given, on_chunk(df) is applied to every
+    chunk before the chunks are combined, and only the usecols columns are read.
+    """
+    chunks = []
+    for chunk in iter_excel_chunks(input_path, chunk_rows, usecols):
+        if on_chunk is not None:
+            chunk = on_chunk(chunk)
+        chunks.append(chunk)
+    return combine_chunks(chunks)
+
+
+def combine_chunks(chunks):
+    """
+    One DataFrame from the chunks of iter_excel_chunks, as read_excel returns it.
+    The list is emptied: the frame is built column by column and each column of
+    the chunks is let go once it is copied, so the sheet is not held twice.
+    """
+    if len(chunks) == 1:
+        return chunks.pop()
+
+    columns = list(dict.fromkeys(col for chunk in chunks for col in chunk.columns))
+    sizes = [len(chunk) for chunk in chunks]
+    parts = [dict(chunk.items()) for chunk in chunks]
+    del chunks[:]
+
+    data = {}
+    for col in columns:
+        pieces = [part.pop(col, None) for part in parts]
+        # Chunks read before a wider row showed up miss its extra columns
+        dtype = next(piece.dtype for piece in pieces if piece is not None)
+        pieces = [pd.Series([''] * size, dtype=dtype) if piece is None else piece
+                  for piece, size in zip(pieces, sizes)]
+        data[col] = pd.concat(pieces, ignore_index=True)
+        del pieces
+    return pd.DataFrame(data, columns=columns, copy=False)
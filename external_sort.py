@@ -0,0 +1,284 @@
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from frame_dtypes import arrow_types_mapper, has_pyarrow
+from instrumentation import stage
+
+
+# === Out-of-core execution for statements larger than memory ===
+# Chunks are collected until they outgrow a share of the memory budget. A
+# statement that stays below it is processed in memory as usual; past it, the
+# collected rows are sorted on the group key and spilled to a run file on local
+# disk, and so on for every following share of the input. The runs are then
+# merged on the key (an external sort) and handed back as blocks of whole key
+# groups, so the processing stages and the writer only ever hold one block.
+# Memory follows the budget instead of the file size; a single key group is
+# always kept whole, however large it is.
+#
+# Rows with equal keys keep their input order. Runs are Arrow IPC streams, or
+# pickled frames without pyarrow.
+#
+# The mode is opt-in: a statement processed out of core gets no pattern
+# clusters and is not indexed for search, as both need the whole result.
+
+DEFAULT_MEMORY_BUDGET_MB = 0  # out of core is opt-in
+# The loaded frame (or a run, or a merged block) takes at most a budget share
+# this size; the rest covers the copies made while sorting, processing and writing it
+FRAME_SHARE = 8
+# Rows per batch in a run file, the unit in which runs are read back while merging
+RUN_BATCH_ROWS = 8192
+
+
+def memory_budget_from_env():
+    """
+    Memory budget in bytes for processing one statement, set in MiB with
+    SANDRA_MEMORY_BUDGET_MB; 0, the default, turns the out-of-core mode off.
+    It covers the statement's data, not the fixed cost of the interpreter, the
+    imported libraries, the workbook reader and the pattern cache.
+    """
+    try:
+        megabytes = max(0, int(os.environ.get("SANDRA_MEMORY_BUDGET_MB", DEFAULT_MEMORY_BUDGET_MB)))
+    except ValueError:
+        megabytes = DEFAULT_MEMORY_BUDGET_MB
+    return megabytes * 1024 * 1024
+
+
+def spill_dir_from_env():
+    """
+    Directory for the run files, SANDRA_SPILL_DIR or the system temp directory.
+    """
+    return os.environ.get("SANDRA_SPILL_DIR") or None
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
+class SortedRun:
+    """
+    A frame sorted on its key, written to a temporary file in batches of
+    batch_rows rows and read back one batch at a time.
+    """
+
+    def __init__(self, df, directory=None, batch_rows=RUN_BATCH_ROWS):
+        self.rows = len(df)
+        self.arrow = has_pyarrow()
+        fd, self.path = tempfile.mkstemp(suffix=".run", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                if self.arrow:
+                    import pyarrow as pa
+
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    with pa.ipc.new_stream(fh, table.schema) as writer:
+                        writer.write_table(table, max_chunksize=batch_rows)
+                else:
+                    for start in range(0, len(df), batch_rows):
+                        pickle.dump(df.iloc[start:start + batch_rows], fh, protocol=pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            self.remove()
+            raise
+
+    def batches(self):
+        with open(self.path, "rb") as fh:
+            if self.arrow:
+                import pyarrow as pa
+
+                for batch in pa.ipc.open_stream(fh):
+                    yield batch.to_pandas(split_blocks=False, types_mapper=arrow_types_mapper)
+            else:
+                while True:
+                    try:
+                        yield pickle.load(fh).reset_index(drop=True)
+                    except EOFError:
+                        return
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class _RunCursor:
+    """
+    The unmerged rows of a run: the loaded batches not handed out yet.
+    """
+
+    def __init__(self, run, key):
+        self.key = key
+        self._batches = run.batches()
+        self.frame = None
+        self.done = False
+        self.load()
+
+    def load(self):
+        """
+        Appends the next batch of the run; marks the run done at its end.
+        """
+        batch = next(self._batches, None)
+        if batch is None:
+            self.done = True
+        elif self.frame is None or len(self.frame) == 0:
+            self.frame = batch
+        else:
+            self.frame = pd.concat([self.frame, batch], ignore_index=True)
+
+    def last_key(self):
+        return self.frame[self.key].iat[-1]
+
+    def take_below(self, bound):
+        """
+        Removes and returns the leading rows whose key is below bound (all rows
+        when bound is None).
+        """
+        if bound is None:
+            taken, self.frame = self.frame, self.frame.iloc[:0]
+            return taken
+        keys = self.frame[self.key].to_numpy(dtype=object)
+        cut = int(np.searchsorted(keys, bound, side='left'))
+        taken, self.frame = self.frame.iloc[:cut], self.frame.iloc[cut:].reset_index(drop=True)
+        return taken
+
+
+def merge_runs(runs, key, block_rows):
+    """
+    Merges runs sorted on key and yields frames of whole key groups, in key
+    order, of about block_rows rows each (more when a single group is larger).
+    Rows with equal keys come out in run order, then in their order in the run.
+    """
+    cursors = [_RunCursor(run, key) for run in runs]
+    pending = []
+    pending_rows = 0
+    while True:
+        for cursor in cursors:
+            while not cursor.done and (cursor.frame is None or len(cursor.frame) == 0):
+                cursor.load()
+        open_cursors = [c for c in cursors if not c.done]
+
+        # Keys below the smallest last key of the runs still being read cannot
+        # show up again: their groups are complete
+        bound = min(c.last_key() for c in open_cursors) if open_cursors else None
+        pieces = [c.take_below(bound) for c in cursors if c.frame is not None]
+        pieces = [p for p in pieces if len(p)]
+        if pieces:
+            merged = pd.concat(pieces, ignore_index=True) if len(pieces) > 1 else pieces[0]
+            if len(pieces) > 1:
+                merged = merged.sort_values(by=key, kind='stable').reset_index(drop=True)
+            pending.append(merged)
+            pending_rows += len(merged)
+
+        if pending and (pending_rows >= block_rows or bound is None):
+            yield pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0]
+            pending, pending_rows = [], 0
+        if bound is None:
+            return
+
+        # The runs holding only the bound's group need their next batch to finish it
+        for cursor in open_cursors:
+            if cursor.last_key() == bound:
+                cursor.load()
+
+
+class ExternalSorter:
+    """
+    Collects the chunks of a frame to be sorted on key. While they fit in
+    limit_bytes (a FRAME_SHARE of budget_bytes) they stay in memory; past that
+    they are sorted and spilled to disk as runs, and groups() merges them back.
+    Also notes the columns that are blank in every row, for the caller to drop
+    them as remove_empty_columns does on a loaded frame.
+    """
+
+    def __init__(self, key, budget_bytes, directory=None):
+        self.key = key
+        self.limit_bytes = max(1, budget_bytes // FRAME_SHARE)
+        self.directory = directory
+        self.runs = []
+        self.rows = 0
+        self.bytes = 0
+        self._chunks = []
+        self._buffered_bytes = 0
+        self._filled = set()
+        self._columns = []
+
+    @property
+    def spilled(self):
+        return bool(self.runs)
+
+    def add(self, chunk):
+        for col in chunk.columns:
+            if col not in self._columns:
+                self._columns.append(col)
+            if col not in self._filled and (chunk[col].astype(str).str.strip() != '').any():
+                self._filled.add(col)
+
+        size = frame_bytes(chunk)
+        self._chunks.append(chunk)
+        self._buffered_bytes += size
+        self.rows += len(chunk)
+        self.bytes += size
+        if self._buffered_bytes > self.limit_bytes:
+            self._spill()
+
+    def take_chunks(self):
+        """
+        Hands over the chunks collected in memory (everything, if nothing was spilled).
+        """
+        chunks, self._chunks, self._buffered_bytes = self._chunks, [], 0
+        return chunks
+
+    def blank_columns(self):
+        return [col for col in self._columns if col not in self._filled]
+
+    def _normalized(self, df):
+        """
+        df with every column seen so far, in input order, and '' in its missing
+        cells, as combine_chunks leaves a statement read in several chunks. Runs
+        and merged blocks all go through it, so they share one set of columns
+        and column types whatever chunks they were made of.
+        """
+        if list(df.columns) != self._columns:
+            df = df.reindex(columns=self._columns)
+        return df.fillna('')
+
+    def _spill(self):
+        chunks = self.take_chunks()
+        if not chunks:
+            return
+        df = self._normalized(pd.concat(chunks, ignore_index=True, sort=False) if len(chunks) > 1 else chunks[0])
+        del chunks
+        with stage("spill_run", df):
+            df = df.sort_values(by=self.key, kind='stable').reset_index(drop=True)
+            self.runs.append(SortedRun(df, self.directory))
+        print(f"💾 Spilled run {len(self.runs)} ({len(df)} rows) to disk")
+
+    def groups(self):
+        """
+        Yields the collected rows sorted on key, as blocks of whole key groups
+        of about limit_bytes.
+        """
+        self._spill()
+        block_rows = max(1, int(self.limit_bytes * self.rows / max(self.bytes, 1)))
+        # Runs spilled before a wider chunk showed up miss its extra columns
+        for block in merge_runs(self.runs, self.key, block_rows):
+            yield self._normalized(block)
+
+    def close(self):
+        """
+        Drops the collected chunks and removes the run files.
+        """
+        self._chunks = []
+        for run in self.runs:
+            run.remove()
+        self.runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
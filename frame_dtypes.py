@@ -0,0 +1,156 @@
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+# === Compact column types for the processing frame ===
+# Cells are read as strings, which pandas keeps as one Python object per cell.
+# While a statement is processed, free text is held in Arrow-backed string
+# columns (one contiguous buffer per column) and the group key and patterns as
+# categoricals (an integer code per row plus each distinct value once). Columns
+# go back to plain values only where the output is written. Without pyarrow,
+# text columns stay as Python strings.
+
+# Low-cardinality columns of the processing frame
+CATEGORY_COLUMNS = ('codigo', 'Pattren')
+
+
+def compact_frames_from_env():
+    """
+    Compact column types are on unless SANDRA_COMPACT_FRAMES is set to 0/false/no.
+    """
+    return os.environ.get("SANDRA_COMPACT_FRAMES", "").strip().lower() not in ("0", "false", "no", "off")
+
+
+def has_pyarrow():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def text_dtype():
+    """
+    dtype for free-text columns: Arrow-backed strings, or object without pyarrow.
+    """
+    return pd.StringDtype("pyarrow") if has_pyarrow() else object
+
+
+def is_compact(values):
+    return isinstance(values.dtype, (pd.CategoricalDtype, pd.StringDtype, pd.ArrowDtype))
+
+
+def compact_text(df):
+    """
+    Converts the object columns of df to text_dtype(). Meant for the chunks of
+    read_excel, so that the Python strings of a chunk are dropped right away.
+    """
+    dtype = text_dtype()
+    if dtype is object:
+        return df
+    columns = [col for col, col_dtype in df.dtypes.items() if col_dtype == object]
+    if columns:
+        df = df.astype({col: dtype for col in columns})
+    return df
+
+
+def compact_frame(df, category_columns=CATEGORY_COLUMNS):
+    """
+    Text columns to text_dtype() and the category_columns present to categoricals.
+    """
+    df = compact_text(df)
+    for col in category_columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def categorical_from_codes(codes, values):
+    """
+    Categorical of values[codes], where values may repeat; code -1 is missing.
+    """
+    value_codes, categories = pd.factorize(pd.Series(values, dtype=object))
+    codes = np.asarray(codes)
+    row_codes = np.where(codes < 0, -1, value_codes[codes])
+    categorical = pd.Categorical.from_codes(row_codes, categories=pd.Index(categories, dtype=object))
+    return categorical.remove_unused_categories()
+
+
+def like(template, values):
+    """
+    values (a Categorical) as a Series shaped like template: categorical if
+    template is, object otherwise.
+    """
+    if not isinstance(template.dtype, pd.CategoricalDtype):
+        values = np.asarray(values, dtype=object)
+    return pd.Series(values, index=template.index, name=template.name)
+
+
+def concat_frames(frames):
+    """
+    pd.concat(frames, ignore_index=True) that keeps categorical columns
+    categorical when the frames have different categories.
+    """
+    frames = list(frames)
+    if len(frames) > 1:
+        for col, dtype in frames[0].dtypes.items():
+            if not isinstance(dtype, pd.CategoricalDtype):
+                continue
+            if not all(col in f.columns and isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames):
+                continue
+            union = union_categoricals([f[col].array for f in frames]).categories
+            frames = [f.assign(**{col: f[col].cat.set_categories(union)}) for f in frames]
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def arrow_types_mapper(arrow_type):
+    """
+    types_mapper for Table.to_pandas() bringing Arrow-backed string columns
+    (large_string) back as such instead of as Python strings.
+    """
+    import pyarrow as pa
+
+    if arrow_type == pa.large_string():
+        return pd.StringDtype("pyarrow")
+    return None
+
+
+def output_codes(values):
+    """
+    Factorizes a column for writing: returns (codes, distinct values as plain
+    Python objects), code -1 marking missing cells. Compact columns are only
+    converted to Python objects once per distinct value.
+    """
+    if not is_compact(values):
+        values = pd.Series(values.tolist(), dtype=object)
+    codes, uniques = pd.factorize(values)
+    return codes, np.asarray(uniques, dtype=object).tolist()
+
+
+def plain_arrow_table(table):
+    """
+    Table with dictionary columns decoded and large strings cast to string, so
+    compact frames give the same parquet/arrow schema (and pandas metadata) as
+    object ones.
+    """
+    import json
+
+    import pyarrow as pa
+
+    changed = set()
+    for i, field in enumerate(table.schema):
+        target = field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+        if pa.types.is_large_string(target):
+            target = pa.string()
+        if target != field.type:
+            table = table.set_column(i, field.name, table.column(i).cast(target))
+            changed.add(field.name)
+
+    metadata = table.schema.metadata or {}
+    if changed and b'pandas' in metadata:
+        pandas_metadata = json.loads(metadata[b'pandas'])
+        for column in pandas_metadata.get('columns', []):
+            if column.get('field_name') in changed:
+                column.update(pandas_type='unicode', numpy_type='object', metadata=None)
+        table = table.replace_schema_metadata({**metadata, b'pandas': json.dumps(pandas_metadata).encode('utf-8')})
+    return table
@@ -0,0 +1,398 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# === Per-stage instrumentation of the processing pipeline ===
+# A pipeline_report() opened around the processing of one file collects a record
+# for every stage run inside it: wall time, rows in/out and, when memory tracing
+# is on, the peak memory allocated during the stage. Stages are marked with the
+# stage() context manager or the @instrumented decorator; outside of a report they
+# cost one context variable lookup. The report is printed as one JSON log line
+# when it closes.
+#
+# Work split across worker processes (sharding) runs each part inside a report of
+# its own, opened with part=True: it is neither logged nor published, and the
+# side-car outputs of its stages are kept in report.deferred instead of being
+# written. merge_parts() adds the parts to the parent's report, the stages of all
+# parts folded into one record each (rows summed, the slowest part's seconds and
+# the largest peak memory), and hands their deferred outputs to the mergers
+# registered with add_output_merger(), which write them from the parent process.
+
+_CURRENT = contextvars.ContextVar("pipeline_report", default=None)
+
+MIB = 1024 * 1024
+
+# Size limit of the X-Pipeline-Report summary; proxies reject large response
+# headers (nginx answers 502 past its 4k proxy_buffer_size)
+REPORT_HEADER_MAX_BYTES = 1024
+
+
+def trace_memory_from_env():
+    """
+    Per-stage peak memory needs tracemalloc, which slows allocation-heavy stages
+    down; it is only on when SANDRA_TRACE_MEMORY is set to 1/true/yes.
+    """
+    return os.environ.get("SANDRA_TRACE_MEMORY", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _rows(value):
+    try:
+        return len(value) if hasattr(value, "shape") else None
+    except TypeError:
+        return None
+
+
+def _max_rss_mib():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (MIB if sys.platform == "darwin" else 1024), 1)
+
+
+class StageRecord:
+    """
+    One stage of a report. rows_out defaults to rows_in (row-wise stages);
+    call done(df) to record the rows of the stage's result.
+    """
+
+    def __init__(self, name, depth, rows_in=None):
+        self.name = name
+        self.depth = depth
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.seconds = None
+        self.peak_mib = None
+        self._child_peak = 0
+
+    def done(self, result):
+        self.rows_out = _rows(result)
+
+    def to_dict(self):
+        entry = {
+            "stage": self.name,
+            "seconds": round(self.seconds, 4) if self.seconds is not None else None,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out if self.rows_out is not None else self.rows_in,
+        }
+        if self.depth:
+            entry["depth"] = self.depth
+        if self.peak_mib is not None:
+            entry["peak_mib"] = self.peak_mib
+        return entry
+
+
+class PipelineReport:
+    """
+    Stage records of one pipeline run, in the order the stages started, plus
+    the counters reported by the stages, the processing modes they switched to
+    and the side-car files they wrote.
+    deferred is None, or for the report of a part run in a worker process, a
+    dict of the side-car outputs left to the parent ({output name: [data]}).
+    """
+
+    def __init__(self, source=None, trace_memory=False, part=False):
+        self.source = source
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.seconds = None
+        self.error = None
+        self.warnings = []
+        self.counters = {}
+        self.modes = {}
+        self.outputs = {}
+        self.deferred = {} if part else None
+        self._stack = []
+        self._started = time.perf_counter()
+
+    def to_dict(self):
+        report = {
+            "source": self.source,
+            "seconds": round(self.seconds, 4) if self.seconds is not None else None,
+            "stages": [record.to_dict() for record in self.stages],
+            "max_rss_mib": _max_rss_mib(),
+        }
+        if self.warnings:
+            report["warnings"] = list(self.warnings)
+        if self.counters:
+            report["counters"] = {
+                section: {key: {field: round(value, 6) if isinstance(value, float) else value
+                                for field, value in fields.items()}
+                          for key, fields in counts.items()}
+                for section, counts in self.counters.items()
+            }
+        if self.modes:
+            report["modes"] = dict(self.modes)
+        if self.outputs:
+            report["outputs"] = dict(self.outputs)
+        if self.error:
+            report["error"] = self.error
+        return report
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+
+def current_report():
+    return _CURRENT.get()
+
+
+def report_warning(message):
+    """
+    Prints a warning about the data being processed and adds it to the current
+    report, if any.
+    """
+    print(f"⚠️ {message}")
+    report = _CURRENT.get()
+    if report is not None:
+        report.warnings.append(message)
+
+
+def report_mode(name, value=True):
+    """
+    Records in the current report, if any, a processing mode the run switched
+    to that changes its output (e.g. out_of_core).
+    """
+    report = _CURRENT.get()
+    if report is not None:
+        report.modes[name] = value
+
+
+def report_counters(section, counts):
+    """
+    Adds counts ({key: {field: number}}) to the section of the current report,
+    if any, summing them with the counts already there.
+    """
+    report = _CURRENT.get()
+    if report is None:
+        return
+    target = report.counters.setdefault(section, {})
+    for key, fields in counts.items():
+        entry = target.setdefault(key, {})
+        for field, value in fields.items():
+            entry[field] = entry.get(field, 0) + value
+
+
+_LISTENERS = []
+
+
+def add_report_listener(listener):
+    """
+    Registers listener(report_dict), called for every report closed in this
+    process and every report handed over by publish_report().
+    """
+    _LISTENERS.append(listener)
+
+
+def publish_report(report):
+    """
+    Passes a report dict to the listeners. Used for reports closed in worker
+    processes once their result is back in the web process.
+    """
+    for listener in _LISTENERS:
+        try:
+            listener(report)
+        except Exception as e:
+            print(f"❌ Report listener failed: {e}")
+
+
+_OUTPUT_MERGERS = {}
+
+
+def add_output_merger(name, merger):
+    """
+    Registers merger(data), called in the parent process by merge_parts() for
+    the side-car output name deferred by every part.
+    """
+    _OUTPUT_MERGERS[name] = merger
+
+
+def merge_parts(parts):
+    """
+    Adds the reports of parts of the current stage run in worker processes
+    ((report dict, deferred outputs) pairs) to the current report: their stages
+    nested under the open stage, one record per stage name and depth with the
+    rows summed and the largest seconds and peak memory; their counters summed,
+    their warnings once each, and their deferred outputs handed to the mergers.
+    """
+    report = _CURRENT.get()
+    if report is None:
+        return
+    depth = len(report._stack)
+    merged = {}
+    for part, deferred in parts:
+        for entry in part.get("stages", []):
+            key = (entry["stage"], entry.get("depth", 0))
+            record = merged.get(key)
+            if record is None:
+                record = merged[key] = StageRecord(entry["stage"], depth + key[1], entry["rows_in"])
+                record.rows_out = entry["rows_out"]
+                record.seconds = entry["seconds"]
+                record.peak_mib = entry.get("peak_mib")
+                report.stages.append(record)
+                continue
+            record.rows_in = _add(record.rows_in, entry["rows_in"])
+            record.rows_out = _add(record.rows_out, entry["rows_out"])
+            record.seconds = _max(record.seconds, entry["seconds"])
+            record.peak_mib = _max(record.peak_mib, entry.get("peak_mib"))
+
+        for section, counts in part.get("counters", {}).items():
+            report_counters(section, counts)
+        for message in part.get("warnings", []):
+            if message not in report.warnings:
+                report.warnings.append(message)
+        for name, items in (deferred or {}).items():
+            merger = _OUTPUT_MERGERS.get(name)
+            if merger is not None:
+                for data in items:
+                    merger(data)
+
+
+def _add(a, b):
+    return b if a is None else a if b is None else a + b
+
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+@contextmanager
+def pipeline_report(source=None, trace_memory=None, log=True, part=False):
+    """
+    Collects the stages run inside the block. The report is printed as a JSON
+    line (event 'pipeline_report') when the block exits, unless log is False.
+    part=True opens the report of a part of a run in a worker process, see
+    merge_parts().
+    """
+    if trace_memory is None:
+        trace_memory = trace_memory_from_env()
+    report = PipelineReport(source, trace_memory, part)
+
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    token = _CURRENT.set(report)
+    try:
+        yield report
+    except BaseException as e:
+        report.error = str(e) or type(e).__name__
+        raise
+    finally:
+        _CURRENT.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+        report.seconds = time.perf_counter() - report._started
+        if not part:
+            report_dict = report.to_dict()
+            if log:
+                print(json.dumps({"event": "pipeline_report", **report_dict},
+                                 ensure_ascii=False, separators=(",", ":")), flush=True)
+            publish_report(report_dict)
+
+
+@contextmanager
+def stage(name, df=None):
+    """
+    Marks a pipeline stage. Yields a StageRecord (or None outside of a report);
+    df, if given, is the stage's input and sets rows_in.
+    """
+    report = _CURRENT.get()
+    if report is None:
+        yield None
+        return
+
+    record = StageRecord(name, len(report._stack), _rows(df))
+    report.stages.append(record)
+
+    tracing = report.trace_memory and tracemalloc.is_tracing()
+    if tracing:
+        baseline, peak = tracemalloc.get_traced_memory()
+        # Keep the enclosing stages' peak so far before resetting it for this one
+        for parent in report._stack:
+            parent._child_peak = max(parent._child_peak, peak)
+        tracemalloc.reset_peak()
+    report._stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - start
+        report._stack.pop()
+        if tracing:
+            # Inner stages reset the peak, so they hand theirs up to the enclosing stages
+            peak = max(tracemalloc.get_traced_memory()[1], record._child_peak)
+            record.peak_mib = round(max(peak - baseline, 0) / MIB, 1)
+            for parent in report._stack:
+                parent._child_peak = max(parent._child_peak, peak)
+
+
+def instrumented(name):
+    """
+    Decorator recording every call of a stage function. Rows in are taken from
+    the first argument and rows out from the result, when they are DataFrames
+    or Series (functions that work in place keep rows_out = rows_in).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _CURRENT.get() is None:
+                return func(*args, **kwargs)
+            with stage(name, args[0] if args else None) as record:
+                result = func(*args, **kwargs)
+                if _rows(result) is not None:
+                    record.done(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def report_rows(report):
+    """
+    Rows of the file a report dict was made for: the rows read, or the rows
+    into its first stage that has a count. None when no stage has one.
+    """
+    rows = None
+    for record in report.get("stages", []):
+        if record["stage"] == "read_excel":
+            return record.get("rows_out")
+        if rows is None and record.get("rows_in") is not None:
+            rows = record["rows_in"]
+    return rows
+
+
+def report_header(reports):
+    """
+    Value of the X-Pipeline-Report response header for the report dicts of a
+    request (None for cache hits): a JSON list with the source, seconds and
+    rows of every file. The full reports go in the zip manifest and the job
+    status instead. None when the summary is over REPORT_HEADER_MAX_BYTES.
+    """
+    summary = [
+        {"source": report["source"], "seconds": report["seconds"], "rows": report_rows(report)}
+        if report else None
+        for report in reports
+    ]
+    value = json.dumps(summary, ensure_ascii=True, separators=(",", ":"))
+    return value if len(value) <= REPORT_HEADER_MAX_BYTES else None
+
+
+def wants_report(request):
+    """
+    True when a Flask request asks for the report summary in a response
+    header, with a 'report' parameter or an 'X-Pipeline-Report: 1' header, or
+    when SANDRA_REPORT_HEADER is set to 1.
+    """
+    values = (
+        request.values.get("report", ""),
+        request.headers.get("X-Pipeline-Report", ""),
+        os.environ.get("SANDRA_REPORT_HEADER", ""),
+    )
+    return any(str(v).strip().lower() in ("1", "true", "yes", "on") for v in values)
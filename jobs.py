@@ -0,0 +1,427 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from output_formats import output_extension
+from instrumentation import pipeline_report, publish_report
+from result_cache import cacheable
+
+
+# === Asynchronous processing jobs ===
+# Uploads submitted as a job are moved into their own folder under the job directory
+# and handed to a bounded pool of worker processes. Job state lives in a local SQLite
+# file next to them, so no external broker is needed. Only the web process writes to
+# the store: workers just return their output path and a completion callback records it.
+
+DEFAULT_JOB_DIR = "jobs"
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_JOB_TTL = 24 * 60 * 60  # finished jobs and their files are kept for a day
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+NO_PATTERNS_IN_FILE = "No patterns were identified in the file."
+
+
+def job_settings_from_env():
+    """
+    Job directory, pool size and retention, overridable with SANDRA_JOB_DIR,
+    SANDRA_JOB_WORKERS and SANDRA_JOB_TTL (seconds).
+    """
+    job_dir = os.environ.get("SANDRA_JOB_DIR", DEFAULT_JOB_DIR)
+    try:
+        workers = max(1, int(os.environ.get("SANDRA_JOB_WORKERS", DEFAULT_JOB_WORKERS)))
+    except ValueError:
+        workers = DEFAULT_JOB_WORKERS
+    try:
+        ttl = max(0, int(os.environ.get("SANDRA_JOB_TTL", DEFAULT_JOB_TTL)))
+    except ValueError:
+        ttl = DEFAULT_JOB_TTL
+    return job_dir, workers, ttl
+
+
+class JobStore:
+    """
+    SQLite-backed table of jobs: status, inputs, outputs and error messages.
+    outputs and file_errors hold one entry per input, None where it does not apply.
+    """
+
+    def __init__(self, job_dir=DEFAULT_JOB_DIR):
+        self.job_dir = os.path.abspath(job_dir)
+        self.db_path = os.path.join(self.job_dir, "jobs.sqlite3")
+        self._lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _initialize(self):
+        # Done on first use rather than at import: worker processes that import
+        # the app must not touch the store, least of all fail the running jobs
+        os.makedirs(self.job_dir, exist_ok=True)
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    output_format TEXT NOT NULL,
+                    inputs TEXT NOT NULL,
+                    outputs TEXT NOT NULL DEFAULT '[]',
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    finished_at REAL,
+                    file_errors TEXT NOT NULL DEFAULT '[]',
+                    reports TEXT NOT NULL DEFAULT '[]'
+                )
+                """
+            )
+            # Stores created before per-file errors were recorded
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "file_errors" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN file_errors TEXT NOT NULL DEFAULT '[]'")
+            # and before pipeline reports were
+            if "reports" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN reports TEXT NOT NULL DEFAULT '[]'")
+            # Jobs left unfinished by a previous run will never complete
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?)",
+                (FAILED, "Interrupted by a server restart", time.time(), QUEUED, RUNNING),
+            )
+
+    def _connect(self):
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    self._initialize()
+                    self._ready = True
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def job_folder(self, job_id):
+        return os.path.join(self.job_dir, job_id)
+
+    def create(self, job_id, inputs, output_format):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, output_format, inputs, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, output_format, json.dumps(inputs), time.time()),
+            )
+
+    def finish(self, job_id, outputs=None, error=None, file_errors=None, reports=None):
+        status = FAILED if error else DONE
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, outputs = ?, error = ?, file_errors = ?, reports = ?, finished_at = ? "
+                "WHERE id = ?",
+                (status, json.dumps(outputs or []), error, json.dumps(file_errors or []),
+                 json.dumps(reports or [], ensure_ascii=False), time.time(), job_id),
+            )
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, status, output_format, inputs, outputs, error, created_at, finished_at, file_errors, "
+                "reports FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "status": row[1],
+            "output_format": row[2],
+            "inputs": json.loads(row[3]),
+            "outputs": json.loads(row[4]),
+            "error": row[5],
+            "created_at": row[6],
+            "finished_at": row[7],
+            "file_errors": json.loads(row[8]),
+            "reports": json.loads(row[9]),
+        }
+
+    def prune(self, ttl):
+        """
+        Deletes finished jobs older than ttl seconds together with their files.
+        """
+        cutoff = time.time() - ttl
+        with self._lock, self._connect() as conn:
+            expired = [
+                row[0] for row in conn.execute(
+                    "SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                    (DONE, FAILED, cutoff),
+                )
+            ]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+        for job_id in expired:
+            shutil.rmtree(self.job_folder(job_id), ignore_errors=True)
+        return len(expired)
+
+
+def _run_job(process, input_paths, output_format, output_folder):
+    """
+    Worker-side body of a job: processes every input and moves each output into
+    the job folder. Returns one output path and one error per input (None where
+    nothing was produced, or where nothing went wrong) and the stage reports of
+    the inputs. A failing input does not stop the others.
+    """
+    outputs = []
+    errors = []
+    reports = []
+    for input_path in input_paths:
+        output_path, error = None, None
+        try:
+            with pipeline_report(os.path.basename(input_path)) as report:
+                output_path = process(input_path, output_format=output_format)
+        except (Exception, SystemExit) as e:
+            error = _error_message(e)
+        reports.append(report.to_dict())
+        if output_path and os.path.isfile(output_path):
+            final_path = os.path.join(output_folder, os.path.basename(output_path))
+            shutil.move(output_path, final_path)
+            outputs.append(final_path)
+        else:
+            outputs.append(None)
+            error = error or NO_PATTERNS_IN_FILE
+        errors.append(error)
+    return outputs, errors, reports
+
+
+def _run_one(process, input_path, output_format):
+    with pipeline_report(os.path.basename(input_path)) as report:
+        output_path = process(input_path, output_format=output_format)
+    return output_path, report.to_dict()
+
+
+def _error_message(e):
+    # The processing functions print their error and call exit(), which leaves no message
+    if isinstance(e, SystemExit):
+        return "Processing failed, see the server log"
+    return str(e) or type(e).__name__
+
+
+class JobRunner:
+    """
+    Bounded pool of worker processes feeding a JobStore.
+
+    process(input_path, output_format=...) must be a module-level function (it is sent
+    to the workers by reference) that returns the path of the output it wrote.
+    on_output(outputs, output_format, context), if given, runs in the web process
+    once a job succeeds, with one output path (or None) per input and the context
+    passed to submit(). Outputs the result cache must not keep (see
+    result_cache.cacheable) are passed as None.
+    """
+
+    def __init__(self, store, process, workers=DEFAULT_JOB_WORKERS, ttl=DEFAULT_JOB_TTL, on_output=None):
+        self.store = store
+        self.process = process
+        self.workers = workers
+        self.ttl = ttl
+        self.on_output = on_output
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def submit(self, upload_paths, output_format, context=None):
+        """
+        Moves the uploaded files into a new job folder, queues the job and returns its id.
+        """
+        self.store.prune(self.ttl)
+
+        job_id = uuid.uuid4().hex
+        folder = self.store.job_folder(job_id)
+        os.makedirs(folder)
+        input_folder = os.path.join(folder, "input")
+        os.makedirs(input_folder)
+
+        inputs = []
+        for upload_path in upload_paths:
+            input_path = os.path.join(input_folder, os.path.basename(upload_path))
+            shutil.move(upload_path, input_path)
+            inputs.append(input_path)
+
+        self.store.create(job_id, inputs, output_format)
+        future = self._pool().submit(_run_job, self.process, inputs, output_format, folder)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finished(job_id, output_format, context, f))
+        return job_id
+
+    def _finished(self, job_id, output_format, context, future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+        try:
+            outputs, file_errors, reports = future.result()
+        except BaseException as e:
+            error = _error_message(e)
+            print(f"❌ Job {job_id} failed: {error}")
+            self.store.finish(job_id, error=error)
+            return
+        finally:
+            shutil.rmtree(os.path.join(self.store.job_folder(job_id), "input"), ignore_errors=True)
+
+        # Reports closed in the worker process reach the listeners of this one
+        for report in reports:
+            publish_report(report)
+
+        # Outputs stay aligned with the inputs, so a download index names the same file
+        produced = [path for path in outputs if path]
+        if not produced:
+            error = file_errors[0] if len(file_errors) == 1 else "No output was produced for any of the uploaded files."
+            self.store.finish(job_id, error=error, file_errors=file_errors, reports=reports)
+            return
+
+        self.store.finish(job_id, outputs=outputs, file_errors=file_errors, reports=reports)
+        print(f"✅ Job {job_id} done: {len(produced)} of {len(outputs)} output file(s)")
+        if self.on_output is not None:
+            try:
+                self.on_output([path if cacheable(report) else None for path, report in zip(outputs, reports)],
+                               output_format, context)
+            except Exception as e:
+                print(f"❌ Error in output callback of job {job_id}: {e}")
+
+    def run_all(self, input_paths, output_format):
+        """
+        Processes the inputs concurrently in the worker pool and waits for all of
+        them. Returns one (output_path, error, stage report) triple per input, in
+        input order.
+        A single input is processed in the calling process, skipping the pool.
+        """
+        if len(input_paths) == 1:
+            try:
+                output_path, report = _run_one(self.process, input_paths[0], output_format)
+                return [(output_path, None, report)]
+            except (Exception, SystemExit) as e:
+                return [(None, _error_message(e), None)]
+
+        futures = [self._pool().submit(_run_one, self.process, path, output_format) for path in input_paths]
+        results = []
+        for future in futures:
+            try:
+                output_path, report = future.result()
+                publish_report(report)
+                results.append((output_path, None, report))
+            except BaseException as e:
+                results.append((None, _error_message(e), None))
+        return results
+
+    def pending(self):
+        """
+        Number of submitted jobs that have not finished yet.
+        """
+        with self._lock:
+            return len(self._futures)
+
+    def status(self, job_id):
+        """
+        The stored job record, with 'running' reported once a worker has picked it up.
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            future = self._futures.get(job_id)
+        if job["status"] == QUEUED and future is not None and future.running():
+            job["status"] = RUNNING
+        return job
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def wants_async(request):
+    """
+    True when a Flask request asks for job mode, with an 'async' form/query
+    parameter or a 'Prefer: respond-async' header.
+    """
+    flag = str(request.values.get("async", "")).strip().lower()
+    if flag in ("1", "true", "yes", "on"):
+        return True
+    return "respond-async" in request.headers.get("Prefer", "").lower()
+
+
+def job_summary(job):
+    """
+    Public view of a job record, as returned by the status endpoint.
+    """
+    summary = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "output_format": job["output_format"],
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+        "status_url": f"/jobs/{job['id']}",
+    }
+    if job["status"] == DONE:
+        summary["files"] = sum(1 for path in job["outputs"] if path)
+        summary["download_url"] = f"/jobs/{job['id']}/download"
+    if job["error"]:
+        summary["error"] = job["error"]
+    if any(job["file_errors"]):
+        summary["file_errors"] = job["file_errors"]
+    if job.get("reports"):
+        summary["reports"] = job["reports"]  # the pipeline report of every input
+    return summary
+
+
+def job_output(job, index):
+    """
+    The output path of the index-th input of a finished job, and the error
+    explaining why there is none (both None for an index out of range).
+    """
+    if not 0 <= index < len(job["outputs"]):
+        return None, None
+    errors = job["file_errors"]
+    return job["outputs"][index], errors[index] if index < len(errors) else None
+
+
+def process_uploads(runner, cache, input_paths, output_format, upload_names=None):
+    """
+    Synchronous processing of uploaded files: cache hits are answered from the
+    result cache and the misses run concurrently through runner.run_all().
+
+    Returns one result per input, in input order, as a dict with the upload name,
+    the output path (None if nothing was produced), the cache status and key, the
+    error and the stage report of the run (None for cache hits).
+    """
+    extension = output_extension(output_format)
+    upload_names = upload_names or [os.path.basename(path) for path in input_paths]
+
+    results = []
+    misses = []
+    for input_path, name in zip(input_paths, upload_names):
+        cache_key = cache.key_for(input_path, output_format) if cache.enabled else None
+        output_path = cache.get(cache_key, extension) if cache_key else None
+        result = {"file": name, "output": output_path, "cache": "HIT" if output_path else "MISS",
+                  "key": cache_key, "error": None, "report": None}
+        results.append(result)
+        if not output_path:
+            misses.append((input_path, cache_key, result))
+
+    if misses:
+        outputs = runner.run_all([input_path for input_path, _, _ in misses], output_format)
+        for (_, cache_key, result), (output_path, error, report) in zip(misses, outputs):
+            if output_path and os.path.isfile(output_path):
+                result["output"] = output_path
+                if cache_key and cacheable(report):
+                    cache.put(cache_key, output_path, extension)
+            result["error"] = error
+            result["report"] = report
+
+    return results
+
+
+def job_runner_from_env(process, on_output=None):
+    job_dir, workers, ttl = job_settings_from_env()
+    return JobRunner(JobStore(job_dir), process, workers, ttl, on_output)
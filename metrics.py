@@ -0,0 +1,245 @@
+import bisect
+import threading
+import time
+
+from instrumentation import add_report_listener, report_rows
+
+
+# === In-process metrics in the Prometheus text format ===
+# Counters, gauges and histograms live in this process (one registry per worker
+# when the app runs under several processes) and are rendered by GET /metrics.
+# Request metrics come from Flask hooks, file, stage and token rule metrics from
+# the pipeline reports, and cache/job figures are read at scrape time.
+
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._values.items())
+        lines = self.header()
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [le])} {cumulative}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [inf])} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The service's metrics. Collectors are called at scrape time to refresh
+    gauges that mirror other components (result cache, job pool).
+    """
+
+    def __init__(self):
+        self.requests = Counter("sandra_http_requests_total", "HTTP requests handled.",
+                                ("endpoint", "method", "status"))
+        self.request_seconds = Histogram("sandra_http_request_duration_seconds", "HTTP request latency.",
+                                         ("endpoint",), REQUEST_BUCKETS)
+        self.in_flight = Gauge("sandra_http_requests_in_flight", "HTTP requests being handled.", ("endpoint",))
+        self.request_bytes = Counter("sandra_http_request_bytes_total", "Bytes received in request bodies (uploads).",
+                                     ("endpoint",))
+        self.files = Counter("sandra_files_processed_total", "Files run through the pipeline.", ("result",))
+        self.rows = Counter("sandra_rows_processed_total", "Rows read from processed files.")
+        self.file_seconds = Histogram("sandra_file_processing_seconds", "Pipeline time per file.", (), REQUEST_BUCKETS)
+        self.stage_seconds = Histogram("sandra_stage_duration_seconds", "Pipeline stage duration.",
+                                       ("stage",), STAGE_BUCKETS)
+        self.rule_tokens = Counter("sandra_token_rule_tokens_total",
+                                   "Distinct tokens decided by each token removal rule ('kept': by none).", ("rule",))
+        self.rule_hits = Counter("sandra_token_rule_hits_total", "Token occurrences removed by each rule.", ("rule",))
+        self.rule_seconds = Counter("sandra_token_rule_seconds_total",
+                                    "Time spent matching the tokens decided by each rule.", ("rule",))
+        self.cache = Gauge("sandra_result_cache", "Result cache counters and size (hits, misses, evictions, "
+                           "entries, size_bytes).", ("field",))
+        self.jobs = Gauge("sandra_jobs_pending", "Background jobs queued or running.")
+        self.started = Gauge("sandra_process_start_time_seconds", "Start time of the process (unix epoch).")
+        self.started.set(time.time())
+
+        self.metrics = [
+            self.requests, self.request_seconds, self.in_flight, self.request_bytes,
+            self.files, self.rows, self.file_seconds, self.stage_seconds,
+            self.rule_tokens, self.rule_hits, self.rule_seconds,
+            self.cache, self.jobs, self.started,
+        ]
+        self.collectors = []
+
+    def observe_report(self, report):
+        """
+        Records a pipeline report (as returned by PipelineReport.to_dict()).
+        """
+        self.files.inc(result="error" if report.get("error") else "ok")
+        if report.get("seconds") is not None:
+            self.file_seconds.observe(report["seconds"])
+
+        for record in report.get("stages", []):
+            if record.get("seconds") is not None:
+                self.stage_seconds.observe(record["seconds"], stage=record["stage"])
+        rows = report_rows(report)
+        if rows:
+            self.rows.inc(rows)
+
+        for rule, counts in report.get("counters", {}).get("token_rules", {}).items():
+            self.rule_tokens.inc(counts.get("tokens", 0), rule=rule)
+            self.rule_seconds.inc(counts.get("seconds", 0), rule=rule)
+            if "hits" in counts:
+                self.rule_hits.inc(counts["hits"], rule=rule)
+
+    def render(self):
+        for collect in self.collectors:
+            try:
+                collect(self)
+            except Exception as e:
+                print(f"❌ Metrics collector failed: {e}")
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def install_metrics(app, result_cache=None, job_runner=None, registry=None):
+    """
+    Adds request hooks and a GET /metrics route to a Flask app, and subscribes the
+    registry to pipeline reports closed in this process. Returns the registry.
+    """
+    from flask import Response, g, request
+
+    registry = registry or MetricsRegistry()
+    add_report_listener(registry.observe_report)
+
+    if result_cache is not None:
+        def collect_cache(reg):
+            stats = result_cache.stats()
+            for field in ("hits", "misses", "evictions", "entries", "size_bytes"):
+                reg.cache.set(stats[field], field=field)
+        registry.collectors.append(collect_cache)
+
+    if job_runner is not None:
+        registry.collectors.append(lambda reg: reg.jobs.set(job_runner.pending()))
+
+    def endpoint():
+        return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    @app.before_request
+    def _start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_endpoint = endpoint()
+        registry.in_flight.inc(endpoint=g.metrics_endpoint)
+
+    @app.after_request
+    def _record_request_metrics(response):
+        name = g.get("metrics_endpoint", endpoint())
+        registry.requests.inc(endpoint=name, method=request.method, status=response.status_code)
+        if "metrics_start" in g:
+            registry.request_seconds.observe(time.perf_counter() - g.metrics_start, endpoint=name)
+        if request.content_length:
+            registry.request_bytes.inc(request.content_length, endpoint=name)
+        return response
+
+    @app.teardown_request
+    def _end_request_metrics(exc):
+        if "metrics_endpoint" in g:
+            registry.in_flight.dec(endpoint=g.pop("metrics_endpoint"))
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), mimetype=CONTENT_TYPE.split(";")[0],
+                        headers={"Content-Type": CONTENT_TYPE})
+
+    return registry
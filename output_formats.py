@@ -0,0 +1,241 @@
+import json
+import os
+import tempfile
+import zipfile
+
+import pandas as pd
+
+from amounts import amounts_to_units
+from frame_dtypes import plain_arrow_table
+from instrumentation import instrumented
+from xlsx_writer import write_excel_chunks, write_excel_with_pivot
+
+
+# === Output formats for processed statements ===
+# name -> (file extension, MIME type)
+OUTPUT_FORMATS = {
+    "xlsx": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.file"),
+    "csv": (".csv", "text/csv"),
+}
+DEFAULT_OUTPUT_FORMAT = "xlsx"
+
+# Other names accepted for the format parameter
+FORMAT_ALIASES = {
+    "excel": "xlsx",
+    "pq": "parquet",
+    "ipc": "arrow",
+    "feather": "arrow",
+}
+
+
+def normalize_output_format(output_format):
+    """
+    Returns the canonical format name, or raises ValueError for an unknown one.
+    """
+    if not output_format:
+        return DEFAULT_OUTPUT_FORMAT
+    name = str(output_format).strip().lower().lstrip('.')
+    name = FORMAT_ALIASES.get(name, name)
+    if name not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format '{output_format}'. "
+                         f"Use one of: {', '.join(OUTPUT_FORMATS)}")
+    return name
+
+
+def output_format_from_request(request):
+    """
+    Picks the output format of a Flask request: a 'format' form/query parameter
+    wins, otherwise the best match in the Accept header, otherwise xlsx.
+    """
+    explicit = request.values.get("format")
+    if explicit:
+        return normalize_output_format(explicit)
+
+    mimetypes = [mime for _, mime in OUTPUT_FORMATS.values()]
+    best = request.accept_mimetypes.best_match(mimetypes)
+    for name, (_, mime) in OUTPUT_FORMATS.items():
+        if mime == best:
+            return name
+    return DEFAULT_OUTPUT_FORMAT
+
+
+def output_extension(output_format):
+    return OUTPUT_FORMATS[normalize_output_format(output_format)][0]
+
+
+def output_mimetype(output_format):
+    return OUTPUT_FORMATS[normalize_output_format(output_format)][1]
+
+
+def _arrow_table(df):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("pyarrow is required for parquet and arrow output (pip install pyarrow)")
+    return plain_arrow_table(pa.Table.from_pandas(df, preserve_index=False))
+
+
+@instrumented("write_output")
+def write_output(df, output_path, output_format=DEFAULT_OUTPUT_FORMAT, pivot_fields=None):
+    """
+    Writes the processed DataFrame in the requested format, with its amounts in
+    currency units. The pivot sheet is only built for xlsx; pivot_fields may be a
+    dict or a callable taking the columns.
+    """
+    output_format = normalize_output_format(output_format)
+    df = amounts_to_units(df)
+
+    if output_format == "xlsx":
+        write_excel_with_pivot(df, output_path, pivot_fields)
+    elif output_format == "csv":
+        df.to_csv(output_path, index=False, encoding="utf-8")
+    elif output_format == "parquet":
+        table = _arrow_table(df)
+        import pyarrow.parquet as pq
+        pq.write_table(table, output_path)
+    elif output_format == "arrow":
+        table = _arrow_table(df)
+        import pyarrow as pa
+        with pa.OSFile(output_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    return output_path
+
+
+def write_output_chunks(chunks, output_path, output_format=DEFAULT_OUTPUT_FORMAT, pivot_fields=None):
+    """
+    write_output for a processed statement that arrives as an iterable of
+    DataFrame chunks with the same columns; each chunk is appended to the file
+    as it arrives.
+    """
+    output_format = normalize_output_format(output_format)
+    chunks = (amounts_to_units(chunk) for chunk in chunks)
+
+    if output_format == "xlsx":
+        return write_excel_chunks(chunks, output_path, pivot_fields)
+
+    if output_format == "csv":
+        with open(output_path, "w", encoding="utf-8", newline="") as fh:
+            for n, chunk in enumerate(chunks):
+                chunk.to_csv(fh, index=False, header=n == 0)
+        return output_path
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = sink = None
+    try:
+        for chunk in chunks:
+            table = _arrow_table(chunk)
+            if writer is None:
+                schema = table.schema
+                if output_format == "parquet":
+                    writer = pq.ParquetWriter(output_path, schema)
+                else:
+                    sink = pa.OSFile(output_path, "wb")
+                    writer = pa.ipc.new_file(sink, schema)
+            # A column that is empty in one chunk may be typed differently there
+            writer.write_table(table.cast(schema))
+        if writer is None:
+            write_output(pd.DataFrame(), output_path, output_format)
+    finally:
+        if writer is not None:
+            writer.close()
+        if sink is not None:
+            sink.close()
+    return output_path
+
+
+def _temp_output_path(output_format):
+    temp_file = tempfile.NamedTemporaryFile(suffix=output_extension(output_format), delete=False)
+    temp_file.close()
+    return temp_file.name
+
+
+def write_temp_output(df, output_format=DEFAULT_OUTPUT_FORMAT, pivot_fields=None):
+    """
+    Writes the processed DataFrame to a new temporary file and returns its path.
+    """
+    return write_output(df, _temp_output_path(output_format), output_format, pivot_fields)
+
+
+def write_temp_output_chunks(chunks, output_format=DEFAULT_OUTPUT_FORMAT, pivot_fields=None):
+    """
+    write_temp_output for a statement processed chunk by chunk (see write_output_chunks).
+    """
+    return write_output_chunks(chunks, _temp_output_path(output_format), output_format, pivot_fields)
+
+
+def remove_files(paths):
+    for path in set(paths):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def send_and_remove(path, download_name, mimetype, remove_paths=(), chunk_size=1024 * 1024):
+    """
+    Flask response streaming a file as an attachment. The file and remove_paths
+    are deleted once the body has been sent (or the client went away); send_file
+    hands the file straight to the server and gives no such hook.
+    """
+    from flask import Response
+
+    def stream():
+        try:
+            with open(path, "rb") as fh:
+                for block in iter(lambda: fh.read(chunk_size), b""):
+                    yield block
+        finally:
+            remove_files([path, *remove_paths])
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="{download_name}"',
+        "Content-Length": str(os.path.getsize(path)),
+    }
+    return Response(stream(), mimetype=mimetype, headers=headers)
+
+
+def write_temp_zip(results, output_format=DEFAULT_OUTPUT_FORMAT):
+    """
+    Bundles the outputs of several uploads into one temporary zip archive and
+    returns its path. Each output is named after its upload; manifest.json lists
+    every upload with its status ('ok', 'failed' or 'empty'), archive name,
+    cache status, error and pipeline report.
+    """
+    extension = output_extension(output_format)
+    # xlsx, parquet and arrow are already compressed
+    compression = zipfile.ZIP_DEFLATED if output_format == "csv" else zipfile.ZIP_STORED
+
+    temp_file = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+    temp_file.close()
+
+    manifest = []
+    used_names = set()
+    with zipfile.ZipFile(temp_file.name, "w", compression) as zf:
+        for result in results:
+            entry = {"file": result["file"], "cache": result.get("cache")}
+            if result["output"]:
+                stem = os.path.splitext(result["file"])[0] or "output"
+                arcname = stem + extension
+                n = 1
+                while arcname in used_names or arcname == "manifest.json":
+                    arcname = f"{stem}_{n}{extension}"
+                    n += 1
+                used_names.add(arcname)
+                zf.write(result["output"], arcname)
+                entry.update(status="ok", output=arcname)
+            elif result.get("error"):
+                entry.update(status="failed", error=result["error"])
+            else:
+                entry.update(status="empty", error="No patterns were identified in this file.")
+            if result.get("report"):
+                entry["report"] = result["report"]
+            manifest.append(entry)
+        zf.writestr("manifest.json", json.dumps({"format": output_format, "files": manifest}, indent=2, ensure_ascii=False))
+
+    return temp_file.name
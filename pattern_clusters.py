@@ -0,0 +1,178 @@
+import os
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from frame_dtypes import categorical_from_codes, like
+from instrumentation import instrumented
+
+
+# === Near-duplicate pattern clusters ===
+# Patterns that only differ by a reference number ('PAGO CUOTA 12/36' and 'PAGO
+# CUOTA 13/36') end up as different patterns, possibly in different codigo groups.
+# Each distinct pattern is reduced to the set of its tokens with digit runs masked
+# and summarized by a MinHash signature; locality-sensitive hashing on bands of
+# the signature proposes candidate pairs, which are kept when their estimated
+# Jaccard similarity reaches the threshold. Clusters are the connected groups of
+# kept pairs, so the stage runs in about linear time in the number of distinct
+# patterns instead of comparing every pair.
+#
+# Every row gets the id of its pattern's cluster and the cluster's canonical
+# pattern: its most frequent pattern (the first one in the frame on a tie).
+# Hashes are seeded, so the same patterns give the same clusters in any process.
+
+CLUSTER_COL = 'Cluster'
+CANONICAL_COL = 'Canonical pattern'
+
+DEFAULT_CLUSTER_THRESHOLD = 0.7
+NUM_PERM = 64
+# Bands of NUM_PERM // BANDS values: pairs from about 0.5 similarity become candidates
+BANDS = 16
+HASH_PRIME = 4294967311  # smallest prime above 2**32
+SEED = 1
+
+DIGIT_RUN_RE = re.compile(r'\d+')
+
+
+def pattern_clusters_from_env():
+    """
+    The cluster columns are added when SANDRA_PATTERN_CLUSTERS is set to
+    1/true/yes; SANDRA_CLUSTER_THRESHOLD sets the similarity threshold (0-1).
+    Returns (enabled, threshold).
+    """
+    enabled = os.environ.get("SANDRA_PATTERN_CLUSTERS", "").strip().lower() in ("1", "true", "yes", "on")
+    try:
+        threshold = float(os.environ.get("SANDRA_CLUSTER_THRESHOLD", DEFAULT_CLUSTER_THRESHOLD))
+    except ValueError:
+        threshold = DEFAULT_CLUSTER_THRESHOLD
+    return enabled, min(max(threshold, 0.0), 1.0)
+
+
+def pattern_features(pattern):
+    """
+    The tokens of a pattern with every digit run masked, as a set.
+    """
+    return {DIGIT_RUN_RE.sub('0', token) for token in str(pattern).split()}
+
+
+def minhash_signatures(feature_sets, num_perm=NUM_PERM, seed=SEED):
+    """
+    (len(feature_sets), num_perm) uint64 MinHash signatures. Features are hashed
+    once (crc32) and permuted with num_perm seeded universal hashes; an empty
+    set gets a signature of HASH_PRIME values.
+    """
+    vocab = {}
+    flat = []
+    lengths = np.zeros(len(feature_sets), dtype=np.int64)
+    for i, features in enumerate(feature_sets):
+        lengths[i] = len(features)
+        flat.extend(vocab.setdefault(f, len(vocab)) for f in features)
+
+    signatures = np.full((len(feature_sets), num_perm), HASH_PRIME, dtype=np.uint64)
+    nonempty = lengths > 0
+    if not nonempty.any():
+        return signatures
+
+    hashes = np.fromiter((zlib.crc32(f.encode('utf-8')) for f in vocab), dtype=np.uint64, count=len(vocab))
+    flat = np.asarray(flat, dtype=np.int64)
+    starts = (np.cumsum(lengths) - lengths)[nonempty]
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 32, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 32, size=num_perm, dtype=np.uint64)
+    for k in range(num_perm):
+        permuted = (a[k] * hashes + b[k]) % np.uint64(HASH_PRIME)
+        signatures[nonempty, k] = np.minimum.reduceat(permuted[flat], starts)
+    return signatures
+
+
+def _band_keys(signatures, band):
+    """
+    One int64 key per signature for the columns of a band (equal columns give
+    equal keys; a collision only adds a candidate that is then checked).
+    """
+    key = np.zeros(len(signatures), dtype=np.uint64)
+    for col in range(band.start, band.stop):
+        key = key * np.uint64(1000003) + signatures[:, col]
+    return key.view(np.int64)
+
+
+def _connected_labels(n, src, dst):
+    """
+    Component label (the smallest member) of every node of the graph with the
+    given edges, by label propagation with pointer jumping.
+    """
+    labels = np.arange(n)
+    if len(src) == 0:
+        return labels
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, src, labels[dst])
+        np.minimum.at(new, dst, labels[src])
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def cluster_signatures(signatures, threshold=DEFAULT_CLUSTER_THRESHOLD, bands=BANDS):
+    """
+    Cluster label of every signature. Signatures sharing a band are linked to
+    the band bucket's first member when they agree on at least threshold of
+    their values.
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    src, dst = [], []
+    for i in range(bands):
+        keys = _band_keys(signatures, slice(i * rows, (i + 1) * rows))
+        codes, _ = pd.factorize(keys)
+        _, first = np.unique(codes, return_index=True)
+        leader = first[codes]  # the bucket's first member
+        linked = np.flatnonzero(leader != np.arange(n))
+        if len(linked):
+            src.append(linked)
+            dst.append(leader[linked])
+    if not src:
+        return np.arange(n)
+
+    src = np.concatenate(src)
+    dst = np.concatenate(dst)
+    similarity = (signatures[src] == signatures[dst]).mean(axis=1)
+    keep = similarity >= threshold
+    return _connected_labels(n, src[keep], dst[keep])
+
+
+@instrumented("pattern_clusters")
+def add_pattern_clusters(df, pattern_col='Pattren', threshold=DEFAULT_CLUSTER_THRESHOLD):
+    """
+    Adds CLUSTER_COL (cluster ids from 1, in order of first appearance) and
+    CANONICAL_COL (the cluster's most frequent pattern) to df and returns it.
+    Empty patterns form a cluster of their own. The canonical column is
+    categorical when the pattern column is.
+    """
+    patterns = df[pattern_col]
+    codes, distinct = pd.factorize(patterns, use_na_sentinel=False)
+    if len(codes) == 0:
+        df[CLUSTER_COL] = np.zeros(0, dtype=np.int64)
+        df[CANONICAL_COL] = like(patterns, categorical_from_codes(codes, distinct))
+        return df
+
+    # Patterns without any token share a signature no other pattern can have,
+    # so they only cluster with each other
+    labels = cluster_signatures(minhash_signatures([pattern_features(p) for p in distinct]), threshold)
+
+    # Canonical pattern: the most frequent one of each cluster, then the first seen
+    counts = np.bincount(codes, minlength=len(distinct))
+    order = np.lexsort((np.arange(len(distinct)), -counts, labels))
+    is_first = np.r_[True, labels[order][1:] != labels[order][:-1]]
+    canonical = np.empty(labels.max() + 1, dtype=np.int64)
+    canonical[labels[order][is_first]] = order[is_first]
+
+    row_labels = labels[codes]
+    cluster_ids, _ = pd.factorize(row_labels)
+    df[CLUSTER_COL] = cluster_ids + 1
+    df[CANONICAL_COL] = like(patterns, categorical_from_codes(canonical[row_labels], distinct))
+    return df
@@ -0,0 +1,404 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from amounts import AMOUNT_COLUMNS, amounts_to_units, cents_to_units
+from frame_dtypes import has_pyarrow
+from instrumentation import add_report_listener, current_report
+
+
+# === Pattern search over recently processed results ===
+# A processed frame is indexed once, in the web process: its distinct patterns
+# are factorized, every token points to the distinct patterns holding it, and
+# the rows and Credito/Debito cents are grouped per distinct pattern. A search
+# then works on the (few) distinct patterns and only gathers rows for the page
+# it returns, so it answers without touching the workbook or the pipeline.
+#
+# A store only takes frames once the app it was installed on serves a request,
+# so scripts that import the app's module for its processing functions (CLI and
+# folder runs) keep nothing. A run in the serving process itself hands its output
+# frame to the store directly. Runs in its worker processes write it to an
+# Arrow IPC side-car file named in the pipeline report (outputs 'pattern_index');
+# the store, a report listener, loads it when the report reaches the web
+# process, indexes it under the report's source and removes the file. Frames over the
+# store's row limit are not handed over at all. The store keeps the most
+# recently indexed results up to a total number of rows.
+#
+# Results answered from the result cache are not processed again: the indexed
+# frame of a result is kept in the cache next to its output, as a side entry
+# with the INDEX_EXTENSION, and indexed again from there on a cache hit.
+#
+# Side-cars and side entries hold plain Arrow IPC data (Feather), never pickles:
+# a planted or stale file can fail to load but cannot run code, and it reads
+# back across pandas and pyarrow upgrades. Both need pyarrow; without it only
+# runs in the serving process itself are indexed.
+
+DEFAULT_INDEX_ROWS = 1_000_000
+DEFAULT_SEARCH_LIMIT = 100
+MAX_SEARCH_LIMIT = 1000
+SEARCH_MODES = ("all", "any", "exact")
+PATTERN_COL = 'Pattren'
+INDEX_EXTENSION = ".patterns.arrow"
+
+# Stores serving in this process. Its worker processes only write a side-car
+# when their parent is serving, which it tells them (with its row limit) through
+# SERVER_ENV as "<pid>:<max rows>"
+_STORES = []
+_STORES_LOCK = threading.Lock()
+SERVER_ENV = "SANDRA_PATTERN_INDEX_SERVER"
+
+
+def pattern_index_rows_from_env():
+    """
+    Total rows kept indexed for search, SANDRA_PATTERN_INDEX_ROWS (0 disables
+    the index).
+    """
+    try:
+        return max(0, int(os.environ.get("SANDRA_PATTERN_INDEX_ROWS", DEFAULT_INDEX_ROWS)))
+    except ValueError:
+        return DEFAULT_INDEX_ROWS
+
+
+def write_frame(df, path):
+    """
+    Writes df to path as Arrow IPC (Feather), keeping its dtypes (the int64
+    cents among them). Object columns Arrow cannot type (mixed values) are
+    written as strings.
+    """
+    df = df.reset_index(drop=True)
+    try:
+        df.to_feather(path)
+    except (TypeError, ValueError):  # ArrowTypeError / ArrowInvalid
+        text = {col: df[col].map(lambda v: v if pd.isna(v) else str(v))
+                for col in df.columns if df[col].dtype == object}
+        df.assign(**text).to_feather(path)
+
+
+def read_frame(path):
+    return pd.read_feather(path)
+
+
+def _tokens(pattern):
+    return str(pattern).casefold().split()
+
+
+class PatternIndex:
+    """
+    Inverted index of one processed frame, from the tokens of its pattern
+    column to its rows, with the amount totals of every distinct pattern.
+    """
+
+    def __init__(self, df, source=None, pattern_col=PATTERN_COL, amount_columns=AMOUNT_COLUMNS):
+        self.source = source
+        self.frame = df.reset_index(drop=True)
+        codes, distinct = pd.factorize(self.frame[pattern_col], use_na_sentinel=False)
+        self.patterns = [str(p) for p in distinct]
+
+        # Rows of distinct pattern p: row_order[offsets[p]:offsets[p + 1]], in row order
+        self.counts = np.bincount(codes, minlength=len(distinct))
+        self.offsets = np.r_[0, np.cumsum(self.counts)]
+        self.row_order = np.argsort(codes, kind='stable')
+
+        self.postings = {}
+        self.exact = {}
+        for p, pattern in enumerate(self.patterns):
+            tokens = _tokens(pattern)
+            self.exact.setdefault(" ".join(tokens), []).append(p)
+            for token in set(tokens):
+                self.postings.setdefault(token, []).append(p)
+        self.postings = {token: np.asarray(ids, dtype=np.int64) for token, ids in self.postings.items()}
+
+        # Amounts are summed in the int64 cents left by cleaning
+        self.cents = {}
+        for names in amount_columns:
+            col = next((c for c in names if c in self.frame.columns), None)
+            if col is None or self.frame[col].dtype != np.int64:
+                continue
+            sums = np.zeros(len(distinct), dtype=np.int64)
+            np.add.at(sums, codes, self.frame[col].to_numpy())
+            self.cents[col] = sums
+
+    @property
+    def rows(self):
+        return len(self.frame)
+
+    def match(self, query, mode="all"):
+        """
+        Ids of the distinct patterns matching query: holding all its tokens,
+        any of them, or exactly its tokens in order (mode 'exact').
+        Tokens are compared case-insensitively.
+        """
+        tokens = _tokens(query)
+        if not tokens:
+            return np.zeros(0, dtype=np.int64)
+        if mode == "exact":
+            return np.asarray(self.exact.get(" ".join(tokens), []), dtype=np.int64)
+
+        empty = np.zeros(0, dtype=np.int64)
+        lists = [self.postings.get(token, empty) for token in set(tokens)]
+        if mode == "any":
+            return np.unique(np.concatenate(lists))
+        lists.sort(key=len)
+        ids = lists[0]
+        for other in lists[1:]:
+            ids = np.intersect1d(ids, other, assume_unique=True)
+        return ids
+
+    def search(self, query, mode="all", limit=DEFAULT_SEARCH_LIMIT):
+        """
+        Rows matching query (the first limit of them, in row order) with the
+        amount totals and row count of all matches, and the matching patterns
+        by number of rows.
+        """
+        ids = self.match(query, mode)
+        counts = self.counts[ids]
+        rows = np.sort(np.concatenate([self.row_order[self.offsets[p]:self.offsets[p + 1]] for p in ids])
+                       if len(ids) else np.zeros(0, dtype=np.int64))[:limit]
+        page = amounts_to_units(self.frame.iloc[rows])
+
+        by_rows = np.argsort(-counts, kind='stable')[:limit]
+        return {
+            "result": self.source,
+            "query": query,
+            "mode": mode,
+            "rows_matched": int(counts.sum()),
+            "totals": {col: float(cents_to_units(sums[ids].sum())) for col, sums in self.cents.items()},
+            "patterns": [
+                {"pattern": self.patterns[ids[i]], "rows": int(counts[i]),
+                 **{col: float(cents_to_units(sums[ids[i]])) for col, sums in self.cents.items()}}
+                for i in by_rows
+            ],
+            "row_ids": rows.tolist(),
+            "rows": page.astype(object).where(page.notna(), None).to_dict(orient="records"),
+            "truncated": bool(counts.sum() > len(rows)),
+        }
+
+
+class PatternIndexStore:
+    """
+    In-process LRU store of PatternIndex objects keyed by result id (the
+    source of the pipeline report), holding at most max_rows rows in total.
+    """
+
+    def __init__(self, max_rows=DEFAULT_INDEX_ROWS):
+        self.max_rows = max_rows
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_rows > 0
+
+    def add(self, result_id, df):
+        """
+        Indexes df under result_id and evicts the least recently used results
+        beyond max_rows. Returns False when df alone is over the limit.
+        """
+        if not self.enabled or len(df) > self.max_rows:
+            return False
+        index = PatternIndex(df, result_id)
+        with self._lock:
+            self._indexes.pop(result_id, None)
+            self._indexes[result_id] = index
+            total = sum(i.rows for i in self._indexes.values())
+            while total > self.max_rows:
+                _, evicted = self._indexes.popitem(last=False)
+                total -= evicted.rows
+        return True
+
+    def get(self, result_id=None):
+        """
+        The index of result_id (the most recently used one when None), or None.
+        """
+        with self._lock:
+            if result_id is None:
+                return next(reversed(self._indexes.values()), None)
+            index = self._indexes.get(result_id)
+            if index is not None:
+                self._indexes.move_to_end(result_id)
+            return index
+
+    def has(self, result_id):
+        with self._lock:
+            return result_id in self._indexes
+
+    def keep(self, result_id, df):
+        """
+        add() with a log line. Returns True when df was indexed.
+        """
+        if self.add(result_id, df):
+            print(f"🔎 Indexed {len(df)} rows of {result_id} for pattern search")
+            return True
+        print(f"⚠️ {result_id} has more than {self.max_rows} rows and is not indexed for search")
+        return False
+
+    def observe_report(self, report):
+        """
+        Report listener: indexes the side-car frame named in the report. Only
+        the process the store was created for reads it; workers leave it to
+        their parent.
+        """
+        path = report.get("outputs", {}).get("pattern_index")
+        if not path or multiprocessing.parent_process() is not None:
+            return
+        try:
+            self.load(report.get("source"), path)
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def save(self, result_id, path):
+        """
+        Writes the frame indexed under result_id to path as Arrow IPC. Returns
+        False when result_id is not indexed.
+        """
+        with self._lock:
+            index = self._indexes.get(result_id)
+        if index is None:
+            return False
+        write_frame(index.frame, path)
+        return True
+
+    def load(self, result_id, path):
+        """
+        Indexes the frame written at path (Arrow IPC) under result_id.
+        """
+        return self.keep(result_id, read_frame(path))
+
+    def save_to_cache(self, result_id, cache, key):
+        """
+        Keeps the frame indexed under result_id in cache, as the side entry of
+        the output cached under key.
+        """
+        if not key or not cache.enabled or not has_pyarrow() or not self.has(result_id):
+            return
+        fd, path = tempfile.mkstemp(suffix=INDEX_EXTENSION)
+        os.close(fd)
+        try:
+            if self.save(result_id, path):
+                cache.put(key, path, INDEX_EXTENSION)
+        finally:
+            os.remove(path)
+
+    def load_from_cache(self, result_id, cache, key):
+        """
+        Indexes under result_id the frame kept in cache with the output cached
+        under key. Returns False when the cache has no such frame.
+        """
+        if not key or not self.enabled or not has_pyarrow():
+            return False
+        path = cache.get(key, INDEX_EXTENSION, count=False)
+        if path is None:
+            return False
+        try:
+            return self.load(result_id, path)
+        finally:
+            os.remove(path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "results": len(self._indexes),
+                "rows": sum(i.rows for i in self._indexes.values()),
+                "max_rows": self.max_rows,
+            }
+
+
+def _handover_rows():
+    """
+    Row limit of the frames this process hands to a pattern index: the largest
+    of its serving stores, or of its parent's when the parent serves one. 0 when
+    nothing would read them.
+    """
+    if multiprocessing.parent_process() is None:
+        return max((store.max_rows for store in _STORES), default=0)
+    server, _, max_rows = os.environ.get(SERVER_ENV, "").partition(":")
+    if server != str(os.getppid()):
+        return 0
+    return int(max_rows)
+
+
+def pattern_index_enabled():
+    return _handover_rows() > 0
+
+
+def keep_for_index(df):
+    """
+    Hands the final frame of a run to the pattern index: to the stores
+    directly when they serve in this process, otherwise through a side-car
+    file named in the current report. Does nothing outside a report, without
+    a serving store or when df has more rows than the stores keep, and in
+    worker processes without pyarrow.
+    """
+    report = current_report()
+    max_rows = _handover_rows()
+    if report is None or max_rows <= 0:
+        return
+    if len(df) > max_rows:
+        print(f"⚠️ {report.source} has more than {max_rows} rows and is not indexed for search")
+        return
+    if multiprocessing.parent_process() is None:
+        for store in _STORES:
+            store.keep(report.source, df)
+        return
+    if not has_pyarrow():
+        print(f"⚠️ {report.source} is not indexed for search: pyarrow is required to hand it over")
+        return
+    fd, path = tempfile.mkstemp(suffix=INDEX_EXTENSION)
+    os.close(fd)
+    try:
+        write_frame(df, path)
+    except BaseException:
+        os.remove(path)
+        raise
+    report.outputs["pattern_index"] = path
+
+
+def pattern_index_from_env():
+    """
+    A PatternIndexStore sized by SANDRA_PATTERN_INDEX_ROWS. It takes no frames
+    until serve_pattern_index() is called on it.
+    """
+    return PatternIndexStore(pattern_index_rows_from_env())
+
+
+def serve_pattern_index(store):
+    """
+    Starts indexing the runs of this process and of its workers into store:
+    subscribes it to the pipeline reports and marks the process as serving.
+    Does nothing for a disabled store or one already serving.
+    """
+    if not store.enabled:
+        return
+    with _STORES_LOCK:
+        if store in _STORES:
+            return
+        _STORES.append(store)
+        add_report_listener(store.observe_report)
+        max_rows = max(store.max_rows for store in _STORES)
+        os.environ[SERVER_ENV] = f"{os.getpid()}:{max_rows}"
+
+
+def install_pattern_index(app, store=None):
+    """
+    Adds a request hook to a Flask app that starts serving store (by default
+    one from pattern_index_from_env()) with the first request the app handles.
+    Returns the store.
+    """
+    if store is None:
+        store = pattern_index_from_env()
+
+    @app.before_request
+    def _serve_pattern_index():
+        if store not in _STORES:
+            serve_pattern_index(store)
+
+    return store
@@ -0,0 +1,352 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from frame_dtypes import categorical_from_codes, is_compact, like
+from instrumentation import current_report, instrumented
+from token_rules import TOKEN_RULE_ENGINE
+
+
+LONG_NUMBER_RE = re.compile(r'\d{7,}')
+DIGITS_RE = re.compile(r'\d+')
+REPEATED_SPECIAL_RE = re.compile(r'([^A-Za-z0-9\s])\1{4,}')
+WHITESPACE_RE = r'\s+'
+SPECIAL_PATTERN_RE = re.compile(r'^(\d+)-[^ ]+\s+TX:\d+\s+(2/\d+)')
+
+DEFAULT_PATTERN_CACHE_SIZE = 100_000
+
+
+def extract_tokens(desc):
+    """
+    Splits a description into its tokens, dropping repeated ones.
+    """
+    seen = set()
+    return [x for x in desc.split() if not (x in seen or seen.add(x))]
+
+
+def extract_special_pattern(pattern):
+    # Match: start digits (before -), then **, then keep 2/xxxxxx
+    match = SPECIAL_PATTERN_RE.search(pattern)
+    if match:
+        return f"{match.group(1)}**{match.group(2)}"
+    return pattern  # keep unchanged if not matched
+
+
+def mask_pattern(pattern_str):
+    # Split into parts
+    patterns = pattern_str.split()
+    if not patterns:
+        return pattern_str
+
+    # 1️⃣ Mask last part if it contains a long number (10+ digits)
+    last = patterns[-1]
+    digits = DIGITS_RE.findall(last)
+    if digits and len(digits[-1]) >= 10:
+        masked = '**' + digits[-1][-4:]
+        patterns[-1] = LONG_NUMBER_RE.sub(masked, last)
+
+    result = ' '.join(patterns)
+
+    # 2️⃣ Replace any special character repeated more than 5 times with "**"
+    result = REPEATED_SPECIAL_RE.sub('**', result)
+
+    return result
+
+
+def mask_last_pattern_if_long_number(df):
+    patterns = df['Pattren']
+    df['Pattren'] = map_unique(patterns, lambda values: values.map(mask_pattern), categorical=is_compact(patterns))
+
+
+@instrumented("fill_pattern_with_referencia")
+def fill_pattern_with_referencia(df, mask=True):
+    """
+    Masks long numbers in 'Pattren', then falls back to the normalized 'Referencia'
+    wherever the pattern is empty or a single short token (3 chars or less, no comma).
+    Pass mask=False for patterns already masked by description_patterns().
+    """
+    # The mask runs twice on purpose: a second pass can still collapse special
+    # characters that became adjacent during the first one.
+    if mask:
+        mask_last_pattern_if_long_number(df)
+        mask_last_pattern_if_long_number(df)
+
+    # Worked out once per distinct pattern and reference, then mapped to the rows
+    original = df['Pattren']
+    pattern_codes, patterns = pd.factorize(original, use_na_sentinel=False)
+    patterns = pd.Series(patterns, dtype=object)
+    pattern = patterns.astype(str).str.strip()
+    if 'Referencia' in df.columns:
+        referencia_codes, referencias = pd.factorize(df['Referencia'], use_na_sentinel=False)
+        referencia = pd.Series(referencias, dtype=object).astype(str).str.strip()
+    else:
+        referencia_codes, referencia = np.zeros(len(df), dtype=np.intp), pd.Series([''], dtype=object)
+
+    # Empty, or one token of at most 3 chars without a comma
+    too_short = (
+        (pattern.str.len() <= 3)
+        & ~pattern.str.contains(',', regex=False)
+        & ~pattern.str.contains(WHITESPACE_RE, regex=True)
+    ).to_numpy()
+    use_referencia = too_short[pattern_codes] & (referencia != '').to_numpy()[referencia_codes]
+
+    # Stripped pattern unless empty, otherwise the original value
+    kept_pattern = patterns.mask(pattern != '', pattern)
+    normalized_referencia = referencia.str.replace(WHITESPACE_RE, ' ', regex=True)
+    values = pd.concat([kept_pattern, normalized_referencia], ignore_index=True)
+    codes = np.where(use_referencia, len(kept_pattern) + referencia_codes, pattern_codes)
+    df['Pattren'] = like(original, categorical_from_codes(codes, values))
+
+
+# === Per-description transforms ===
+# Statements repeat the same descriptions (fees, standing transfers) many times.
+# The row-level steps from description to pattern only depend on the description,
+# so they run once per distinct description and the results are mapped back to
+# the rows. Patterns are also kept in a bounded LRU cache, so descriptions seen in
+# an earlier file handled by the same process are not transformed again.
+
+def pattern_cache_size_from_env(default=DEFAULT_PATTERN_CACHE_SIZE):
+    """
+    Entries of the per-process pattern cache, overridable with
+    SANDRA_PATTERN_CACHE_SIZE (0 disables the cache).
+    """
+    try:
+        return max(0, int(os.environ.get("SANDRA_PATTERN_CACHE_SIZE", default)))
+    except ValueError:
+        return default
+
+
+class LRUCache:
+    """
+    Thread-safe mapping holding at most max_entries items, dropping the least
+    recently used ones first.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys, default=None):
+        found = []
+        with self._lock:
+            for key in keys:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    found.append(self._items[key])
+                    self.hits += 1
+                else:
+                    found.append(default)
+                    self.misses += 1
+        return found
+
+    def put_many(self, keys, values):
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._items[key] = value
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+_MISSING = object()
+
+
+def unique_results(values, transform, cache=None):
+    """
+    Applies transform (a function from a Series to a Series of the same length)
+    to the distinct values of a Series only. Returns (codes, results): the code
+    of every row's value and the object array of results per distinct value.
+    With a cache, values transformed earlier are looked up instead.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    uniques = pd.Series(uniques, dtype=object)
+    results = np.empty(len(uniques), dtype=object)
+
+    todo = np.arange(len(uniques))
+    if cache is not None and len(uniques):
+        todo = []
+        for i, value in enumerate(cache.get_many(uniques.tolist(), _MISSING)):
+            if value is _MISSING:
+                todo.append(i)
+            else:
+                results[i] = value
+        todo = np.array(todo, dtype=np.intp)
+
+    if len(todo):
+        pending = uniques.iloc[todo].reset_index(drop=True)
+        # Through an object array, so list results are not turned into a 2-D array
+        computed = transform(pending).to_numpy(dtype=object)
+        results[todo] = computed
+        if cache is not None:
+            cache.put_many(pending.tolist(), computed.tolist())
+    return codes, results
+
+
+def _map_back(values, codes, results, categorical=False):
+    if categorical:
+        return pd.Series(categorical_from_codes(codes, results), index=values.index, name=values.name)
+    return pd.Series(results[codes], index=values.index, name=values.name, dtype=object)
+
+
+def map_unique(values, transform, cache=None, categorical=False):
+    """
+    Applies transform (a function from a Series to a Series of the same length)
+    to the distinct values of a Series only and maps the results back to every
+    row. With a cache, values transformed earlier are looked up instead. With
+    categorical=True the result is a categorical Series.
+    """
+    codes, results = unique_results(values, transform, cache)
+    return _map_back(values, codes, results, categorical)
+
+
+def _mask_joined(pattern):
+    """
+    mask_pattern() for a pattern whose tokens are already joined by single spaces.
+    """
+    head, sep, last = pattern.rpartition(' ')
+    digits = DIGITS_RE.findall(last)
+    if digits and len(digits[-1]) >= 10:
+        last = LONG_NUMBER_RE.sub('**' + digits[-1][-4:], last)
+    return REPEATED_SPECIAL_RE.sub('**', head + sep + last)
+
+
+def _patterns_of_descriptions(descriptions, rules):
+    """
+    The row-level steps fused into one pass per description: the tokens are split
+    once and every rule works on the token list, so no intermediate column is
+    built. Gives the same pattern as chaining extract_tokens, extract_special_pattern,
+    drop_first_pattern and mask_pattern twice (checked by benchmarks.parity).
+    Returns (pattern, removed) per description, removed holding the (token, rule
+    index) pairs dropped from it; rules is the token -> rule memo of the batch.
+    """
+    match_rule = TOKEN_RULE_ENGINE.match
+    unseen = object()
+
+    def pattern(desc):
+        tokens = extract_tokens(desc)
+
+        # The special TX pattern can only match on the first three tokens
+        if len(tokens) > 2 and tokens[1].startswith('TX:'):
+            match = SPECIAL_PATTERN_RE.search(' '.join(tokens[:3]))
+            if match:
+                tokens = [f"{match.group(1)}**{match.group(2)}"]
+
+        kept = []
+        removed = []
+        for token in tokens:
+            rule = rules.get(token, unseen)
+            if rule is unseen:
+                rule = rules[token] = match_rule(token)
+            if rule is None:
+                kept.append(token)
+            else:
+                removed.append((token, rule))
+
+        # Twice, as fill_pattern_with_referencia does
+        return _mask_joined(_mask_joined(' '.join(kept))), tuple(removed)
+
+    results = np.empty(len(descriptions), dtype=object)
+    results[:] = [pattern(desc) for desc in descriptions]
+    return pd.Series(results, index=descriptions.index, dtype=object)
+
+
+PATTERN_CACHE = LRUCache(pattern_cache_size_from_env())
+
+
+@instrumented("description_patterns")
+def description_patterns(descriptions, cache=PATTERN_CACHE):
+    """
+    Pattern of every description: tokens without repeats, the special TX pattern
+    collapsed, reference-like tokens dropped and long numbers masked. Each
+    distinct description is processed once; pass cache=None to skip the LRU cache.
+    The patterns are categorical when the descriptions are a compact column.
+    The rule hits are counted per row, cached descriptions included.
+    """
+    if cache is not None and cache.max_entries <= 0:
+        cache = None
+    stats = TOKEN_RULE_ENGINE.stats()
+    codes, results = unique_results(descriptions, partial(_patterns_of_descriptions, rules=stats.rules), cache)
+
+    if current_report() is not None:
+        rows = np.bincount(codes, minlength=len(results))
+        for (_, removed), weight in zip(results, rows.tolist()):
+            if removed:
+                stats.add(removed, weight)
+        stats.report()
+
+    patterns = np.empty(len(results), dtype=object)
+    patterns[:] = [result[0] for result in results]
+    return _map_back(descriptions, codes, patterns, categorical=is_compact(descriptions))
+
+
+@instrumented("replace_with_common_patterns")
+def replace_with_common_patterns(df, codigo_col='codigo', pattern_col='Pattren'):
+    """
+    For each codigo group:
+    - Find words common to all rows in the group's pattern
+    - If there are >= 2 common words, replace the pattern with only those words
+
+    Words are interned to integer ids and each group is intersected in one pass,
+    stopping as soon as fewer than 2 common words are left. The pattern column is
+    updated in place with a single assignment and the same frame is returned.
+    """
+    codes, uniques = pd.factorize(df[codigo_col])
+    if len(codes) == 0:
+        return df
+    patterns = df[pattern_col]
+
+    # Intern every word of each distinct pattern to an integer id
+    vocab = {}
+    pattern_codes, distinct_patterns = pd.factorize(patterns, use_na_sentinel=False)
+    pattern_words = [[vocab.setdefault(w, len(vocab)) for w in str(p).split()] for p in distinct_patterns]
+    words = list(vocab)
+
+    # Rows of each group are contiguous after a stable sort on the group code,
+    # with the group's first row (in frame order) leading
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    sorted_patterns = pattern_codes[order].tolist()
+
+    replacement = np.full(len(uniques), None, dtype=object)
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        group_code = sorted_codes[start]
+        if group_code < 0:
+            continue  # missing codigo, not grouped
+
+        first = pattern_words[sorted_patterns[start]]
+        common = set(first)
+        for pos in range(start + 1, end):
+            if len(common) < 2:
+                break
+            common.intersection_update(pattern_words[sorted_patterns[pos]])
+
+        if len(common) >= 2:
+            replacement[group_code] = ' '.join([words[w] for w in first if w in common])
+
+    has_common = (codes >= 0) & pd.notna(replacement)[codes]
+    if has_common.any():
+        values = pd.concat([pd.Series(distinct_patterns, dtype=object), pd.Series(replacement, dtype=object)],
+                           ignore_index=True)
+        new_codes = np.where(has_common, len(distinct_patterns) + codes, pattern_codes)
+        df[pattern_col] = like(patterns, categorical_from_codes(new_codes, values))
+
+    return df
@@ -0,0 +1,222 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from amounts import amount_decimal_from_env
+from excel_reader import read_header
+from pattern_clusters import pattern_clusters_from_env
+from token_rules import rules_version
+
+
+# === Content-addressed cache of processed outputs ===
+# An upload is identified by the hash of its bytes, its header row (the detected
+# schema), the rule-set version, the engine that produced it, the output format and
+# the settings that change the output.
+# Outputs are stored on local disk as <key><ext>; reading an entry refreshes its
+# mtime, so eviction by oldest mtime keeps the cache under max_bytes in LRU order.
+# Side entries kept with an output (its pattern index frame) are stored the same
+# way under the output's key with their own extension, and evicted alike.
+# The key is worked out before the upload is processed, so results that came out
+# without part of what it promises (see cacheable()) are not stored.
+
+DEFAULT_CACHE_DIR = "cache"
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def cache_settings_from_env():
+    """
+    Cache directory and size limit, overridable with SANDRA_CACHE_DIR and
+    SANDRA_CACHE_MAX_BYTES (0 disables the cache).
+    """
+    cache_dir = os.environ.get("SANDRA_CACHE_DIR", DEFAULT_CACHE_DIR)
+    try:
+        max_bytes = max(0, int(os.environ.get("SANDRA_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)))
+    except ValueError:
+        max_bytes = DEFAULT_CACHE_MAX_BYTES
+    return cache_dir, max_bytes
+
+
+def output_settings():
+    """
+    The settings that change what a result holds, as a string for the cache key:
+    the amount decimal override and the pattern cluster threshold (when on).
+    """
+    clusters, threshold = pattern_clusters_from_env()
+    return f"decimal={amount_decimal_from_env() or ''};clusters={threshold if clusters else 'off'}"
+
+
+def cacheable(report):
+    """
+    False when the result of the pipeline report (a dict, or None) lacks part
+    of what output_settings() promises: statements processed out of core get no
+    pattern clusters, so they are not kept under a clusters-on key, where they
+    would still be served once the memory budget is raised.
+    """
+    out_of_core = bool(report and report.get("modes", {}).get("out_of_core"))
+    return not (out_of_core and pattern_clusters_from_env()[0])
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Disk-backed LRU cache of output files with hit/miss counters.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES, namespace=""):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key_for(self, input_path, output_format):
+        """
+        Cache key of an uploaded workbook for the given output format.
+        """
+        try:
+            schema = read_header(input_path)
+        except Exception:
+            schema = []  # unreadable header: the bytes alone identify the upload
+        parts = [
+            file_digest(input_path),
+            "\x1f".join(schema),
+            rules_version(),
+            self.namespace,
+            output_format,
+            output_settings(),
+        ]
+        return hashlib.sha256("\x1e".join(parts).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key, extension):
+        return os.path.join(self.cache_dir, key + extension)
+
+    def get(self, key, extension, count=True):
+        """
+        Returns a temporary copy of the cached output for key, or None on a miss.
+        The copy belongs to the caller, who may move or delete it like a fresh output.
+        Pass count=False to leave the hit/miss counters alone (side entries).
+        """
+        if not self.enabled:
+            return None
+
+        path = self._entry_path(key, extension)
+        temp_file = tempfile.NamedTemporaryFile(suffix=extension, delete=False)
+        try:
+            with self._lock:
+                os.utime(path)  # mark as most recently used
+                with open(path, "rb") as src:
+                    shutil.copyfileobj(src, temp_file, HASH_BLOCK_SIZE)
+                if count:
+                    self.hits += 1
+        except FileNotFoundError:
+            temp_file.close()
+            os.remove(temp_file.name)
+            if count:
+                with self._lock:
+                    self.misses += 1
+            return None
+        temp_file.close()
+        return temp_file.name
+
+    def put(self, key, output_path, extension):
+        """
+        Stores a copy of output_path under key and evicts the least recently used
+        entries beyond max_bytes. Returns the cached path, or None if not stored.
+        """
+        if not self.enabled:
+            return None
+        if os.path.getsize(output_path) > self.max_bytes:
+            return None
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._entry_path(key, extension)
+
+        # Copy next to the final entry and rename, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as dst, open(output_path, "rb") as src:
+                shutil.copyfileobj(src, dst, HASH_BLOCK_SIZE)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._evict(keep=path)
+        return path
+
+    def put_many(self, keys, output_paths, extension):
+        """
+        Stores several outputs at once; keys and paths that are None are skipped.
+        """
+        for key, output_path in zip(keys or [], output_paths):
+            if key and output_path and os.path.isfile(output_path):
+                self.put(key, output_path, extension)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".part"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self, keep=None):
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Hit/miss counters and current disk usage, for monitoring.
+        """
+        entries = self._entries() if os.path.isdir(self.cache_dir) else []
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(entries),
+                "size_bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+            }
+
+
+def result_cache_from_env(namespace=""):
+    cache_dir, max_bytes = cache_settings_from_env()
+    return ResultCache(cache_dir, max_bytes, namespace)
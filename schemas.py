@@ -0,0 +1,78 @@
+from amounts import AMOUNT_COLUMNS
+from excel_reader import read_header
+from instrumentation import instrumented
+
+
+# === Statement schemas ===
+# Each supported export names the three columns the pipeline works on (codigo,
+# DESC and Referencia) differently. A workbook's schema is picked from its header
+# row alone, so files of an unknown layout are rejected before their rows are
+# parsed, and only the columns the pipeline uses are loaded.
+
+class UnknownSchemaError(ValueError):
+    pass
+
+
+class StatementSchema:
+    """
+    key, description and reference are the export's names for the pipeline's
+    'codigo', 'DESC' and 'Referencia' columns. A header matches when it has all
+    the required columns (by default the three of them).
+    """
+
+    def __init__(self, name, key, description, reference, required=None):
+        self.name = name
+        self.required = tuple(required) if required is not None else (key, description, reference)
+        self.to_pipeline = {key: 'codigo', description: 'DESC', reference: 'Referencia'}
+        self.from_pipeline = {v: k for k, v in self.to_pipeline.items()}
+
+    def matches(self, header):
+        return set(self.required).issubset(header)
+
+    def usecols(self, header):
+        """
+        The columns of header the pipeline needs, in sheet order.
+        """
+        # The amount columns cleaned by process_excel_file are loaded when present
+        wanted = set(self.to_pipeline).union(*AMOUNT_COLUMNS)
+        return [name for name in header if name in wanted]
+
+    def __repr__(self):
+        return f"StatementSchema({self.name!r})"
+
+
+# Checked in order, the first match wins
+SCHEMAS = [
+    StatementSchema("fecha", "Fecha", "Concepto", "Referencia"),
+    StatementSchema("fecha_valor", "Fecha valor", "Concepto", "Referencia"),
+    StatementSchema("documento", "Número de documento", "Asunto", "Dependencia"),
+    # Already in the pipeline's column names; Referencia is optional
+    StatementSchema("raw", "codigo", "DESC", "Referencia", required=("codigo", "DESC")),
+]
+
+
+def detect_schema(header, schemas=SCHEMAS):
+    """
+    Returns the first schema matching the column names, or None.
+    """
+    header = [str(name) for name in header]
+    return next((schema for schema in schemas if schema.matches(header)), None)
+
+
+def expected_layouts(schemas=SCHEMAS):
+    return "; ".join(", ".join(schema.required) for schema in schemas)
+
+
+@instrumented("sniff_schema")
+def sniff_schema(input_path, schemas=SCHEMAS):
+    """
+    Reads only the header row of a workbook and returns (schema, header).
+    Raises UnknownSchemaError when no schema matches.
+    """
+    header = read_header(input_path)
+    schema = detect_schema(header, schemas)
+    if schema is None:
+        raise UnknownSchemaError(
+            f"The columns do not match any known statement layout (expected one of: {expected_layouts(schemas)})"
+        )
+    return schema, header
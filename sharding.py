@@ -0,0 +1,237 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from frame_dtypes import arrow_types_mapper, concat_frames, has_pyarrow
+from instrumentation import current_report, merge_parts, pipeline_report, stage
+
+
+# === Intra-file parallelism over codigo groups ===
+# A large frame is split into shards on group boundaries, so every row of a codigo
+# group lands in the same shard, and each shard runs through the processing stages
+# in a worker process. Only the common-pattern stage looks across rows and it works
+# per codigo group, so the reassembled result is the same as a single-process run.
+#
+# Shards travel as Arrow IPC streams written into shared memory blocks; only the
+# block name and size are pickled. Without pyarrow the frames are pickled instead.
+#
+# When the frame is processed inside a pipeline report, every shard runs inside a
+# report part (see instrumentation.merge_parts) that travels back with its result
+# and is added to the parent's report.
+
+DEFAULT_SHARD_WORKERS = 1  # sharding is opt-in
+DEFAULT_SHARD_MIN_ROWS = 100_000
+
+
+def shard_settings_from_env():
+    """
+    Worker count and minimum frame size for sharding, overridable with
+    SANDRA_SHARD_WORKERS (1 disables it) and SANDRA_SHARD_MIN_ROWS.
+    """
+    try:
+        workers = max(1, int(os.environ.get("SANDRA_SHARD_WORKERS", DEFAULT_SHARD_WORKERS)))
+    except ValueError:
+        workers = DEFAULT_SHARD_WORKERS
+    try:
+        min_rows = max(1, int(os.environ.get("SANDRA_SHARD_MIN_ROWS", DEFAULT_SHARD_MIN_ROWS)))
+    except ValueError:
+        min_rows = DEFAULT_SHARD_MIN_ROWS
+    return workers, min_rows
+
+
+def shard_rows(keys, n_shards):
+    """
+    Splits row positions into at most n_shards shards of about the same size
+    without splitting a group of equal keys. Groups are taken in order of first
+    appearance, so a frame sorted by key gives contiguous shards.
+    Returns a list of row position arrays, each in frame order.
+    """
+    codes, uniques = pd.factorize(keys)
+    if len(codes) == 0:
+        return []
+    # Rows with a missing key are not grouped; they get a group of their own
+    missing = codes < 0
+    if missing.any():
+        codes = codes.copy()
+        codes[missing] = len(uniques)
+
+    sizes = np.bincount(codes)
+    target = len(codes) / n_shards
+    # Shard of each group: cut where the running row count crosses a multiple of target
+    group_shard = np.minimum((np.cumsum(sizes) - sizes) // target, n_shards - 1).astype(np.int64)
+    row_shard = group_shard[codes]
+
+    shards = []
+    for shard in np.unique(row_shard):
+        shards.append(np.flatnonzero(row_shard == shard))
+    return shards
+
+
+def _frame_to_shm(df):
+    """
+    Writes df as an Arrow IPC stream into a new shared memory block.
+    Returns (block name, size); the reader unlinks the block.
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    mock = pa.MockOutputStream()
+    with pa.ipc.new_stream(mock, table.schema) as writer:
+        writer.write_table(table)
+    size = mock.size()
+
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        sink = pa.FixedSizeBufferWriter(pa.py_buffer(shm.buf))
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        sink.close()
+        del writer, sink  # release the exported view before closing the block
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    return shm.name, size
+
+
+def _frame_from_shm(name, size):
+    """
+    Reads a frame written by _frame_to_shm and releases the shared memory block.
+    """
+    import pyarrow as pa
+
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # Copy out of the block so that it can be released right away; Arrow-backed
+        # columns would otherwise keep pointing into it
+        buffer = pa.py_buffer(bytes(shm.buf[:size]))
+    finally:
+        shm.close()
+        shm.unlink()
+    table = pa.ipc.open_stream(buffer).read_all()
+    return table.to_pandas(split_blocks=False, types_mapper=arrow_types_mapper)
+
+
+def _run_shard(process, payload, use_shm, trace_memory=None):
+    """
+    Worker-side body: processes one shard, inside a report part unless
+    trace_memory is None (no report in the parent). Returns (result payload,
+    (report dict, deferred outputs) or None).
+    """
+    if use_shm:
+        df = _frame_from_shm(*payload)
+    else:
+        df = payload
+    part = None
+    if trace_memory is None:
+        result = process(df)
+    else:
+        with pipeline_report(trace_memory=trace_memory, part=True) as report:
+            result = process(df)
+        part = (report.to_dict(), report.deferred)
+    if use_shm:
+        return _frame_to_shm(result.reset_index(drop=True)), part
+    return result, part
+
+
+_EXECUTOR = None
+_EXECUTOR_WORKERS = 0
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _pool(workers):
+    global _EXECUTOR, _EXECUTOR_WORKERS
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None or _EXECUTOR_WORKERS != workers:
+            if _EXECUTOR is not None:
+                _EXECUTOR.shutdown(wait=False)
+            _EXECUTOR = ProcessPoolExecutor(max_workers=workers)
+            _EXECUTOR_WORKERS = workers
+        return _EXECUTOR
+
+
+def run_sharded(process, df, key='codigo', workers=None, min_rows=None):
+    """
+    Runs process(df) -> df over shards of df split on the key column, in worker
+    processes, and returns the results reassembled in the original row order
+    and index. process must be a module-level function, or a partial of one (it
+    is sent to the workers by reference), that keeps one output row per input row
+    and only combines rows within the same key group. Settings that depend on the
+    whole frame must be worked out before and bound to process.
+
+    Falls back to process(df) when sharding is disabled, the frame is smaller
+    than min_rows or it has no key column.
+    """
+    env_workers, env_min_rows = shard_settings_from_env()
+    workers = workers or env_workers
+    min_rows = min_rows or env_min_rows
+
+    if workers <= 1 or len(df) < min_rows or key not in df.columns:
+        return process(df)
+
+    shards = shard_rows(df[key], workers)
+    if len(shards) <= 1:
+        return process(df)
+
+    with stage(f"sharded_process[{len(shards)}]", df):
+        return _run_shards(process, df, shards, workers)
+
+
+def _run_shards(process, df, shards, workers):
+    use_shm = has_pyarrow()
+    report = current_report()
+    trace_memory = report.trace_memory if report is not None else None
+    executor = _pool(workers)
+    payloads = []
+    futures = []
+    results = []
+    parts = []
+    try:
+        for positions in shards:
+            shard = df.iloc[positions].reset_index(drop=True)
+            payload = _frame_to_shm(shard) if use_shm else shard
+            payloads.append(payload)
+            futures.append(executor.submit(_run_shard, process, payload, use_shm, trace_memory))
+            del shard
+
+        for future in futures:
+            result, part = future.result()
+            results.append(_frame_from_shm(*result) if use_shm else result.reset_index(drop=True))
+            if part is not None:
+                parts.append(part)
+    except BaseException:
+        if use_shm:
+            _discard_blocks(payloads, futures[len(results):])
+        raise
+    merge_parts(parts)
+
+    combined = concat_frames(results)
+    # Put the rows back in frame order
+    combined = combined.take(np.argsort(np.concatenate(shards), kind='stable'))
+    combined.index = df.index
+    return combined
+
+
+def _discard_blocks(payloads, pending):
+    """
+    Unlinks the shared memory blocks of a failed run: inputs that were never read
+    and outputs of shards that finished but were not collected.
+    """
+    blocks = [payload[0] for payload in payloads]
+    for future in pending:
+        try:
+            blocks.append(future.result()[0][0])
+        except BaseException:
+            pass
+    for name in blocks:
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue  # already read and released
+        shm.close()
+        shm.unlink()
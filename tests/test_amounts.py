@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from amounts import (amount_decimal_votes, amounts_to_units, clean_amount_columns, decimal_from_votes,
+                     infer_amount_decimal, parse_amounts)
+
+
+def units(values, decimal=None):
+    cents, invalid = parse_amounts(values, decimal)
+    return [None if bad else value / 100 for value, bad in zip(cents.tolist(), invalid.tolist())]
+
+
+@pytest.mark.parametrize("column, expected", [
+    # Uruguayan column: '250,50' tells the decimal comma, so '1.500' groups thousands
+    (['1.500', '250,50', '3.000'], [1500.0, 250.5, 3000.0]),
+    (['1,500', '250.50', '3,000'], [1500.0, 250.5, 3000.0]),
+    # A repeated separator groups thousands and tells the other one is decimal
+    (['1.234.567', '2.000'], [1234567.0, 2000.0]),
+    (['1.234,56', '1,234.56', '1.234,00'], [1234.56, 1234.56, 1234.0]),
+    # Nothing tells the convention: '.' is decimal, as in numeric cells
+    (['1.234', '2.000'], [1.23, 2.0]),
+    # A lone separator that cannot group thousands is decimal
+    (['0,125', '1234,567', '250,50'], [0.13, 1234.57, 250.5]),
+    # Badly formed grouping is not an amount
+    (['1.2.3', '12.34.567', '1,2.50', '1.234.5'], [None, None, None, None]),
+    (['(1.234,50)', '$ 12,5-', 'USD 7,25', '-3', '.5', ',50'], [-1234.5, -12.5, 7.25, -3.0, 0.5, 0.5]),
+    (['1234.5', '-0.01', '1e-05', '1.005', '', 'abc'], [1234.5, -0.01, 0.0, 1.01, 0.0, None]),
+])
+def test_parse_amounts(column, expected):
+    assert units(column) == expected
+
+
+@pytest.mark.parametrize("decimal, expected", [(',', [1.23, 2.5]), ('.', [1234.0, 2.5])])
+def test_decimal_override_reads_ambiguous_amounts(decimal, expected):
+    # The override wins over the column's own evidence
+    assert units(['1,234', '2,50'], decimal) == expected
+
+
+def test_parse_amounts_handles_missing_cells():
+    cents, invalid = parse_amounts(pd.Series(['1,50', None, np.nan]))
+    assert cents.tolist() == [150, 0, 0]
+    assert not invalid.any()
+
+
+def test_clean_amount_columns_keeps_int64_cents():
+    df = pd.DataFrame({'Crédito': ['1.500', '250,50', 'x'], 'Debito': ['', '3', '0,01']})
+    assert clean_amount_columns(df) == 1
+    assert df['Crédito'].dtype == np.int64
+    assert df['Crédito'].tolist() == [150000, 25050, 0]
+    assert df['Debito'].tolist() == [0, 300, 1]
+
+    units = amounts_to_units(df)
+    assert units['Crédito'].tolist() == [1500.0, 250.5, 0.0]
+    assert units['Debito'].tolist() == [0.0, 3.0, 0.01]
+    assert df['Crédito'].dtype == np.int64  # the frame itself keeps its cents
+
+
+def test_amounts_to_units_leaves_other_frames_alone():
+    df = pd.DataFrame({'Credito': [1.5], 'Cuenta': [12]})
+    assert amounts_to_units(df) is df
+
+
+def test_statement_decimal_is_voted_over_every_chunk(monkeypatch):
+    monkeypatch.delenv('SANDRA_AMOUNT_DECIMAL', raising=False)
+    df = pd.DataFrame({'Credito': ['1.500', '250,50', '1.234,56', '7,25', '1.500'],
+                       'Débito': ['1,234.56', '3.000', '', '12', '99.10']})
+    assert infer_amount_decimal(df) == ','
+    # Votes count cells, so the chunks of a file add up to the whole file's vote
+    votes = amount_decimal_votes(df.iloc[:2]) + amount_decimal_votes(df.iloc[2:])
+    # ('99.10' reads as a numeric cell, which does not vote)
+    assert votes == amount_decimal_votes(df) == {',': 3, '.': 1}
+    assert decimal_from_votes(votes) == ','
+
+    # A part of the statement is read with the statement's separator
+    part = df.iloc[:1].copy()
+    clean_amount_columns(part, decimal=infer_amount_decimal(df))
+    assert part['Credito'].tolist() == [150000]
+
+    monkeypatch.setenv('SANDRA_AMOUNT_DECIMAL', '.')
+    assert infer_amount_decimal(df) == '.'
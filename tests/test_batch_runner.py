@@ -0,0 +1,40 @@
+import os
+import tempfile
+
+import pytest
+
+from batch_runner import output_names, run_folder
+
+
+def copy_input(input_path, output_format="xlsx"):
+    # Stands in for process_file: the "result" is the input's name
+    fd, path = tempfile.mkstemp(suffix="." + output_format)
+    with os.fdopen(fd, "w") as fh:
+        fh.write(os.path.basename(input_path))
+    return path
+
+
+def test_output_names_keep_inputs_sharing_a_stem_apart():
+    names = ["a.xls", "a.xlsx", "b.xlsx", "B.xls", "c.xls.xlsx", "c.xls", "c.xlsx"]
+    assert output_names(names, ".xlsx") == [
+        "a.xls.xlsx", "a.xlsx.xlsx", "b.xlsx.xlsx", "B.xls.xlsx", "c.xls.xlsx", "c.xls (2).xlsx", "c.xlsx.xlsx",
+    ]
+    assert output_names(["a.xls", "b.xlsx"], ".csv") == ["a.csv", "b.csv"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_folder_keeps_every_output(tmp_path, workers):
+    input_folder, output_folder = tmp_path / "in", tmp_path / "out"
+    input_folder.mkdir()
+    for name in ("statement.xls", "statement.xlsx", "other.xlsx"):
+        (input_folder / name).write_text("")
+
+    results = run_folder(copy_input, str(input_folder), str(output_folder), workers=workers)
+
+    assert [r["status"] for r in results] == ["ok"] * 3
+    outputs = {r["file"]: r["output"] for r in results}
+    assert len(set(outputs.values())) == 3
+    assert sorted(os.listdir(output_folder)) == ["other.xlsx", "statement.xls.xlsx", "statement.xlsx.xlsx"]
+    for file_name, output in outputs.items():
+        with open(output) as fh:
+            assert fh.read() == file_name
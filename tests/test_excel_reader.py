@@ -0,0 +1,49 @@
+import tracemalloc
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_statement
+from excel_reader import _frame, combine_chunks, read_excel
+from frame_dtypes import compact_text, has_pyarrow
+from xlsx_writer import write_excel_with_pivot
+
+
+def make_chunks(n_chunks=6, rows=2_000, compact=False):
+    chunks = []
+    for k in range(n_chunks):
+        width = 4 if k < n_chunks // 2 else 5  # a wider row shows up halfway
+        columns = ['codigo', 'DESC', 'Debito', 'Credito', 'Unnamed: 4'][:width]
+        chunk = _frame([[f'{k}-{i}-{j}' for j in range(width)] for i in range(rows)], columns)
+        chunks.append(compact_text(chunk) if compact else chunk)
+    return chunks
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_combine_chunks_matches_concat(compact):
+    if compact and not has_pyarrow():
+        pytest.skip("pyarrow is not installed")
+    expected = pd.concat(make_chunks(compact=compact), ignore_index=True, sort=False).fillna('')
+    chunks = make_chunks(compact=compact)
+    df = combine_chunks(chunks)
+    assert chunks == []
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_combine_chunks_does_not_hold_the_sheet_twice():
+    chunks = make_chunks(n_chunks=10, rows=10_000)
+    tracemalloc.start()
+    try:
+        df = combine_chunks(chunks)
+        kept, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(df) == 100_000
+    # The chunks' cells are let go as the columns are copied
+    assert peak < kept * 1.5
+
+
+def test_read_excel_in_chunks_matches_one_chunk(tmp_path):
+    path = str(tmp_path / "statement.xlsx")
+    write_excel_with_pivot(generate_statement(3_000, "fecha", seed=2), path, None)
+    pd.testing.assert_frame_equal(read_excel(path, chunk_rows=700), read_excel(path, chunk_rows=10_000))
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+import API2
+from benchmarks.synthetic import generate_statement
+from external_sort import memory_budget_from_env
+from jobs import JobRunner, process_uploads
+from result_cache import ResultCache
+from xlsx_writer import write_excel_with_pivot
+
+
+def test_out_of_core_is_opt_in(monkeypatch):
+    monkeypatch.delenv("SANDRA_MEMORY_BUDGET_MB", raising=False)
+    assert memory_budget_from_env() == 0
+
+
+@pytest.mark.parametrize("schema", ["fecha", "documento", "raw"])
+def test_out_of_core_output_matches_in_memory(tmp_path, monkeypatch, capsys, schema):
+    df = generate_statement(20_000, schema, seed=7)
+    # Printed amounts whose convention only the second half of the file tells
+    half = len(df) // 2
+    df["Credito"] = ["1.500"] * half + ["250,50"] * (len(df) - half)
+    input_path = str(tmp_path / f"{schema}.xlsx")
+    write_excel_with_pivot(df, input_path, None)
+    monkeypatch.delenv("SANDRA_AMOUNT_DECIMAL", raising=False)
+
+    outputs = {}
+    for budget in ("0", "1"):
+        monkeypatch.setenv("SANDRA_MEMORY_BUDGET_MB", budget)
+        path = API2.process_file(input_path, "csv")
+        with open(path, "rb") as fh:
+            outputs[budget] = fh.read()
+        os.remove(path)
+
+    assert " runs)" in capsys.readouterr().out  # the 1 MiB budget did spill
+    assert outputs["1"] == outputs["0"]
+    assert b"1500.0" in outputs["0"]
+
+
+def test_out_of_core_results_without_clusters_are_not_cached(tmp_path, monkeypatch):
+    input_path = str(tmp_path / "statement.xlsx")
+    write_excel_with_pivot(generate_statement(20_000, "fecha", seed=7), input_path, None)
+    monkeypatch.setenv("SANDRA_PATTERN_CLUSTERS", "1")
+    cache = ResultCache(str(tmp_path / "cache"))
+    runner = JobRunner(None, API2.process_file)
+
+    for budget, cached in (("1", False), ("0", True)):
+        monkeypatch.setenv("SANDRA_MEMORY_BUDGET_MB", budget)
+        [result] = process_uploads(runner, cache, [input_path], "csv")
+        os.remove(result["output"])
+        assert result["cache"] == "MISS"
+        assert result["report"].get("modes", {}).get("out_of_core", False) is not cached
+        copy = cache.get(result["key"], ".csv", count=False)
+        assert (copy is not None) is cached
+        if copy:
+            os.remove(copy)
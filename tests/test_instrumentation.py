@@ -0,0 +1,21 @@
+import json
+
+from instrumentation import REPORT_HEADER_MAX_BYTES, pipeline_report, report_header, stage
+
+
+def test_report_header_sums_up_every_file():
+    with pipeline_report("a.xlsx", log=False) as report:
+        with stage("read_excel") as record:
+            record.rows_out = 120
+        with stage("clean_amounts"):
+            pass
+    summary = json.loads(report_header([report.to_dict(), None]))
+    assert summary[0] == {"source": "a.xlsx", "seconds": summary[0]["seconds"], "rows": 120}
+    assert summary[1] is None  # a cache hit
+
+
+def test_report_header_is_dropped_past_its_size():
+    reports = [{"source": f"statement_{i:04d}.xlsx", "seconds": 1.25, "stages": []} for i in range(100)]
+    assert report_header(reports[:3]) is not None
+    assert report_header(reports) is None
+    assert len(report_header(reports[:10])) <= REPORT_HEADER_MAX_BYTES
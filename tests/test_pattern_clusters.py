@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pattern_clusters import (CANONICAL_COL, CLUSTER_COL, add_pattern_clusters, minhash_signatures,
+                              pattern_clusters_from_env)
+
+PATTERNS = [
+    'PAGO CUOTA 12/36', 'PAGO CUOTA 13/36', 'TRANSFERENCIA RECIBIDA SUELDO', 'PAGO CUOTA 13/36',
+    '', 'COMPRA SUPERMERCADO DISCO', 'TRANSFERENCIA RECIBIDA SUELDO', '',
+]
+
+
+def clustered(patterns, **kwargs):
+    return add_pattern_clusters(pd.DataFrame({'Pattren': patterns}), **kwargs)
+
+
+def test_reference_numbers_cluster_together():
+    df = clustered(PATTERNS)
+    assert df[CLUSTER_COL].tolist() == [1, 1, 2, 1, 3, 4, 2, 3]
+    # The most frequent pattern of the cluster is its canonical one
+    assert df[CANONICAL_COL].tolist() == [
+        'PAGO CUOTA 13/36', 'PAGO CUOTA 13/36', 'TRANSFERENCIA RECIBIDA SUELDO', 'PAGO CUOTA 13/36',
+        '', 'COMPRA SUPERMERCADO DISCO', 'TRANSFERENCIA RECIBIDA SUELDO', '',
+    ]
+
+
+def test_canonical_is_first_pattern_on_a_tie():
+    df = clustered(['PAGO CUOTA 12/36', 'PAGO CUOTA 13/36'])
+    assert df[CANONICAL_COL].tolist() == ['PAGO CUOTA 12/36'] * 2
+
+
+def test_dissimilar_patterns_stay_apart():
+    df = clustered(['PAGO CUOTA 12/36', 'PAGO SERVICIO ANTEL', 'DEBITO AUTOMATICO UTE'])
+    assert df[CLUSTER_COL].tolist() == [1, 2, 3]
+
+
+def test_threshold():
+    # Three of their five distinct masked tokens in common: a Jaccard similarity of 0.6
+    patterns = ['PAGO CUOTA PRESTAMO 12/36', 'PAGO CUOTA TARJETA 12/36']
+    assert clustered(patterns, threshold=0.3)[CLUSTER_COL].tolist() == [1, 1]
+    assert clustered(patterns, threshold=0.9)[CLUSTER_COL].tolist() == [1, 2]
+
+
+def test_empty_frame():
+    df = clustered([])
+    assert len(df) == 0 and CLUSTER_COL in df and CANONICAL_COL in df
+
+
+def test_signatures_are_deterministic():
+    features = [{'PAGO', 'CUOTA', '0/0'}, set(), {'SUELDO'}]
+    first = minhash_signatures(features)
+    assert np.array_equal(first, minhash_signatures(features))
+    assert (first[1] == first[1, 0]).all()
+    assert not np.array_equal(first[0], first[2])
+
+
+def test_categorical_patterns_give_the_same_clusters():
+    plain = clustered(PATTERNS)
+    categorical = clustered(pd.Categorical(PATTERNS))
+    assert categorical[CLUSTER_COL].tolist() == plain[CLUSTER_COL].tolist()
+    assert isinstance(categorical[CANONICAL_COL].dtype, pd.CategoricalDtype)
+    assert categorical[CANONICAL_COL].astype(object).tolist() == plain[CANONICAL_COL].tolist()
+
+
+@pytest.mark.parametrize("env, expected", [
+    ({}, (False, 0.7)),
+    ({'SANDRA_PATTERN_CLUSTERS': 'yes', 'SANDRA_CLUSTER_THRESHOLD': '0.9'}, (True, 0.9)),
+    ({'SANDRA_PATTERN_CLUSTERS': '1', 'SANDRA_CLUSTER_THRESHOLD': '2'}, (True, 1.0)),
+    ({'SANDRA_CLUSTER_THRESHOLD': 'x'}, (False, 0.7)),
+])
+def test_pattern_clusters_from_env(monkeypatch, env, expected):
+    monkeypatch.delenv('SANDRA_PATTERN_CLUSTERS', raising=False)
+    monkeypatch.delenv('SANDRA_CLUSTER_THRESHOLD', raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    assert pattern_clusters_from_env() == expected
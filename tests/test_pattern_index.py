@@ -0,0 +1,68 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import API2
+import instrumentation
+import pattern_index
+from benchmarks.synthetic import write_statement
+from instrumentation import pipeline_report
+
+
+@pytest.fixture
+def statement(tmp_path, monkeypatch):
+    # Serving state is per process; start from none and drop it afterwards
+    monkeypatch.setattr(pattern_index, "_STORES", [])
+    monkeypatch.setattr(instrumentation, "_LISTENERS", list(instrumentation._LISTENERS))
+    monkeypatch.delenv(pattern_index.SERVER_ENV, raising=False)
+    monkeypatch.setattr(API2.PATTERN_INDEX, "_indexes", OrderedDict())
+    path = str(tmp_path / "statement.xlsx")
+    write_statement(path, 2_000, "fecha", seed=4)
+    return path
+
+
+def run(path):
+    with pipeline_report(os.path.basename(path), log=False):
+        os.remove(API2.process_file(path, "csv"))
+
+
+def test_importing_the_app_keeps_no_frames(statement):
+    run(statement)
+    assert not pattern_index.pattern_index_enabled()
+    assert API2.PATTERN_INDEX.stats()["results"] == 0
+    assert pattern_index.SERVER_ENV not in os.environ
+
+
+def test_serving_the_app_indexes_runs(statement):
+    stats = API2.app.test_client().get("/patterns/stats").get_json()
+    assert stats["enabled"] and stats["results"] == 0
+    assert os.environ[pattern_index.SERVER_ENV] == f"{os.getpid()}:{stats['max_rows']}"
+
+    run(statement)
+    assert API2.PATTERN_INDEX.has("statement.xlsx")
+    API2.app.test_client().get("/patterns/stats")
+    assert pattern_index._STORES == [API2.PATTERN_INDEX]  # subscribed once
+
+
+def test_side_car_round_trip_keeps_cents(tmp_path):
+    pytest.importorskip("pyarrow")
+    df = pd.DataFrame({
+        'Pattren': ['PAGO CUOTA', 'PAGO CUOTA', 'COMPRA'],
+        'Referencia': ['R1', 7, None],  # mixed values are written as strings
+        'Credito': np.array([150000, 25050, 0], dtype=np.int64),
+        'Debito': np.array([0, 0, 300000], dtype=np.int64),
+    })
+    store = pattern_index.PatternIndexStore(max_rows=10)
+    store.add("statement.xlsx", df)
+    path = str(tmp_path / ("statement" + pattern_index.INDEX_EXTENSION))
+    assert store.save("statement.xlsx", path)
+
+    loaded = pattern_index.PatternIndexStore(max_rows=10)
+    assert loaded.load("statement.xlsx", path)
+    frame = loaded.get("statement.xlsx").frame
+    assert frame['Credito'].dtype == np.int64 and frame['Debito'].dtype == np.int64
+    assert frame['Referencia'].tolist() == ['R1', '7', None]
+    assert loaded.get().search("pago")["totals"] == {'Credito': 1750.5, 'Debito': 0.0}
@@ -0,0 +1,66 @@
+import random
+
+import pandas as pd
+import pytest
+
+from baseline_pattern_chain import baseline_patterns
+from benchmarks.parity import EDGE_CASES, fuzz_descriptions
+from frame_dtypes import compact_text, has_pyarrow
+from pattern_stages import LRUCache, description_patterns
+
+# Tokens the original steps react to: the special TX pattern, reference tokens,
+# long numbers (ASCII and not) and runs of special characters, with non-ASCII
+# digits and letters that str.isdigit/isalpha and the \d regexes accept
+TOKENS = [
+    "PAGO", "COMPRA", "TRANSFERENCIA", "SUELDO", "CUOTA", "12/36", "/REF", "UYU", "ÑANDÚ", "café",
+    "TX:123", "TX:١٢٣", "837841TT", "٨٣٧٨٤١TT", "123456LR:42", "123456LR:ABC1", "123456LR:SPI-PREX99",
+    "TRJ:**-1-23", "TRJ:..-2-5", "S15BUZ612", "RECIBIDA", "RECIBIDAS", "Trf.x", "Trfx", "123456AB12",
+    "12345678901", "CTA:0012345678901", "١٢٣٤٥٦٧٨٩٠١", "N°1234567890123", "*****", "-------",
+    "ééééé", "--", "2/", "0", "²²²²²²²²²²", "ⅫⅫ", "ＡＢ１２",
+]
+SEPARATORS = [" ", "  ", "\t", " ", " "]
+
+
+def corpus(count=3_000, seed=0):
+    rng = random.Random(seed)
+    descriptions = EDGE_CASES + fuzz_descriptions(count // 3, seed) + [
+        "PAGO PAGO PAGO", "9-X TX:1 2/12", "9-X TX:1 3/12", "12-A\tTX:7 2/9", "TX:1 123-ABC 2/678"]
+    for _ in range(count):
+        tokens = [rng.choice(TOKENS) for _ in range(rng.randint(1, 7))]
+        if rng.random() < 0.1:
+            # The special pattern with noise after it
+            tokens = [f"{rng.randint(1, 999)}-{rng.choice(TOKENS)}", f"TX:{rng.randint(0, 99)}",
+                      f"2/{rng.randint(0, 99999)}"] + tokens
+        text = tokens[0]
+        for token in tokens[1:]:
+            text += rng.choice(SEPARATORS) + token
+        descriptions.append(text)
+    # Repeats, as statements have
+    descriptions += rng.sample(descriptions, len(descriptions) // 2)
+    return pd.DataFrame({'DESC': descriptions, 'codigo': [i % 97 for i in range(len(descriptions))]})
+
+
+@pytest.fixture(scope="module")
+def statement():
+    df = corpus()
+    return df, baseline_patterns(df).tolist()
+
+
+def test_description_patterns_match_the_original_chain(statement):
+    df, expected = statement
+    assert description_patterns(df['DESC'], cache=None).tolist() == expected
+
+
+def test_cached_patterns_match_the_original_chain(statement):
+    df, expected = statement
+    cache = LRUCache(1_000)  # smaller than the corpus, so entries get evicted
+    assert description_patterns(df['DESC'], cache=cache).tolist() == expected
+    assert description_patterns(df['DESC'], cache=cache).tolist() == expected
+
+
+@pytest.mark.skipif(not has_pyarrow(), reason="compact columns need pyarrow")
+def test_compact_patterns_match_the_original_chain(statement):
+    df, expected = statement
+    patterns = description_patterns(compact_text(df[['DESC']])['DESC'], cache=None)
+    assert isinstance(patterns.dtype, pd.CategoricalDtype)
+    assert patterns.astype(object).tolist() == expected
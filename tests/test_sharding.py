@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+import API2
+from instrumentation import pipeline_report
+
+
+def statement():
+    # The first half of the codigo groups only holds the ambiguous '1.500'; the
+    # second half tells the decimal comma ('250,50'), so '1.500' is 1500
+    rows = 200
+    codigo = [f"C{i // 5:03d}" for i in range(rows)]
+    return pd.DataFrame({
+        'codigo': codigo,
+        'DESC': [f"PAGO CUOTA TX:{i} {c}" for i, c in enumerate(codigo)],
+        'Referencia': ['REF'] * rows,
+        'Credito': ['1.500' if i < rows // 2 else '250,50' for i in range(rows)],
+        'Debito': ['3.000'] * rows,
+    })
+
+
+def run(monkeypatch, workers):
+    monkeypatch.setenv("SANDRA_SHARD_WORKERS", str(workers))
+    monkeypatch.setenv("SANDRA_SHARD_MIN_ROWS", "1")
+    monkeypatch.delenv("SANDRA_AMOUNT_DECIMAL", raising=False)
+    path = API2.Pre_Processing(statement(), "csv")
+    try:
+        return pd.read_csv(path)
+    finally:
+        API2.os.remove(path)
+
+
+@pytest.mark.parametrize("workers", [2, 4])
+def test_sharded_run_matches_single_process(monkeypatch, workers):
+    single = run(monkeypatch, 1)
+    sharded = run(monkeypatch, workers)
+    pd.testing.assert_frame_equal(sharded, single)
+    assert single['Credito'].tolist() == [1500.0] * 100 + [250.5] * 100
+    assert (single['Debito'] == 3000.0).all()
+
+
+def reported_run(monkeypatch, tmp_path, workers):
+    trace_dir = tmp_path / f"trace{workers}"
+    monkeypatch.setenv("SANDRA_RULE_TRACE_DIR", str(trace_dir))
+    with pipeline_report("statement.xlsx", log=False) as report:
+        run(monkeypatch, workers)
+    # Tokens and seconds add up per shard; hits are counted per row
+    hits = {rule: counts.get("hits") for rule, counts in report.counters["token_rules"].items()}
+    trace = pd.read_csv(trace_dir / "statement.rule_trace.csv").groupby(['token', 'rule'])['occurrences'].sum()
+    return hits, trace
+
+
+@pytest.mark.parametrize("workers", [2, 4])
+def test_sharded_run_reports_the_same_rule_hits(monkeypatch, tmp_path, workers):
+    single_hits, single_trace = reported_run(monkeypatch, tmp_path, 1)
+    sharded_hits, sharded_trace = reported_run(monkeypatch, tmp_path, workers)
+    assert any(single_hits.values())
+    assert sharded_hits == single_hits
+    pd.testing.assert_series_equal(sharded_trace, single_trace)
+
+
+def stage_rows(monkeypatch, workers):
+    with pipeline_report("statement.xlsx", log=False) as report:
+        run(monkeypatch, workers)
+    return {record.name: (record.rows_in, record.rows_out) for record in report.stages}
+
+
+def test_sharded_run_reports_every_stage(monkeypatch):
+    single = stage_rows(monkeypatch, 1)
+    sharded = stage_rows(monkeypatch, 4)
+    assert "sharded_process[4]" in sharded
+    for name in ("clean_amounts", "description_patterns", "fill_pattern_with_referencia",
+                 "replace_with_common_patterns"):
+        assert sharded[name] == single[name] == (200, 200)
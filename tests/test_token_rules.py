@@ -0,0 +1,115 @@
+import csv
+import random
+
+import pandas as pd
+import pytest
+
+from baseline_pattern_chain import drop_first_pattern
+from instrumentation import pipeline_report
+from pattern_stages import LRUCache, description_patterns
+from token_rules import KEPT, TOKEN_RULE_ENGINE
+
+TX = "Rule: TX: + digits"
+TRF = "Rule: Trf."
+
+
+def rule_counts(descriptions, cache=None):
+    with pipeline_report("statement.xlsx", log=False) as report:
+        patterns = description_patterns(pd.Series(descriptions, dtype=object), cache=cache)
+    return patterns, report.to_dict().get("counters", {}).get("token_rules", {})
+
+
+def test_hits_count_every_row():
+    descriptions = ["PAGO TX:123", "PAGO TX:123", "PAGO TX:123", "COMPRA TX:9 Trf.1"]
+    patterns, counts = rule_counts(descriptions)
+    assert patterns.tolist() == ["PAGO", "PAGO", "PAGO", "COMPRA"]
+    assert counts[TX]["hits"] == 4
+    assert counts[TX]["tokens"] == 2
+    assert counts[TRF]["hits"] == 1
+    assert counts[KEPT]["tokens"] == 2
+
+
+def test_cached_descriptions_still_count():
+    cache = LRUCache(100)
+    descriptions = ["PAGO TX:123", "PAGO TX:123", "COMPRA Trf.1"]
+    first_patterns, first = rule_counts(descriptions, cache)
+    patterns, counts = rule_counts(descriptions, cache)
+    assert patterns.tolist() == first_patterns.tolist() == ["PAGO", "PAGO", "COMPRA"]
+    assert counts[TX]["hits"] == first[TX]["hits"] == 2
+    assert counts[TRF]["hits"] == 1
+    # Nothing was matched again
+    assert counts[TX]["tokens"] == 0
+
+
+def test_apply_counts_hits():
+    with pipeline_report("statement.xlsx", log=False) as report:
+        result = TOKEN_RULE_ENGINE.apply(pd.Series(["A TX:1", "B TX:1", "C"]))
+    assert result.tolist() == ["A", "B", "C"]
+    assert report.to_dict()["counters"]["token_rules"][TX]["hits"] == 2
+
+
+def test_trace_is_written_per_report(tmp_path, monkeypatch):
+    monkeypatch.setenv("SANDRA_RULE_TRACE_DIR", str(tmp_path))
+    descriptions = pd.Series(["PAGO TX:123", "PAGO TX:123"], dtype=object)
+
+    # Outside a report nothing is counted or written
+    description_patterns(descriptions, cache=None)
+    assert list(tmp_path.iterdir()) == []
+
+    for _ in range(2):
+        with pipeline_report("statement.xlsx", log=False) as report:
+            description_patterns(descriptions, cache=None)
+        path = report.outputs["rule_trace"]
+        with open(path, encoding="utf-8", newline="") as fh:
+            rows = list(csv.reader(fh))
+        assert rows == [["token", "rule", "occurrences"], ["TX:123", TX, "2"]]
+    assert [p.name for p in tmp_path.iterdir()] == ["statement.rule_trace.csv"]
+
+
+# Pieces the rules react to, non-ASCII digits and letters (str.isdigit and
+# isalpha accept them, the ASCII regexes do not) and plain noise
+PIECES = [
+    "TX:", "LR:", "LR:SPI-PREX", "TRJ:**-", "TRJ:..-", "RECIBIDA", "Trf", ".", "-", "/", ":", "*",
+    "123456", "1234567", "0", "7", "12", "123456789012", "AB", "ZZZ", "S15BUZ", "TT", "ab", "x",
+    "١٢٣", "４５６", "²", "٣", "ÁÉ", "ñ", "Ｔ", "ß", "Ⅻ", "é1",
+]
+
+EDGE_TOKENS = [
+    "837841TT", "837841ＴＴ", "８３７８４１TT", "TX:123", "TX:", "TX:١٢٣", "TX:12a",
+    "123456LR:42", "123456LR:123456789012", "123456LR:AB12", "١٢٣٤٥٦LR:42", "123456LR:SPI-PREX12",
+    "123456LR:SPI-PREX", "TRJ:**-1-23", "TRJ:**-1-٢", "TRJ:..-2-5", "TRJ:..-22-5", "S15BUZ612",
+    "ÁB15BUZ612", "RECIBIDA", "RECIBIDAS", "XRECIBIDA", "Trf.", "Trfx", "Trf", "123456AB12",
+    "123456AB", "/TX:123", "/", "²²²²²²AB", "ⅫⅫ", "é",
+]
+
+
+def fuzz_tokens(count=20_000, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.choice(PIECES) for _ in range(rng.randint(1, 4))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("token", EDGE_TOKENS)
+def test_engine_removes_what_the_original_rules_removed(token):
+    removed = drop_first_pattern(token) == ''
+    assert (TOKEN_RULE_ENGINE.match(token) is not None) == removed
+
+
+def test_engine_matches_the_original_rules_on_fuzzed_tokens():
+    tokens = sorted(set(fuzz_tokens()))
+    mismatches = [token for token in tokens
+                  if (TOKEN_RULE_ENGINE.match(token) is not None) != (drop_first_pattern(token) == '')]
+    assert mismatches == []
+
+    # Whole patterns, as drop_first_pattern saw them
+    rng = random.Random(1)
+    patterns = pd.Series([' '.join(rng.sample(tokens, rng.randint(0, 6))) for _ in range(2_000)])
+    assert TOKEN_RULE_ENGINE.apply(patterns).tolist() == [drop_first_pattern(p) for p in patterns]
+
+
+def test_dispatch_reports_the_first_matching_rule():
+    # The exact checks are the original conditions, in table order
+    for token in sorted(set(fuzz_tokens(seed=2))) + EDGE_TOKENS:
+        if token.startswith("/"):
+            continue
+        first = next((i for i, rule in enumerate(TOKEN_RULE_ENGINE.rules) if rule[3](token)), None)
+        assert TOKEN_RULE_ENGINE.match(token) == first, token
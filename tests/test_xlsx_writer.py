@@ -0,0 +1,47 @@
+import tracemalloc
+import zipfile
+
+import pytest
+
+from benchmarks.synthetic import generate_statement
+from xlsx_writer import StreamingXlsxWriter, summary_pivot_fields, write_excel_with_pivot
+
+
+def pivot_parts(path):
+    with zipfile.ZipFile(path) as zf:
+        return {name: zf.read(name) for name in zf.namelist() if 'pivot' in name}
+
+
+def traced_write(path, chunk, n_chunks):
+    """
+    Peak MiB traced while n_chunks copies of chunk are streamed into one workbook.
+    The chunk itself is allocated before tracing starts, as a reader's chunk would be.
+    """
+    tracemalloc.start()
+    try:
+        with StreamingXlsxWriter(path, summary_pivot_fields) as writer:
+            for _ in range(n_chunks):
+                writer.write_chunk(chunk)
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("chunk_rows", [500, 3_000])
+def test_chunked_pivot_matches_one_chunk(tmp_path, chunk_rows):
+    df = generate_statement(6_000, "fecha", seed=3)
+    # Rows that repeat across chunks, so combinations are merged across them
+    df = df.iloc[list(range(3_000)) * 2].reset_index(drop=True)
+    whole, chunked = str(tmp_path / "whole.xlsx"), str(tmp_path / "chunked.xlsx")
+    write_excel_with_pivot(df, whole, summary_pivot_fields, chunk_rows=len(df))
+    write_excel_with_pivot(df, chunked, summary_pivot_fields, chunk_rows=chunk_rows)
+    assert pivot_parts(chunked) == pivot_parts(whole)
+
+
+def test_large_write_memory_follows_distinct_rows(tmp_path):
+    chunk = generate_statement(5_000, "fecha", seed=5)
+    peaks = {n: traced_write(str(tmp_path / f"{n}.xlsx"), chunk, n) for n in (2, 40)}
+    print(f"peak MiB by chunk count: {peaks}")
+    # 20x the rows with the same distinct rows: the pivot aggregates stay the size
+    # of the distinct combinations instead of growing with every chunk
+    assert peaks[40] < peaks[2] * 1.5
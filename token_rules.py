@@ -0,0 +1,359 @@
+import csv
+import hashlib
+import os
+import re
+import string
+import time
+from collections import Counter
+from itertools import chain, islice
+
+import pandas as pd
+
+from instrumentation import add_output_merger, current_report, instrumented, report_counters
+
+
+# === Token removal rules for drop_first_pattern ===
+# Each rule is (name, first characters it can start with, ASCII regex, exact check).
+# The regex is used for plain ASCII tokens through one combined pattern per first
+# character; the exact check is the original str-method test and is only used for
+# tokens with non-ASCII characters (isdigit/isalpha accept more than [0-9A-Za-z]).
+# Order matters: the first matching rule is the one reported for a token.
+DIGITS = string.digits
+UPPER = string.ascii_uppercase
+
+TOKEN_RULES = [
+    (
+        "Rule: 6+ digits followed by 2+ letters",
+        DIGITS,
+        r"\d{6}[A-Za-z]{2,}",
+        lambda p: len(p) >= 8 and p[:6].isdigit() and p[6:].isalpha() and len(p[6:]) >= 2,
+    ),
+    (
+        "Rule: TX: + digits",
+        "T",
+        r"TX:\d+",
+        lambda p: p.startswith("TX:") and p[3:].isdigit(),
+    ),
+    (
+        "Rule: 6+ digits + LR: + digits",
+        DIGITS,
+        r"\d{6}LR:\d+",
+        lambda p: p[:6].isdigit() and p[6:].startswith("LR:") and p[9:].isdigit(),
+    ),
+    (
+        "Rule: 6+ digits + LR: + 12+ digits",
+        DIGITS,
+        r"\d{6}LR:\d{12,}",
+        lambda p: p[:6].isdigit() and p[6:].startswith("LR:") and p[9:].isdigit() and len(p[9:]) >= 12,
+    ),
+    (
+        "Rule: 6+ digits + LR: + alphanumeric",
+        DIGITS,
+        r"\d{6}LR:[A-Za-z0-9]+",
+        lambda p: p[:6].isdigit() and p[6:].startswith("LR:") and p[9:].isalnum(),
+    ),
+    (
+        "Rule: TRJ:**-X-X",
+        "T",
+        r"TRJ:\*\*-\d-\d+",
+        lambda p: p.startswith("TRJ:**-") and re.match(r"^TRJ:\*\*-\d-\d+$", p) is not None,
+    ),
+    (
+        "Rule: TRJ:..-X-X",
+        "T",
+        r"TRJ:\.\.-\d-\d+",
+        lambda p: p.startswith("TRJ:..-") and re.match(r"^TRJ:\.\.-\d-\d+$", p) is not None,
+    ),
+    (
+        "Rule: 1–2 letters, digits, 2+ letters, 2+ digits",
+        UPPER,
+        r"[A-Z]{1,2}\d{2,}[A-Z]{2,}\d{2,}",
+        lambda p: re.match(r"^[A-Z]{1,2}\d{2,}[A-Z]{2,}\d{2,}$", p) is not None,
+    ),
+    (
+        "Rule: RECIBIDA",
+        "R",
+        r"RECIBIDA.*",
+        lambda p: re.match(r"RECIBIDA", p) is not None,
+    ),
+    (
+        "Rule: Trf.",
+        "T",
+        r"Trf..*",
+        lambda p: re.match(r"Trf.", p) is not None,
+    ),
+    (
+        # part[16:] starts at the trailing "X" of "LR:SPI-PREX", so this check
+        # can never succeed; it stays in the table so the order is unchanged.
+        "Rule: 6+ digits + LR:SPI-PREX + digits",
+        DIGITS,
+        None,
+        lambda p: p[:6].isdigit() and p[6:].startswith("LR:SPI-PREX") and p[16:].isdigit(),
+    ),
+    (
+        "Rule: 6 digits + 2 uppercase letters + more digits",
+        DIGITS,
+        r"\d{6}[A-Z]{2}\d+",
+        lambda p: re.match(r"^\d{6}[A-Z]{2}\d+$", p) is not None,
+    ),
+]
+
+# Tokens starting with one of these are always kept
+KEEP_PREFIXES = ("/",)
+
+# Counter name for the tokens no rule removes
+KEPT = "kept"
+# One distinct token in this many is timed again for the per-rule matching time
+TIMING_SAMPLE = 64
+
+# Bump when a pipeline stage changes its output without touching the rule table
+PIPELINE_VERSION = 5
+
+
+class TokenRuleEngine:
+    """
+    A rule table compiled once into a first-character dispatch table of combined regexes.
+    """
+
+    def __init__(self, rules, keep_prefixes=KEEP_PREFIXES):
+        self.rules = list(rules)
+        self.names = [rule[0] for rule in self.rules]
+        self.keep_prefixes = tuple(keep_prefixes)
+
+        # One combined regex per first character, holding only the rules that can
+        # start with it, in table order. Group "r<i>" tells which rule matched.
+        by_char = {}
+        for i, (_, first_chars, pattern, _) in enumerate(self.rules):
+            if pattern is None:
+                continue
+            for ch in first_chars:
+                by_char.setdefault(ch, []).append(f"(?P<r{i}>{pattern})")
+        self._dispatch = {
+            ch: re.compile("|".join(alternatives), re.ASCII)
+            for ch, alternatives in by_char.items()
+        }
+
+    def match(self, token):
+        """
+        Returns the index of the first rule that removes the token, or None to keep it.
+        """
+        if token.startswith(self.keep_prefixes):
+            return None
+
+        if not token.isascii():
+            for i, rule in enumerate(self.rules):
+                if rule[3](token):
+                    return i
+            return None
+
+        regex = self._dispatch.get(token[0])
+        if regex is None:
+            return None
+        m = regex.fullmatch(token)
+        if m is None:
+            return None
+        return int(m.lastgroup[1:])
+
+    def stats(self):
+        return RuleStats(self, trace=rule_trace_dir_from_env() is not None)
+
+    def apply(self, patterns):
+        """
+        Drops every token removed by the rule table from a Series of patterns.
+        Each distinct token is checked once and the result reused for all rows.
+        """
+        split_rows = [str(p).split() for p in patterns]
+
+        stats = self.stats()
+        rules = stats.rules
+        removed = []
+        for tokens in split_rows:
+            for token in tokens:
+                if token not in rules:
+                    rules[token] = self.match(token)
+                if rules[token] is not None:
+                    removed.append((token, rules[token]))
+        stats.add(removed)
+        stats.report()
+
+        result = [' '.join([t for t in tokens if rules[t] is None]) for tokens in split_rows]
+        return pd.Series(result, index=patterns.index, name=patterns.name, dtype=object)
+
+
+# === Rule hit statistics ===
+# Every batch of tokens run through the rule table counts, per rule, the distinct
+# tokens it matched and the time spent matching them, estimated by timing a
+# sample of the matches again (tokens no rule removes are counted under KEPT),
+# and the rows it removed a token from (hits). Descriptions served from the
+# pattern cache were not matched again, so they add no tokens or time, but they
+# keep the tokens removed from them and still add their hits, one per row. The
+# counts are worked out once per batch, off the per-token path, and go into the
+# current pipeline report (section 'token_rules') and from there into the
+# metrics. Batches run outside a pipeline report are not counted.
+#
+# With SANDRA_RULE_TRACE_DIR set, every removed token is also written with its
+# rule and occurrences to '<input name>.rule_trace.csv' in that directory, one
+# file per pipeline report.
+#
+# Shards run in worker processes (sharding.run_sharded) count into reports of
+# their own, which are added to the file's report; their trace rows are written
+# by the parent process. Every shard is a batch of its own, so tokens and
+# seconds add up per shard, while hits and the trace match a single-process run.
+
+def rule_trace_dir_from_env():
+    """
+    Directory for the rule trace side-car files, SANDRA_RULE_TRACE_DIR; the
+    trace is off when it is not set.
+    """
+    return os.environ.get("SANDRA_RULE_TRACE_DIR") or None
+
+
+class RuleStats:
+    """
+    Rule hits of one batch of tokens. The caller stores the result of
+    engine.match() for every distinct token it matches in rules and adds the
+    removed (token, rule index) pairs with add(); the counts are only worked
+    out by to_dict(). report() hands them to the current pipeline report and
+    writes the trace.
+    """
+
+    def __init__(self, engine, trace=False):
+        self.engine = engine
+        self.trace = trace
+        self.rules = {}  # token -> index of the rule removing it, or None
+        self.occurrences = Counter()  # (token, rule index) -> occurrences
+
+    def add(self, removed, weight=1):
+        """
+        Counts the (token, rule index) pairs of removed, each weight times.
+        """
+        if weight == 1:
+            self.occurrences.update(removed)
+            return
+        occurrences = self.occurrences
+        for pair in removed:
+            occurrences[pair] += weight
+
+    def _slot(self, rule):
+        return len(self.engine.rules) if rule is None else rule
+
+    def match_seconds(self):
+        """
+        Time spent matching the tokens decided by each rule (the last slot:
+        kept), estimated by matching again one token in TIMING_SAMPLE and one
+        token of every rule.
+        """
+        n_slots = len(self.engine.rules) + 1
+        timed = [0] * n_slots
+        seconds = [0.0] * n_slots
+        match = self.engine.match
+        # A token of every rule (the last one seen), then the sample
+        one_per_rule = dict(zip(self.rules.values(), self.rules.keys()))
+        sample = islice(self.rules.items(), 0, None, TIMING_SAMPLE)
+        for token, rule in chain(((token, rule) for rule, token in one_per_rule.items()), sample):
+            start = time.perf_counter()
+            match(token)
+            seconds[self._slot(rule)] += time.perf_counter() - start
+            timed[self._slot(rule)] += 1
+        return timed, seconds
+
+    def to_dict(self):
+        """
+        {rule name: {'tokens', 'hits', 'seconds'}} for every rule of the table,
+        in table order, then KEPT.
+        """
+        n_rules = len(self.engine.rules)
+        tokens = [0] * (n_rules + 1)
+        for rule, count in Counter(self.rules.values()).items():
+            tokens[self._slot(rule)] = count
+        hits = [0] * n_rules
+        for (_, rule), count in self.occurrences.items():
+            hits[rule] += count
+        timed, seconds = self.match_seconds()
+
+        counts = {}
+        for i, name in enumerate(self.engine.names + [KEPT]):
+            entry = {"tokens": tokens[i], "seconds": seconds[i] / timed[i] * tokens[i] if timed[i] else 0.0}
+            if i < n_rules:
+                entry["hits"] = hits[i]
+            counts[name] = entry
+        return counts
+
+    def report(self):
+        report = current_report()
+        if report is None or not (self.rules or self.occurrences):
+            return
+        report_counters("token_rules", self.to_dict())
+        if self.trace and self.occurrences:
+            rows = trace_rows(self.engine, self.occurrences)
+            if report.deferred is not None:
+                report.deferred.setdefault("rule_trace", []).append(rows)
+            else:
+                write_rule_trace(rows, rule_trace_dir_from_env())
+
+
+def trace_rows(engine, occurrences):
+    """
+    (token, rule name, occurrences) rows of the removed tokens of a batch.
+    """
+    return [(token, engine.names[rule], count) for (token, rule), count in occurrences.items()]
+
+
+def write_rule_trace(rows, directory):
+    """
+    Appends the trace rows of a batch (token, rule, occurrences) to the trace
+    file of the current pipeline report, which is named after its source and
+    started afresh for every report. Returns the file's path.
+    """
+    report = current_report()
+    path = report.outputs.get("rule_trace")
+    new_file = path is None
+    if new_file:
+        source = report.source or f"pipeline_{os.getpid()}"
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.path.splitext(os.path.basename(source))[0]}.rule_trace.csv")
+        report.outputs["rule_trace"] = path
+        print(f"🔎 Writing the token rule trace to {path}")
+
+    with open(path, "w" if new_file else "a", encoding="utf-8", newline="") as fh:
+        writer = csv.writer(fh)
+        if new_file:
+            writer.writerow(["token", "rule", "occurrences"])
+        writer.writerows(rows)
+    return path
+
+
+def _merge_rule_trace(rows):
+    directory = rule_trace_dir_from_env()
+    if directory is not None:
+        write_rule_trace(rows, directory)
+
+
+add_output_merger("rule_trace", _merge_rule_trace)
+
+
+def compile_token_rules(rules=TOKEN_RULES):
+    return TokenRuleEngine(rules)
+
+
+TOKEN_RULE_ENGINE = compile_token_rules()
+
+
+@instrumented("drop_first_pattern")
+def drop_first_pattern(patterns):
+    """
+    Removes reference-like tokens (TX:, TRJ:, LR:, account numbers...) from every pattern in the Series.
+    """
+    return TOKEN_RULE_ENGINE.apply(patterns)
+
+
+def rules_version(rules=TOKEN_RULES, keep_prefixes=KEEP_PREFIXES):
+    """
+    Short fingerprint of the rule table and PIPELINE_VERSION, used to tell apart
+    results produced by different rule sets (e.g. in the result cache).
+    """
+    digest = hashlib.sha1(f"pipeline:{PIPELINE_VERSION}".encode())
+    for name, first_chars, pattern, _ in rules:
+        digest.update(f"\0{name}\0{first_chars}\0{pattern}".encode())
+    digest.update(f"\0keep:{keep_prefixes}".encode())
+    return digest.hexdigest()[:12]
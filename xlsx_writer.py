@@ -0,0 +1,749 @@
+import math
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from frame_dtypes import output_codes
+
+
+# === Native xlsx writer with a PivotTable sheet (no Excel / COM needed) ===
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_X14 = "http://schemas.microsoft.com/office/spreadsheetml/2009/9/main"
+REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+CT_PREFIX = "application/vnd.openxmlformats-officedocument.spreadsheetml."
+
+# x14 pivotField extension that carries "Repeat item labels"
+PIVOT_FIELD_EXT_URI = "{2946ED86-A175-432a-8AC1-64E0C546D7DE}"
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+ILLEGAL_XML_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+XML_SPECIAL_RE = re.compile(r'[&<>"\x00-\x08\x0b\x0c\x0e-\x1f]')
+BLANK_LABEL = "(blank)"
+
+# Rows converted to XML at a time by write_excel_with_pivot
+DEFAULT_CHUNK_ROWS = 20_000
+
+
+def column_letter(index):
+    """
+    Converts a 0-based column index into an Excel column letter (0 -> A, 27 -> AB).
+    """
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def escape_xml(text):
+    if not XML_SPECIAL_RE.search(text):
+        return text
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+    # Control characters are not valid XML; Excel stores them as _xHHHH_
+    return ILLEGAL_XML_CHARS_RE.sub(lambda m: '_x%04X_' % ord(m.group()), text)
+
+
+def cell_kind(value):
+    """
+    Returns 'n' (number), 'b' (boolean), 's' (text) or None (blank) for a cell value.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return 'b'
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        if isinstance(value, (float, np.floating)) and (math.isnan(value) or math.isinf(value)):
+            return None
+        return 'n'
+    if isinstance(value, str):
+        return 's' if value != '' else None
+    if value is pd.NaT:
+        return None
+    return 's'
+
+
+def format_number(value):
+    if isinstance(value, (float, np.floating)) and float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, (float, np.floating)) else str(int(value))
+
+
+def summary_pivot_fields(headers):
+    """
+    SummaryPivot field logic used by Pre_Processing:
+    - First row field is 'codigo', else 'Pattren', else the first header, with repeated item labels
+    - Every other column is added as a row field after it, in sheet order
+    - No data fields, no subtotals, tabular layout, no grand totals
+    """
+    headers = list(headers)
+    if not headers:
+        return {"rows": [], "repeat_labels": [], "data": [], "pages": []}
+
+    if "codigo" in headers:
+        first_field = "codigo"
+    elif "Pattren" in headers:
+        first_field = "Pattren"
+    else:
+        first_field = headers[0]
+
+    rows = [first_field] + [h for h in headers if h != first_field]
+    return {"rows": rows, "repeat_labels": [first_field], "data": [], "pages": []}
+
+
+class PivotCacheField:
+    """
+    Shared items of one source column, as stored in the pivot cache definition.
+    Items are collected chunk by chunk; None stands for the blank item.
+    """
+
+    def __init__(self, name):
+        self.name = str(name)
+        self.items = []
+        self.item_kinds = []
+        self.numbers = []  # numeric value of each item, 0 for text and blank
+        self.tags = []  # <x v="i"/> record tag of each item
+        self._index = {}
+
+    def _item(self, value):
+        kind = cell_kind(value)
+        key = (None,) if kind is None else value
+        index = self._index.get(key)
+        if index is None:
+            index = len(self.items)
+            self._index[key] = index
+            self.items.append(None if kind is None else value)
+            self.item_kinds.append(kind)
+            self.numbers.append(float(value) if kind == 'n' else 0.0)
+            self.tags.append(f'<x v="{index}"/>' if index else '<x/>')
+        return index
+
+    def add(self, values):
+        """
+        Registers a chunk of column values and returns the item index of each one.
+        """
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        return self.add_codes(codes, uniques)
+
+    def add_codes(self, codes, uniques):
+        """
+        add() for a chunk already factorized into codes (-1 for blanks) and uniques.
+        """
+        mapping = np.zeros(len(uniques) + 1, dtype=np.int64)
+        for j, value in enumerate(uniques):
+            mapping[j] = self._item(value)
+        if (codes < 0).any():
+            mapping[-1] = self._item(None)
+        return mapping[codes]
+
+    @property
+    def item_count(self):
+        return len(self.items)
+
+    @property
+    def has_blank(self):
+        return (None,) in self._index
+
+    def label(self, item_index):
+        return self.items[item_index]
+
+    def display_order(self):
+        """
+        Item indexes in ascending display order: numbers, then text (case-insensitive), then blank.
+        """
+        def sort_key(i):
+            value, kind = self.items[i], self.item_kinds[i]
+            if kind == 'n':
+                return (0, float(value), '')
+            if kind == 'b':
+                return (2, float(value), '')
+            return (1, 0.0, str(value).casefold())
+
+        order = sorted((i for i, k in enumerate(self.item_kinds) if k is not None), key=sort_key)
+        if self.has_blank:
+            order.append(self._index[(None,)])
+        return order
+
+    def to_xml(self):
+        kinds = set(k for k in self.item_kinds if k is not None)
+        attrs = []
+        if 's' not in kinds:
+            if not self.has_blank:
+                attrs.append('containsSemiMixedTypes="0"')
+            attrs.append('containsString="0"')
+        if len(kinds) > 1:
+            attrs.append('containsMixedTypes="1"')
+        if 'n' in kinds:
+            numbers = [n for n, k in zip(self.numbers, self.item_kinds) if k == 'n']
+            attrs.append('containsNumber="1"')
+            if all(n.is_integer() for n in numbers):
+                attrs.append('containsInteger="1"')
+            attrs.append(f'minValue="{format_number(min(numbers))}" maxValue="{format_number(max(numbers))}"')
+        if self.has_blank:
+            attrs.append('containsBlank="1"')
+        attrs.append(f'count="{self.item_count}"')
+
+        parts = [f'<cacheField name="{escape_xml(self.name)}" numFmtId="0"><sharedItems {" ".join(attrs)}>']
+        for value, kind in zip(self.items, self.item_kinds):
+            if kind is None:
+                parts.append('<m/>')
+            elif kind == 'n':
+                parts.append(f'<n v="{format_number(value)}"/>')
+            elif kind == 'b':
+                parts.append(f'<b v="{1 if value else 0}"/>')
+            else:
+                parts.append(f'<s v="{escape_xml(str(value))}"/>')
+        parts.append('</sharedItems></cacheField>')
+        return ''.join(parts)
+
+
+def _cell_body(value, style=0):
+    """
+    Everything after r="..." in a <c> element, or '' for a cell that is not written.
+    """
+    kind = cell_kind(value)
+    s = f' s="{style}"' if style else ''
+    if kind is None:
+        return f'{s}/>' if style else ''
+    if kind == 'n':
+        return f'{s}><v>{format_number(value)}</v></c>'
+    if kind == 'b':
+        return f'{s} t="b"><v>{1 if value else 0}</v></c>'
+    return f'{s} t="inlineStr"><is><t xml:space="preserve">{escape_xml(str(value))}</t></is></c>'
+
+
+def _cell_xml(ref, value, style=0):
+    body = _cell_body(value, style)
+    return f'<c r="{ref}"{body}' if body else ''
+
+
+def _write_buffered(fh, parts, flush_every=5000):
+    """
+    Writes an iterable of XML strings to an open zip entry a few thousand at a time.
+    """
+    buffer = []
+    for part in parts:
+        buffer.append(part)
+        if len(buffer) >= flush_every:
+            fh.write(''.join(buffer).encode('utf-8'))
+            buffer = []
+    fh.write(''.join(buffer).encode('utf-8'))
+
+
+def _styles_xml():
+    # Style 1 mirrors the pandas header format: bold, thin borders, centered
+    return (
+        XML_HEADER +
+        f'<styleSheet xmlns="{NS_MAIN}">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+        '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="1" xfId="0" applyFont="1" applyBorder="1" applyAlignment="1">'
+        '<alignment horizontal="center" vertical="top"/></xf></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    )
+
+
+def _rows_xml(columns, letters, first_row):
+    """
+    Builds the <row> elements of a chunk, given each column as (codes, uniques)
+    like output_codes() returns.
+    """
+    # Each distinct value of a column is converted to XML once
+    bodies = []
+    for codes, uniques in columns:
+        unique_bodies = [_cell_body(v) for v in uniques] + ['']
+        bodies.append([unique_bodies[c] for c in codes.tolist()])
+
+    rows = []
+    for row_number, row_bodies in enumerate(zip(*bodies), start=first_row):
+        cells = ''.join([f'<c r="{letter}{row_number}"{body}' for letter, body in zip(letters, row_bodies) if body])
+        rows.append(f'<row r="{row_number}">{cells}</row>')
+    return ''.join(rows)
+
+
+def _pivot_cache_definition(fields, record_count, source_ref, sheet_name):
+    return (
+        XML_HEADER +
+        f'<pivotCacheDefinition xmlns="{NS_MAIN}" xmlns:r="{NS_REL}" r:id="rId1" refreshOnLoad="1" '
+        f'createdVersion="6" refreshedVersion="6" minRefreshableVersion="3" recordCount="{record_count}">'
+        f'<cacheSource type="worksheet"><worksheetSource ref="{source_ref}" sheet="{escape_xml(sheet_name)}"/></cacheSource>'
+        f'<cacheFields count="{len(fields)}">' + ''.join(f.to_xml() for f in fields) + '</cacheFields>'
+        '</pivotCacheDefinition>'
+    )
+
+
+def _pivot_layout(fields, row_idx, combos, sums):
+    """
+    Puts the distinct row-field combinations collected while writing (an array
+    of cache item indexes, one column per row field) into display order,
+    expressed as positions in each pivotField's <items>, with their data sums.
+    """
+    # Position of each cache item inside the pivotField's display-ordered <items>
+    orders = {i: fields[i].display_order() for i in row_idx}
+    ranked = np.empty(combos.shape, dtype=np.int64)
+    for col, i in enumerate(row_idx):
+        rank = np.zeros(fields[i].item_count, dtype=np.int64)
+        rank[orders[i]] = np.arange(len(orders[i]))
+        ranked[:, col] = rank[combos[:, col]]
+
+    # Sorted on the first row field, then the second...
+    order = np.lexsort(ranked.T[::-1]) if len(ranked) else np.arange(0)
+    return orders, ranked[order], sums[order]
+
+
+def _iter_rows(array, block_rows=10_000):
+    """
+    Rows of a 2-D array as lists, converted a block at a time.
+    """
+    for start in range(0, len(array), block_rows):
+        yield from array[start:start + block_rows].tolist()
+
+
+def _write_pivot_table(zf, fields, spec, pivot_name, combos, combo_sums):
+    names = [f.name for f in fields]
+    row_idx = [names.index(n) for n in spec["rows"] if n in names]
+    data_idx = [names.index(n) for n in spec["data"] if n in names]
+    page_idx = [i for i, f in enumerate(fields) if f.name in spec["pages"]]
+    orders, combos, combo_sums = _pivot_layout(fields, row_idx, combos, combo_sums)
+    repeat = set(spec["repeat_labels"])
+    n_rows, n_data = len(row_idx), len(data_idx)
+
+    # Page fields sit above the table with one empty row in between
+    top = len(page_idx) + 1 if page_idx else 0
+    header_rows = 2 if n_data > 1 else 1
+    last_col = max(n_rows + n_data, 1) - 1
+    first_row = top + 1
+    last_row = top + header_rows + max(len(combos), 1)
+    location = f'A{first_row}:{column_letter(last_col)}{last_row}'
+
+    # --- pivotFields ---
+    parts = []
+    for i, field in enumerate(fields):
+        attrs = 'compact="0" outline="0" showAll="0"'
+        if i in data_idx:
+            attrs += ' dataField="1"'
+        if i in row_idx:
+            items = ''.join(f'<item x="{x}"/>' for x in orders[i])
+            ext = ''
+            if field.name in repeat:
+                ext = (f'<extLst><ext uri="{PIVOT_FIELD_EXT_URI}" xmlns:x14="{NS_X14}">'
+                       '<x14:pivotField fillDownLabels="1"/></ext></extLst>')
+            parts.append(f'<pivotField axis="axisRow" {attrs} defaultSubtotal="0">'
+                         f'<items count="{field.item_count}">{items}</items>{ext}</pivotField>')
+        elif i in page_idx:
+            items = ''.join(f'<item x="{x}"/>' for x in field.display_order())
+            parts.append(f'<pivotField axis="axisPage" {attrs}>'
+                         f'<items count="{field.item_count + 1}">{items}<item t="default"/></items></pivotField>')
+        else:
+            parts.append(f'<pivotField {attrs}/>')
+    pivot_fields = f'<pivotFields count="{len(fields)}">' + ''.join(parts) + '</pivotFields>'
+
+    # --- rows / columns / pages / data ---
+    def row_items():
+        previous = None
+        for combo in _iter_rows(combos):
+            repeated = 0
+            if previous is not None:
+                while repeated < n_rows - 1 and combo[repeated] == previous[repeated]:
+                    repeated += 1
+            r = f' r="{repeated}"' if repeated else ''
+            xs = ''.join([f'<x v="{v}"/>' if v else '<x/>' for v in combo[repeated:]])
+            yield f'<i{r}>{xs}</i>'
+            previous = combo
+
+    tail = []
+    if n_data > 1:
+        tail.append('<colFields count="1"><field x="-2"/></colFields>')
+        tail.append(f'<colItems count="{n_data}"><i><x/></i>' +
+                    ''.join(f'<i i="{k}"><x v="{k}"/></i>' for k in range(1, n_data)) + '</colItems>')
+    else:
+        tail.append('<colItems count="1"><i/></colItems>')
+    if page_idx:
+        tail.append(f'<pageFields count="{len(page_idx)}">' +
+                    ''.join(f'<pageField fld="{i}" hier="-1"/>' for i in page_idx) + '</pageFields>')
+    data_names = [f'Sum of {fields[i].name}' for i in data_idx]
+    if data_idx:
+        tail.append(f'<dataFields count="{n_data}">' +
+                    ''.join(f'<dataField name="{escape_xml(name)}" fld="{i}" baseField="0" baseItem="0"/>'
+                            for name, i in zip(data_names, data_idx)) + '</dataFields>')
+    tail.append('<pivotTableStyleInfo name="PivotStyleLight16" showRowHeaders="1" showColHeaders="1" '
+                'showRowStripes="0" showColStripes="0" showLastColumn="1"/>')
+
+    page_counts = f' rowPageCount="{len(page_idx)}" colPageCount="1"' if page_idx else ''
+    with zf.open('xl/pivotTables/pivotTable1.xml', 'w', force_zip64=True) as fh:
+        fh.write((
+            XML_HEADER +
+            f'<pivotTableDefinition xmlns="{NS_MAIN}" name="{escape_xml(pivot_name)}" cacheId="1" '
+            'applyNumberFormats="0" applyBorderFormats="0" applyFontFormats="0" applyPatternFormats="0" '
+            'applyAlignmentFormats="0" applyWidthHeightFormats="1" dataCaption="Values" updatedVersion="6" '
+            'minRefreshableVersion="3" useAutoFormatting="1" itemPrintTitles="1" createdVersion="6" indent="0" '
+            'compact="0" compactData="0" outline="1" outlineData="1" multipleFieldFilters="0" '
+            'rowGrandTotals="0" colGrandTotals="0">'
+            f'<location ref="{location}" firstHeaderRow="1" firstDataRow="{header_rows}" firstDataCol="{n_rows}"{page_counts}/>'
+            + pivot_fields
+        ).encode('utf-8'))
+        if row_idx:
+            fh.write((f'<rowFields count="{n_rows}">' + ''.join(f'<field x="{i}"/>' for i in row_idx) +
+                      '</rowFields>').encode('utf-8'))
+            if len(combos):
+                fh.write(f'<rowItems count="{len(combos)}">'.encode('utf-8'))
+                _write_buffered(fh, row_items())
+                fh.write(b'</rowItems>')
+        fh.write((''.join(tail) + '</pivotTableDefinition>').encode('utf-8'))
+    zf.writestr('xl/pivotTables/_rels/pivotTable1.xml.rels', _rels_xml([
+        ('rId1', 'pivotCacheDefinition', '../pivotCache/pivotCacheDefinition1.xml'),
+    ]))
+
+    # --- Rendered cells, so the sheet reads correctly even before a refresh ---
+    # Label cells are converted to XML once per item; widths come from the items
+    labels = {}
+    widths = [0] * (max(last_col, 1) + 1)
+    for col, i in enumerate(row_idx):
+        texts = [BLANK_LABEL if fields[i].label(x) is None else fields[i].label(x) for x in orders[i]]
+        labels[i] = [_cell_body(t) for t in texts]
+        widths[col] = max([len(fields[i].name)] + [len(str(t)) for t in texts])
+    for k, name in enumerate(data_names):
+        widths[n_rows + k] = max(len(name), 12)
+    if page_idx:
+        widths[0] = max(widths[0], max(len(fields[i].name) for i in page_idx))
+        widths[1] = max(widths[1], len("(All)"))
+
+    def sheet_rows():
+        row_number = 0
+
+        def row(cells):
+            return f'<row r="{row_number}">{"".join(cells)}</row>'
+
+        for i in page_idx:
+            row_number += 1
+            yield row([_cell_xml(f'A{row_number}', fields[i].name), _cell_xml(f'B{row_number}', "(All)")])
+        if page_idx:
+            row_number += 1
+            yield row([])
+
+        if n_data > 1:
+            row_number += 1
+            yield row([_cell_xml(f'{column_letter(n_rows)}{row_number}', "Values", style=1)])
+
+        row_number += 1
+        header = [_cell_xml(f'{column_letter(col)}{row_number}', fields[i].name, style=1)
+                  for col, i in enumerate(row_idx)]
+        header += [_cell_xml(f'{column_letter(n_rows + k)}{row_number}', name, style=1)
+                   for k, name in enumerate(data_names)]
+        yield row(header)
+
+        letters = [column_letter(c) for c in range(n_rows + n_data)]
+        repeated_cols = [fields[i].name in repeat for i in row_idx]
+        previous = None
+        for combo, sums in zip(_iter_rows(combos), _iter_rows(combo_sums)):
+            row_number += 1
+            cells = []
+            changed = previous is None
+            for col, (i, rank) in enumerate(zip(row_idx, combo)):
+                changed = changed or previous[col] != rank
+                if changed or repeated_cols[col]:
+                    cells.append(f'<c r="{letters[col]}{row_number}"{labels[i][rank]}')
+            for k in range(n_data):
+                cells.append(_cell_xml(f'{letters[n_rows + k]}{row_number}', sums[k]))
+            yield row(cells)
+            previous = combo
+
+    cols = ''.join(
+        f'<col min="{c + 1}" max="{c + 1}" width="{min(max(w, 8) + 2, 60)}" customWidth="1"/>'
+        for c, w in enumerate(widths)
+    )
+    with zf.open('xl/worksheets/sheet2.xml', 'w', force_zip64=True) as fh:
+        fh.write((XML_HEADER + f'<worksheet xmlns="{NS_MAIN}" xmlns:r="{NS_REL}"><cols>{cols}</cols>'
+                  '<sheetData>').encode('utf-8'))
+        _write_buffered(fh, sheet_rows())
+        fh.write(b'</sheetData></worksheet>')
+    zf.writestr('xl/worksheets/_rels/sheet2.xml.rels', _rels_xml([
+        ('rId1', 'pivotTable', '../pivotTables/pivotTable1.xml'),
+    ]))
+
+
+def _rels_xml(relations):
+    rels = ''.join(f'<Relationship Id="{rid}" Type="{REL_TYPE}{kind}" Target="{target}"/>'
+                   for rid, kind, target in relations)
+    return XML_HEADER + f'<Relationships xmlns="{NS_PKG_REL}">{rels}</Relationships>'
+
+
+def _write_package(zf, sheet_names, with_pivot):
+    overrides = [
+        ('/xl/workbook.xml', 'sheet.main+xml'),
+        ('/xl/styles.xml', 'styles+xml'),
+    ]
+    for n in range(1, len(sheet_names) + 1):
+        overrides.append((f'/xl/worksheets/sheet{n}.xml', 'worksheet+xml'))
+    if with_pivot:
+        overrides += [
+            ('/xl/pivotCache/pivotCacheDefinition1.xml', 'pivotCacheDefinition+xml'),
+            ('/xl/pivotCache/pivotCacheRecords1.xml', 'pivotCacheRecords+xml'),
+            ('/xl/pivotTables/pivotTable1.xml', 'pivotTable+xml'),
+        ]
+    zf.writestr('[Content_Types].xml', (
+        XML_HEADER +
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>' +
+        ''.join(f'<Override PartName="{part}" ContentType="{CT_PREFIX}{ct}"/>' for part, ct in overrides) +
+        '</Types>'
+    ))
+    zf.writestr('_rels/.rels', (
+        XML_HEADER +
+        f'<Relationships xmlns="{NS_PKG_REL}">'
+        f'<Relationship Id="rId1" Type="{REL_TYPE}officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ))
+
+    sheets = ''.join(f'<sheet name="{escape_xml(name)}" sheetId="{n}" r:id="rId{n}"/>'
+                     for n, name in enumerate(sheet_names, start=1))
+    relations = [(f'rId{n}', 'worksheet', f'worksheets/sheet{n}.xml') for n in range(1, len(sheet_names) + 1)]
+    relations.append((f'rId{len(sheet_names) + 1}', 'styles', 'styles.xml'))
+    pivot_caches = ''
+    if with_pivot:
+        cache_rid = f'rId{len(sheet_names) + 2}'
+        relations.append((cache_rid, 'pivotCacheDefinition', 'pivotCache/pivotCacheDefinition1.xml'))
+        pivot_caches = f'<pivotCaches><pivotCache cacheId="1" r:id="{cache_rid}"/></pivotCaches>'
+    zf.writestr('xl/workbook.xml', (
+        XML_HEADER +
+        f'<workbook xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+        f'<bookViews><workbookView activeTab="0"/></bookViews><sheets>{sheets}</sheets>{pivot_caches}'
+        '</workbook>'
+    ))
+    zf.writestr('xl/_rels/workbook.xml.rels', _rels_xml(relations))
+    zf.writestr('xl/styles.xml', _styles_xml())
+
+
+class StreamingXlsxWriter:
+    """
+    Writes an xlsx file chunk by chunk. Data rows go straight into the compressed
+    sheet as they arrive and pivot records are spilled to a temporary file. The
+    pivot sheet is built at close() from running aggregates that stay in memory:
+    the shared items of each column and the distinct row-field combinations (with
+    their data field sums). These grow with the distinct values, not the rows;
+    with summary_pivot_fields every column is a row field, so a statement whose
+    rows are all different keeps about one combination (a few int64 per column)
+    per row, plus every distinct cell value as a shared item.
+
+    pivot_fields is a dict like summary_pivot_fields() returns, a callable that
+    builds one from the column names, or None for a data-only workbook.
+    """
+
+    def __init__(self, output_path, pivot_fields=None, sheet_name="Sheet1",
+                 pivot_sheet_name="PivotTable", pivot_name="SummaryPivot"):
+        self.output_path = output_path
+        self.pivot_fields = pivot_fields
+        self.sheet_name = sheet_name
+        self.pivot_sheet_name = pivot_sheet_name
+        self.pivot_name = pivot_name
+        self.columns = None
+        self.row_count = 0
+
+        self._zf = zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._sheet = None
+        self._letters = []
+        self._spec = None
+        self._fields = None
+        self._records = None
+        self._row_idx = []
+        self._data_idx = []
+        self._combos = None
+        self._sums = None
+        self._combo_chunks = []
+        self._sum_chunks = []
+        self._pending_combos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _start(self, columns):
+        self.columns = list(columns)
+        self._letters = [column_letter(i) for i in range(len(self.columns))]
+
+        spec = self.pivot_fields(self.columns) if callable(self.pivot_fields) else self.pivot_fields
+        if spec is not None and self.columns:
+            self._spec = spec
+            self._fields = [PivotCacheField(name) for name in self.columns]
+            names = [f.name for f in self._fields]
+            self._row_idx = [names.index(n) for n in spec["rows"] if n in names]
+            self._data_idx = [names.index(n) for n in spec["data"] if n in names]
+            self._records = tempfile.TemporaryFile()
+
+        self._sheet = self._zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True)
+        header = ''.join(_cell_xml(f'{self._letters[j]}1', str(name), style=1) for j, name in enumerate(self.columns))
+        self._sheet.write((XML_HEADER + f'<worksheet xmlns="{NS_MAIN}"><sheetData>'
+                           f'<row r="1">{header}</row>').encode('utf-8'))
+
+    def write_chunk(self, df):
+        """
+        Appends the rows of a DataFrame. Later chunks are aligned to the first chunk's columns.
+        """
+        if self.columns is None:
+            self._start(df.columns)
+        elif list(df.columns) != self.columns:
+            df = df.reindex(columns=self.columns, fill_value='')
+        if len(df) == 0:
+            return
+
+        columns = [output_codes(df.iloc[:, j]) for j in range(len(self.columns))]
+        self._sheet.write(_rows_xml(columns, self._letters, self.row_count + 2).encode('utf-8'))
+        if self._fields is not None:
+            self._add_to_pivot(columns)
+        self.row_count += len(df)
+
+    def _add_to_pivot(self, columns):
+        codes = [field.add_codes(*column) for field, column in zip(self._fields, columns)]
+
+        # Records: one <x v="item"/> per field, pointing into the shared items
+        tag_columns = [[field.tags[c] for c in field_codes.tolist()] for field, field_codes in zip(self._fields, codes)]
+        _write_buffered(self._records, ('<r>' + ''.join(tags) + '</r>' for tags in zip(*tag_columns)))
+
+        # Aggregates of the chunk: distinct row-field combinations and their data
+        # sums, kept as arrays and merged into the running aggregates once they
+        # add up to as many combinations as those hold
+        if not self._row_idx:
+            return
+        stacked = np.column_stack([codes[i] for i in self._row_idx])
+        unique_combos, inverse = np.unique(stacked, axis=0, return_inverse=True)
+        inverse = np.asarray(inverse).reshape(-1)
+
+        sums = np.zeros((len(unique_combos), len(self._data_idx)))
+        for k, i in enumerate(self._data_idx):
+            values = np.asarray(self._fields[i].numbers)[codes[i]]
+            sums[:, k] = np.bincount(inverse, weights=values, minlength=len(unique_combos))
+        self._combo_chunks.append(unique_combos)
+        self._sum_chunks.append(sums)
+        self._pending_combos += len(unique_combos)
+        if self._combos is None or self._pending_combos >= len(self._combos):
+            self._merge_combos()
+
+    def _merge_combos(self):
+        """
+        Folds the pending chunk aggregates into the running ones. Merging only once
+        the pending combinations match the running ones keeps a combination that
+        repeats across chunks stored once, at a cost in proportion to the combinations added.
+        """
+        if self._combos is not None:
+            self._combo_chunks.insert(0, self._combos)
+            self._sum_chunks.insert(0, self._sums)
+        combos, inverse = np.unique(np.concatenate(self._combo_chunks), axis=0, return_inverse=True)
+        inverse = np.asarray(inverse).reshape(-1)
+        chunk_sums = np.concatenate(self._sum_chunks)
+        sums = np.zeros((len(combos), len(self._data_idx)))
+        for k in range(len(self._data_idx)):
+            sums[:, k] = np.bincount(inverse, weights=chunk_sums[:, k], minlength=len(combos))
+        self._combos, self._sums = combos, sums
+        self._combo_chunks, self._sum_chunks = [], []
+        self._pending_combos = 0
+
+    def _merged_combos(self):
+        """
+        Distinct row-field combinations of the whole file and their data sums.
+        """
+        if self._combo_chunks:
+            self._merge_combos()
+        if self._combos is None:
+            return np.zeros((0, len(self._row_idx)), dtype=np.int64), np.zeros((0, len(self._data_idx)))
+        combos, sums = self._combos, self._sums
+        self._combos, self._sums = None, None
+        return combos, sums
+
+    def close(self):
+        """
+        Finishes the data sheet, writes the pivot parts and the workbook package.
+        """
+        if self._zf is None:
+            return self.output_path
+        if self.columns is None:
+            self._start([])
+        self._sheet.write(b'</sheetData></worksheet>')
+        self._sheet.close()
+
+        with_pivot = self._fields is not None
+        sheet_names = [self.sheet_name, self.pivot_sheet_name] if with_pivot else [self.sheet_name]
+        zf = self._zf
+        if with_pivot:
+            source_ref = f'A1:{column_letter(len(self.columns) - 1)}{self.row_count + 1}'
+            zf.writestr('xl/pivotCache/pivotCacheDefinition1.xml',
+                        _pivot_cache_definition(self._fields, self.row_count, source_ref, self.sheet_name))
+            zf.writestr('xl/pivotCache/_rels/pivotCacheDefinition1.xml.rels', _rels_xml([
+                ('rId1', 'pivotCacheRecords', 'pivotCacheRecords1.xml'),
+            ]))
+            with zf.open('xl/pivotCache/pivotCacheRecords1.xml', 'w', force_zip64=True) as fh:
+                fh.write((XML_HEADER + f'<pivotCacheRecords xmlns="{NS_MAIN}" count="{self.row_count}">').encode('utf-8'))
+                self._records.seek(0)
+                shutil.copyfileobj(self._records, fh)
+                fh.write(b'</pivotCacheRecords>')
+            self._records.close()
+
+            _write_pivot_table(zf, self._fields, self._spec, self.pivot_name, *self._merged_combos())
+
+        _write_package(zf, sheet_names, with_pivot)
+        zf.close()
+        self._zf = None
+
+        if with_pivot:
+            print("📊 Pivot table generated successfully.")
+        return self.output_path
+
+    def abort(self):
+        """
+        Closes everything and removes the partial file.
+        """
+        if self._zf is None:
+            return
+        try:
+            if self._sheet is not None:
+                self._sheet.close()
+            if self._records is not None:
+                self._records.close()
+            self._zf.close()
+        finally:
+            self._zf = None
+            if os.path.exists(self.output_path):
+                os.remove(self.output_path)
+
+
+def write_excel_chunks(chunks, output_path, pivot_fields=None, sheet_name="Sheet1",
+                       pivot_sheet_name="PivotTable", pivot_name="SummaryPivot"):
+    """
+    Writes an iterable of DataFrame chunks to one xlsx file as they arrive.
+    """
+    with StreamingXlsxWriter(output_path, pivot_fields, sheet_name, pivot_sheet_name, pivot_name) as writer:
+        for chunk in chunks:
+            writer.write_chunk(chunk)
+    return output_path
+
+
+def write_excel_with_pivot(df, output_path, pivot_fields=None, sheet_name="Sheet1",
+                           pivot_sheet_name="PivotTable", pivot_name="SummaryPivot",
+                           chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Writes the DataFrame to an xlsx file, plus a PivotTable sheet built from it, in one pass.
+    pivot_fields is a dict with 'rows', 'repeat_labels', 'data' and 'pages' column lists
+    (see summary_pivot_fields); pass None to write the data sheet only.
+    """
+    chunks = (df.iloc[start:start + chunk_rows] for start in range(0, max(len(df), 1), chunk_rows))
+    return write_excel_chunks(chunks, output_path, pivot_fields, sheet_name, pivot_sheet_name, pivot_name)